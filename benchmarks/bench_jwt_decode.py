@@ -0,0 +1,31 @@
+"""
+Measures JWTManager.decode_token for a bearer token seen for the first time (full signature check)
+and for a token already in the verified-claims cache.
+
+Run from the project root:
+    python -m benchmarks.bench_jwt_decode
+"""
+import timeit
+
+from src.services.auth import JWTManager
+
+ROUNDS = 20000
+
+
+def main():
+    cold = JWTManager("secret key", "HS256", cache_size=0)
+    warm = JWTManager("secret key", "HS256")
+    token = warm.create_token({"sub": "deadpool@example.com"}, "refresh_token", 604800)
+    warm.decode_token(token)
+
+    cold_time = timeit.timeit(lambda: cold.decode_token(token), number=ROUNDS) / ROUNDS
+    warm_time = timeit.timeit(lambda: warm.decode_token(token), number=ROUNDS) / ROUNDS
+
+    print(f"{'decode':<10}{'us/call':>10}")
+    print(f"{'verify':<10}{cold_time * 1e6:>10.2f}")
+    print(f"{'cached':<10}{warm_time * 1e6:>10.2f}")
+    print(f"speedup: {cold_time / warm_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
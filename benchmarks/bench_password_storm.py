@@ -0,0 +1,83 @@
+"""
+Measures the latency of an unrelated endpoint while a burst of logins verifies bcrypt passwords,
+once with verification on the event loop and once on the PasswordManager thread pool.
+
+Run from the project root:
+    python -m benchmarks.bench_password_storm
+"""
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from src.services.auth import PasswordManager
+
+LOGINS = 40
+PINGS = 200
+PING_INTERVAL = 0.01
+LOGIN_INTERVAL = 0.05
+
+password_manager = PasswordManager(max_workers=4)
+password_hash = password_manager.get_password_hash("123456789")
+
+app = FastAPI()
+
+
+@app.post("/login/blocking")
+async def login_blocking():
+    return {"ok": password_manager.verify_password("123456789", password_hash)}
+
+
+@app.post("/login/executor")
+async def login_executor():
+    return {"ok": await password_manager.verify_password_async("123456789", password_hash)}
+
+
+@app.get("/ping")
+async def ping():
+    return {"ok": True}
+
+
+async def ping_latencies(client: httpx.AsyncClient) -> list:
+    # Pings are due on a fixed schedule, so time spent waiting for a stalled event loop is counted.
+    latencies = []
+    started = time.perf_counter()
+    for i in range(PINGS):
+        due = started + i * PING_INTERVAL
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await client.get("/ping")
+        latencies.append(time.perf_counter() - due)
+    return latencies
+
+
+async def login_storm(client: httpx.AsyncClient, path: str):
+    # Logins arrive spread over the ping window, like a burst of users signing in.
+    requests = []
+    for _ in range(LOGINS):
+        requests.append(asyncio.create_task(client.post(path)))
+        await asyncio.sleep(LOGIN_INTERVAL)
+    await asyncio.gather(*requests)
+
+
+async def storm(client: httpx.AsyncClient, path: str):
+    started = time.perf_counter()
+    latencies, _ = await asyncio.gather(ping_latencies(client), login_storm(client, path))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{path:<18}{p50:>10.2f}{p99:>10.2f}{latencies[-1] * 1000:>10.2f}{elapsed:>10.2f}")
+
+
+async def main():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'mode':<18}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'total s':>10}")
+        await storm(client, "/login/blocking")
+        await storm(client, "/login/executor")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
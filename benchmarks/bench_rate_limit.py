@@ -0,0 +1,114 @@
+"""
+Compares fastapi_limiter's RateLimiter, one Lua call in Redis per request, with HybridRateLimiter,
+which spends tokens leased in batches: request latency and Redis commands per request, for a
+strict, a default and a generous route limit.
+
+Every simulated client spends exactly its budget, so every request should be allowed. Commands
+are counted by the client, so the numbers match between a real Redis and fakeredis.
+
+Needs the Redis server from docker-compose (or REDIS_HOST/REDIS_PORT/REDIS_PASSWORD in .env), or
+pass --fakeredis to run against an in-process fakeredis TCP server (needs lupa for Lua scripts).
+Run from the project root:
+    python -m benchmarks.bench_rate_limit [--fakeredis]
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import redis.asyncio as redis
+from fastapi import Depends, FastAPI
+from fastapi_limiter import FastAPILimiter
+from fastapi_limiter.depends import RateLimiter
+
+from src.conf.config import redis_config
+from src.services.rate_limit import HybridRateLimiter
+
+CONCURRENCY = 20
+LIMITS = (5, 10, 120)
+
+
+class CountingRedis(redis.Redis):
+    """
+    Redis client counting the commands it sends.
+    """
+    commands = 0
+
+    async def execute_command(self, *args, **options):
+        CountingRedis.commands += 1
+        return await super().execute_command(*args, **options)
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    for times in LIMITS:
+        limiters = {"redis": RateLimiter(times=times, seconds=60),
+                    "lease1": HybridRateLimiter(times=times, seconds=60, lease=1),
+                    "hybrid": HybridRateLimiter(times=times, seconds=60)}
+        for name, limiter in limiters.items():
+            app.add_api_route(f"/{name}/{times}", lambda: {"ok": True}, dependencies=[Depends(limiter)])
+    return app
+
+
+async def run(client: httpx.AsyncClient, r: redis.Redis, path: str, times: int):
+    await r.flushdb()
+    latencies, statuses = [], []
+
+    async def user(user_id: int):
+        # Every simulated client has its own address, so requests are spread over CONCURRENCY keys.
+        for _ in range(times):
+            started = time.perf_counter()
+            response = await client.get(path, headers={"X-Forwarded-For": f"10.0.0.{user_id}"})
+            latencies.append(time.perf_counter() - started)
+            statuses.append(response.status_code)
+
+    before = CountingRedis.commands
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - started
+    used = CountingRedis.commands - before
+    latencies.sort()
+    return (len(latencies) / elapsed, statistics.mean(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, used / len(latencies), statuses.count(200))
+
+
+def start_fakeredis():
+    from fakeredis import TcpFakeServer
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, port
+
+
+async def main(fake: bool):
+    server = None
+    if fake:
+        server, port = start_fakeredis()
+        r = CountingRedis(host="127.0.0.1", port=port)
+    else:
+        r = CountingRedis(host=redis_config.host, port=redis_config.port, password=redis_config.password)
+    await FastAPILimiter.init(r)
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'limit':>6}  {'limiter':<8}{'lease':>6}{'req/s':>8}{'avg ms':>9}{'p99 ms':>9}"
+              f"{'cmds/req':>10}{'allowed':>9}")
+        for times in LIMITS:
+            for name, lease in (("redis", "-"), ("lease1", 1), ("hybrid", HybridRateLimiter().lease_size(times))):
+                rps, avg, p99, per_request, allowed = await run(client, r, f"/{name}/{times}", times)
+                print(f"{times:>6}  {name:<8}{lease:>6}{rps:>8.0f}{avg:>9.2f}{p99:>9.2f}"
+                      f"{per_request:>10.2f}{allowed:>5}/{CONCURRENCY * times}")
+    await r.aclose()
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fakeredis", action="store_true", help="run against an in-process fakeredis server")
+    asyncio.run(main(parser.parse_args().fakeredis))
@@ -0,0 +1,40 @@
+"""
+Compares the pickled ORM user previously stored in Redis with the versioned JSON record
+written by src.services.user_cache: payload size and per-request decode cost.
+
+Run from the project root:
+    python -m benchmarks.bench_user_cache
+"""
+import pickle
+import timeit
+from datetime import datetime
+
+from src.database.models import User
+from src.services.user_cache import CACHE_SCHEMA_VERSION, encode_user, decode_record, user_from_record
+
+ROUNDS = 20000
+
+
+def make_user() -> User:
+    return User(id=42, name="deadpool", surname="wilson", email="deadpool@example.com", phone="1234567890",
+                password="$2b$12$" + "x" * 53, refresh_token="r" * 180, confirmed=True,
+                avatar="https://res.cloudinary.com/demo/image/upload/c_fill,h_250,w_250/v1/NotesApp/deadpool",
+                plan="free", created_at=datetime.now())
+
+
+def main():
+    user = make_user()
+    pickled = pickle.dumps(user)
+    encoded = encode_user(user)
+
+    pickle_load = timeit.timeit(lambda: pickle.loads(pickled), number=ROUNDS) / ROUNDS
+    record_load = timeit.timeit(lambda: user_from_record(decode_record(encoded)), number=ROUNDS) / ROUNDS
+
+    print(f"{'encoding':<12}{'bytes':>8}{'load us':>10}")
+    print(f"{'pickle':<12}{len(pickled):>8}{pickle_load * 1e6:>10.1f}")
+    print(f"{f'json v{CACHE_SCHEMA_VERSION}':<12}{len(encoded):>8}{record_load * 1e6:>10.1f}")
+    print(f"size saved: {1 - len(encoded) / len(pickled):.0%}, load speedup: {pickle_load / record_load:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 from fastapi import FastAPI
-import redis.asyncio as redis
 from fastapi_limiter import FastAPILimiter
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 
-from src.conf.config import redis_config
-from src.routes import users, contacts, auth
+from src.conf.config import settings
+from src.database.db import redis_sessionmanager, sessionmanager
+from src.services.invalidation import invalidation_bus
+from src.services.rate_limit import user_identifier
+from src.routes import users, contacts, auth, metrics
 
 app = FastAPI()
 
@@ -21,17 +24,33 @@ app.add_middleware(
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(contacts.router)
+app.include_router(metrics.router)
+if settings.avatar_storage == "local":
+    app.mount(settings.avatar_local_url, StaticFiles(directory=settings.avatar_local_dir, check_dir=False),
+              name="avatars")
 
 
 @app.on_event("startup")
 async def startup():
     """
-    Function to initialize Redis and FastAPILimiter on application startup.
+    Function to initialize FastAPILimiter on the shared Redis client with per-user rate limit keys,
+    to start listening for cache invalidations and to start the read replica health checks on
+    application startup.
     """
-    r = await redis.Redis(host=redis_config.host, password=redis_config.password, port=redis_config.port,
-                          db=0, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(r)
+    await FastAPILimiter.init(redis_sessionmanager.redis, identifier=user_identifier)
+    invalidation_bus.start()
+    sessionmanager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Function to stop the invalidation listener and close the database pools and the shared Redis client
+    on application shutdown.
+    """
+    await invalidation_bus.stop()
+    await sessionmanager.close()
+    await redis_sessionmanager.close()
 
 
 @app.get("/")
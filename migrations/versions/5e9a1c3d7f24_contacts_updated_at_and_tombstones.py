@@ -0,0 +1,31 @@
+"""'Contacts updated_at and deleted_at tombstones'
+
+Revision ID: 5e9a1c3d7f24
+Revises: c47e2a9d5b81
+Create Date: 2026-10-18 12:40:12.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a1c3d7f24'
+down_revision = 'c47e2a9d5b81'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Backfill in UTC like the utcnow() default of the model; now() is in the session time zone.
+    op.add_column('contacts', sa.Column('updated_at', sa.DateTime(),
+                                        server_default=sa.text("timezone('utc', now())"), nullable=False))
+    op.alter_column('contacts', 'updated_at', server_default=None)
+    op.add_column('contacts', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_contacts_user_id_updated_at_id', 'contacts', ['user_id', 'updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_updated_at_id', table_name='contacts')
+    op.drop_column('contacts', 'deleted_at')
+    op.drop_column('contacts', 'updated_at')
@@ -0,0 +1,29 @@
+"""'Contacts birthday month/day index'
+
+Revision ID: 8b2d4e6f1a33
+Revises: 3f1c9a7b2e10
+Create Date: 2026-10-18 10:05:47.218904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e6f1a33'
+down_revision = '3f1c9a7b2e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_contacts_user_id_birthday_md',
+        'contacts',
+        ['user_id', sa.text('(EXTRACT(month FROM birthday) * 100 + EXTRACT(day FROM birthday))')],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_birthday_md', table_name='contacts')
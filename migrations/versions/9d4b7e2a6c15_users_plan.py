@@ -0,0 +1,24 @@
+"""'Users rate limit plan'
+
+Revision ID: 9d4b7e2a6c15
+Revises: 5e9a1c3d7f24
+Create Date: 2026-10-18 14:05:37.604219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b7e2a6c15'
+down_revision = '5e9a1c3d7f24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('plan', sa.String(length=20), server_default='free', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'plan')
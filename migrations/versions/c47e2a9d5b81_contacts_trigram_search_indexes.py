@@ -0,0 +1,32 @@
+"""'Contacts trigram search indexes'
+
+Revision ID: c47e2a9d5b81
+Revises: 8b2d4e6f1a33
+Create Date: 2026-10-18 11:20:03.655120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2a9d5b81'
+down_revision = '8b2d4e6f1a33'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_contacts_name_trgm', 'contacts', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_contacts_surname_trgm', 'contacts', ['surname'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'surname': 'gin_trgm_ops'})
+    op.create_index('ix_contacts_email_trgm', 'contacts', ['email'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_email_trgm', table_name='contacts')
+    op.drop_index('ix_contacts_surname_trgm', table_name='contacts')
+    op.drop_index('ix_contacts_name_trgm', table_name='contacts')
@@ -1,44 +1,257 @@
+import asyncio
 import contextlib
-import redis
-from typing import AsyncIterator
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import redis.asyncio as redis
+from sqlalchemy import exc, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.conf.config import config, redis_config, settings
 
-from src.conf.config import config, redis_config
+logger = logging.getLogger(__name__)
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class PoolMetrics:
+    """
+    Checkout wait time statistics of a connection pool.
+    """
+    def __init__(self, window: int = 1000):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def record(self, wait: float) -> None:
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self._recent.append(wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = sorted(self._recent)
+
+        def percentile(q: float) -> float:
+            return recent[min(len(recent) - 1, int(len(recent) * q))] * 1000 if recent else 0.0
+
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+            "wait_p50_ms": percentile(0.5),
+            "wait_p95_ms": percentile(0.95),
+            "wait_p99_ms": percentile(0.99),
+        }
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool recording how long every connection checkout waits.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """
+    Builds the engine keyword arguments for a database url from the pool settings.
+
+    :param url: The database url.
+    :type url: str
+    :return: create_async_engine keyword arguments.
+    :rtype: dict
+    """
+    options = dict(
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle,
+    )
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {"statement_cache_size": settings.db_statement_cache_size}
+    return options
+
+
+class ReplicaSet:
+    """
+    Round-robin selection over the read replicas that passed their last health check.
+    """
+    def __init__(self, engines: List[AsyncEngine], check_interval: float = 5, check_timeout: float = 2):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._healthy: List[AsyncEngine] = list(engines)
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def choose(self) -> Optional[AsyncEngine]:
+        healthy = self._healthy
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    async def _ping(self, engine: AsyncEngine) -> bool:
+        try:
+            async with engine.connect() as connection:
+                await asyncio.wait_for(connection.execute(text("SELECT 1")), self.check_timeout)
+            return True
+        except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError) as err:
+            logger.warning("Read replica %s failed its health check: %s", engine.url.render_as_string(), err)
+            return False
+
+    async def check(self) -> None:
+        """
+        Pings every replica and keeps only the ones that answered in the rotation.
+        """
+        results = await asyncio.gather(*(self._ping(engine) for engine in self.engines))
+        self._healthy = [engine for engine, healthy in zip(self.engines, results) if healthy]
+
+    async def run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class RoutingSession(Session):
+    """
+    Session sending statements marked with ``execution_options(replica=True)`` to a read replica.
+
+    Once the session has flushed or executed an INSERT, UPDATE or DELETE it stays on the primary,
+    so a request always reads its own writes.
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replicas: Optional[ReplicaSet] = self.info.get("replicas")
+        if self._flushing or (clause is not None and clause.is_dml):
+            self.info["wrote"] = True
+        elif (replicas is not None and clause is not None and not self.info.get("wrote")
+              and clause.get_execution_options().get("replica")):
+            engine = replicas.choose()
+            if engine is not None:
+                return engine.sync_engine
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
 class DatabaseSessionManager:
 
-    def __init__(self, url: str):
-        self._engine: AsyncEngine | None = create_async_engine(url)
+    def __init__(self, url: str, replica_urls: Iterable[str] = (), replica_check_interval: float = 5,
+                 **engine_kwargs):
+        self._engine: AsyncEngine | None = create_async_engine(url, **engine_kwargs)
+        replicas = [create_async_engine(replica_url, **engine_kwargs) for replica_url in replica_urls]
+        self.replicas: Optional[ReplicaSet] = ReplicaSet(replicas, replica_check_interval) if replicas else None
         self._session_maker: async_sessionmaker | None = async_sessionmaker(autocommit=False, autoflush=False,
-                                                                            bind=self._engine)
+                                                                            expire_on_commit=False,
+                                                                            bind=self._engine,
+                                                                            sync_session_class=RoutingSession,
+                                                                            info={"replicas": self.replicas})
+
+    def start(self) -> None:
+        """
+        Starts the periodic health checks of the read replicas.
+        """
+        if self.replicas is not None:
+            self.replicas.start()
+
+    async def close(self) -> None:
+        """
+        Stops the replica health checks and closes every connection pool.
+        """
+        if self.replicas is not None:
+            await self.replicas.stop()
+            for engine in self.replicas.engines:
+                await engine.dispose()
+        await self._engine.dispose()
+
+    def pool_status(self) -> Dict[str, Any]:
+        """
+        Reports the occupancy of the connection pool and, for instrumented pools, checkout wait times.
+
+        :return: Pool statistics.
+        :rtype: dict
+        """
+        pool = self._engine.pool
+        status = {"size": pool.size(), "checked_in": pool.checkedin(), "checked_out": pool.checkedout(),
+                  "overflow": pool.overflow()} if hasattr(pool, "checkedout") else {}
+        metrics = getattr(pool, "metrics", None)
+        if metrics is not None:
+            status.update(metrics.snapshot())
+        return status
 
     @contextlib.asynccontextmanager
     async def session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Provides a session that is rolled back if the block raises and always closed on exit,
+        returning its connection to the pool. Errors propagate to the caller.
+        """
         if self._session_maker is None:
             raise Exception("DatabaseSessionManager is not initialised")
         session = self._session_maker()
         try:
             yield session
-        except Exception as error:
-            print(error)
+        except Exception:
             await session.rollback()
+            raise
         finally:
-            session.close()
+            await session.close()
 
 
 class RedisSessionManager:
+    """
+    Holds the application wide asyncio Redis client. Connections are opened lazily on first use.
+    Responses are kept as bytes so binary cache payloads round-trip unchanged.
+    """
     def __init__(self, r):
-        self.redis = redis.Redis(host=r.host, port=r.port, password=r.password, db=0, encoding="utf-8",
-                                 decode_responses=True)
+        self.redis = redis.Redis(host=r.host, port=r.port, password=r.password, db=0)
+
+    async def close(self):
+        await self.redis.close()
 
 
-sessionmanager = DatabaseSessionManager(config.DB_URL)
+sessionmanager = DatabaseSessionManager(config.DB_URL, replica_urls=config.REPLICA_URLS,
+                                        replica_check_interval=settings.db_replica_check_interval,
+                                        **engine_options(config.DB_URL))
 redis_sessionmanager = RedisSessionManager(redis_config)
 
 
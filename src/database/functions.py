@@ -0,0 +1,74 @@
+"""
+Module Name: functions.py
+Description: SQL functions with a PostgreSQL implementation and a portable fallback.
+
+``similarity`` ranks text matches. On PostgreSQL it is pg_trgm's trigram similarity, which pairs with
+the GIN trigram indexes on contacts. Other dialects (SQLite in tests) get a CASE expression that
+scores exact, prefix and substring matches, so queries keep the same shape and ordering semantics.
+
+``utcnow`` is the current UTC time by the database clock, so timestamps written by different
+application servers are ordered by a single clock.
+"""
+from sqlalchemy import DateTime, Float
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import GenericFunction
+
+
+class similarity(GenericFunction):
+    """
+    similarity(text, term) -> a relevance score between 0 and 1.
+    """
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(similarity)
+def _compile_similarity(element, compiler, **kw):
+    text, term = [compiler.process(argument, **kw) for argument in element.clauses]
+    return (f"(CASE WHEN lower({text}) = lower({term}) THEN 1.0 "
+            f"WHEN lower({text}) LIKE lower({term}) || '%' THEN 0.6 "
+            f"WHEN lower({text}) LIKE '%' || lower({term}) || '%' THEN 0.3 "
+            f"ELSE 0.0 END)")
+
+
+@compiles(similarity, "postgresql")
+def _compile_similarity_postgresql(element, compiler, **kw):
+    return f"similarity({compiler.process(element.clauses, **kw)})"
+
+
+class utcnow(GenericFunction):
+    """
+    utcnow() -> the current time in UTC by the database clock, without a time zone.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _compile_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "sqlite")
+def _compile_utcnow_sqlite(element, compiler, **kw):
+    # Microseconds, like the text SQLAlchemy stores for datetimes, so the two compare correctly.
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+@compiles(utcnow, "postgresql")
+def _compile_utcnow_postgresql(element, compiler, **kw):
+    # clock_timestamp() rather than now(): the statement time, not the start of its transaction.
+    return "TIMEZONE('utc', CLOCK_TIMESTAMP())"
+
+
+def like_pattern(term: str) -> str:
+    """
+    Builds a ``%term%`` pattern with LIKE wildcards in the term escaped by a backslash.
+
+    :param term: The text to search for.
+    :type term: str
+    :return: The LIKE pattern.
+    :rtype: str
+    """
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
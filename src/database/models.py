@@ -1,9 +1,10 @@
-from datetime import date
+from datetime import date, datetime
 from sqlalchemy.sql.sqltypes import DateTime
-from sqlalchemy import String, ForeignKey, func, Date
+from sqlalchemy import String, ForeignKey, func, Date, Index, Integer, extract, literal_column
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.database.db import Base
+from src.database.functions import utcnow
 
 
 class User(Base):
@@ -17,6 +18,8 @@ class User(Base):
     refresh_token: Mapped[str] = mapped_column(String(255), nullable=True)
     confirmed: Mapped[bool] = mapped_column(default=False)
     avatar: Mapped[str] = mapped_column(String(255), nullable=True)
+    # Rate limit tier, see Settings.rate_limit_plans.
+    plan: Mapped[str] = mapped_column(String(20), default="free", server_default="free", nullable=False)
     created_at: Mapped[date] = mapped_column('crated_at', DateTime, default=func.now(), nullable=True)
 
 
@@ -30,4 +33,30 @@ class Contact(Base):
     phone: Mapped[str] = mapped_column(String(16), unique=True, index=True, nullable=True)
     email: Mapped[str] = mapped_column(String(150), index=True, nullable=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # Set from the database clock on every write, the same clock the change feed cut-off uses.
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), onupdate=utcnow(), nullable=False)
+    # Tombstone: deleted contacts are kept so the change feed can report the deletion.
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     user = relationship(User, backref="contacts")
+
+    __table_args__ = (
+        Index("ix_contacts_user_id_id", "user_id", "id"),
+        Index("ix_contacts_user_id_updated_at_id", "user_id", "updated_at", "id"),
+    )
+
+
+# Birthday as a month * 100 + day number (e.g. 1231 for 31 December), year independent.
+# Backed by an expression index so upcoming birthdays are looked up without a table scan.
+birthday_month_day = (extract("month", Contact.birthday) * literal_column("100", Integer)
+                      + extract("day", Contact.birthday))
+
+Index("ix_contacts_user_id_birthday_md", Contact.user_id, birthday_month_day)
+
+# Trigram indexes serve ILIKE '%term%' contact searches. They need the pg_trgm extension
+# and are only created on PostgreSQL.
+Index("ix_contacts_name_trgm", Contact.name, postgresql_using="gin",
+      postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+Index("ix_contacts_surname_trgm", Contact.surname, postgresql_using="gin",
+      postgresql_ops={"surname": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+Index("ix_contacts_email_trgm", Contact.email, postgresql_using="gin",
+      postgresql_ops={"email": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
@@ -1,14 +1,23 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Sequence, Tuple
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_
+from sqlalchemy import select, insert, update, or_, and_, case, literal, tuple_, Row
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
-from src.database.models import Contact, User
+from src.database.functions import similarity, like_pattern, utcnow
+from src.database.models import Contact, User, birthday_month_day
 from src.schemas import ContactResponse
+from src.services.autocomplete import autocomplete_index
+from src.services.contact_cache import contact_cache
 
 
-async def get_contacts(limit: int, offset: int, db: AsyncSession, user: User):
+async def get_contacts(limit: int, offset: int, db: AsyncSession, user: User, after_id: int | None = None):
     """
-    Retrieves a list of contacts for a specified user.
+    Retrieves a list of contacts for a specified user ordered by id.
+
+    When ``after_id`` is given the page starts right after that contact (keyset pagination) and
+    ``offset`` is ignored, so every page costs the same no matter how deep it is.
 
     :param limit: The maximum number of contacts to retrieve.
     :type limit: int
@@ -18,11 +27,19 @@ async def get_contacts(limit: int, offset: int, db: AsyncSession, user: User):
     :type db: AsyncSession
     :param user: The User instance representing the user.
     :type user: User
+    :param after_id: The id of the last contact of the previous page.
+    :type after_id: int | None
     :return: A list of Contact instances.
     :rtype: list
     """
 
-    sq = select(Contact).filter_by(user=user).offset(offset).limit(limit)
+    # Read from the primary: pages are cached under the current contacts version, and a lagging
+    # replica would keep a stale page there after a write.
+    sq = select(Contact).filter_by(user=user, deleted_at=None).order_by(Contact.id).limit(limit)
+    if after_id is not None:
+        sq = sq.filter(Contact.id > after_id)
+    else:
+        sq = sq.offset(offset)
     contacts = await db.execute(sq)
     return contacts.scalars().all()
 
@@ -41,7 +58,8 @@ async def get_contact(contact_id: int, db: AsyncSession, user: User):
     :rtype: Contact or None
     """
 
-    sq = select(Contact).filter_by(id=contact_id, user=user)
+    # Read from the primary, like get_contacts, because the result is cached.
+    sq = select(Contact).filter_by(id=contact_id, user=user, deleted_at=None)
     contact = await db.execute(sq)
     return contact.scalar_one_or_none()
 
@@ -60,25 +78,26 @@ async def create_contact(body: ContactResponse, db: AsyncSession, user: User):
     :rtype: Contact or None
     """
 
+    values = dict(name=body.name, surname=body.surname, birthday=body.birthday, phone=body.phone, email=body.email,
+                  description=body.description, user_id=user.id)
     try:
-        contact = Contact(name=body.name, surname=body.surname, birthday=body.birthday, phone=body.phone,
-                          email=body.email,
-                          user=user)
-        if body.description:
-            contact.description = body.description
-        db.add(contact)
+        result = await db.execute(insert(Contact).values(**values).returning(Contact))
+        contact = result.scalar_one()
         await db.commit()
-        await db.refresh(contact)
-        return contact
-    except IntegrityError as e:
+    except IntegrityError:
         await db.rollback()
         return None
+    await contact_cache.bump(user.id)
+    await autocomplete_index.contact_changed(user.id, (contact.id, contact.name, contact.surname, contact.email))
+    return contact
 
 
 async def update_contact(contact_id: int, body: ContactResponse, db: AsyncSession, user: User):
     """
     Updates an existing contact's information.
 
+    The contact is updated and read back with a single UPDATE ... RETURNING scoped to the user.
+
     :param contact_id: The ID of the contact to update.
     :type contact_id: int
     :param body: ContactResponse instance containing updated contact information.
@@ -91,24 +110,25 @@ async def update_contact(contact_id: int, body: ContactResponse, db: AsyncSessio
     :rtype: Contact or None
     """
 
-    sq = select(Contact).filter_by(id=contact_id, user=user)
+    sq = (update(Contact).filter_by(id=contact_id, user_id=user.id, deleted_at=None)
+          .values(name=body.name, surname=body.surname, phone=body.phone, email=body.email,
+                  description=body.description)
+          .returning(Contact))
     result = await db.execute(sq)
     contact = result.scalar_one_or_none()
+    await db.commit()
     if contact:
-        contact.name = body.name
-        contact.surname = body.surname
-        contact.phone = body.phone
-        contact.email = body.email
-        contact.user = user
-        contact.description = body.description
-        await db.commit()
-        await db.refresh(contact)
+        await contact_cache.bump(user.id)
+        await autocomplete_index.contact_changed(user.id, (contact.id, contact.name, contact.surname, contact.email))
     return contact
 
 
 async def remove_contact(contact_id: int, db: AsyncSession, user: User):
     """
-    Removes a contact from the database.
+    Removes a contact with a single UPDATE ... RETURNING scoped to the user.
+
+    The row is kept as a tombstone for the change feed: it gets a ``deleted_at`` time and its phone
+    number is released so it can be used by another contact.
 
     :param contact_id: The ID of the contact to remove.
     :type contact_id: int
@@ -120,22 +140,149 @@ async def remove_contact(contact_id: int, db: AsyncSession, user: User):
     :rtype: Contact
     """
 
-    sq = select(Contact).filter_by(id=contact_id, user=user)
+    sq = (update(Contact).filter_by(id=contact_id, user_id=user.id, deleted_at=None)
+          .values(deleted_at=utcnow(), updated_at=utcnow(), phone=None)
+          .returning(Contact))
     result = await db.execute(sq)
     contact = result.scalar_one_or_none()
+    await db.commit()
     if contact:
-        await db.delete(contact)
-        await db.commit()
+        await contact_cache.bump(user.id)
+        await autocomplete_index.contact_removed(user.id, contact_id)
     return contact
 
 
+async def insert_contacts(rows: List[Dict[str, Any]], db: AsyncSession, user: User) -> List[str | None]:
+    """
+    Inserts many contacts of a user, skipping those whose phone number is already taken.
+
+    The rows are sent as multi-row INSERT ... ON CONFLICT (phone) DO NOTHING RETURNING statements,
+    so a conflicting row neither aborts the batch nor costs a round trip of its own.
+
+    :param rows: The contact values, every row with the same keys.
+    :type rows: list
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :param user: The User instance representing the user.
+    :type user: User
+    :return: The phone numbers of the inserted contacts (None for contacts without a phone).
+    :rtype: list
+    """
+
+    if not rows:
+        return []
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}[db.get_bind().dialect.name]
+    sq = (dialect.insert(Contact.__table__)
+          .on_conflict_do_nothing(index_elements=[Contact.phone])
+          .returning(Contact.phone))
+    result = await db.execute(sq, [{**row, "user_id": user.id} for row in rows])
+    await db.commit()
+    await contact_cache.bump(user.id)
+    await autocomplete_index.contacts_reloaded(user.id)
+    return list(result.scalars().all())
+
+
+async def stream_contacts(user: User, db: AsyncSession, batch_size: int = 1000) -> AsyncIterator[Sequence[Row]]:
+    """
+    Streams all contacts of a user in id order, ``batch_size`` contacts at a time.
+
+    Rows are fetched through a server side cursor where the driver supports it and are plain column
+    rows rather than ORM instances, so nothing accumulates in the session and memory use does not
+    grow with the number of contacts.
+
+    :param user: The User instance representing the user.
+    :type user: User
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :param batch_size: The number of contacts fetched per round trip.
+    :type batch_size: int
+    :return: An async iterator of lists of rows with the contact columns.
+    :rtype: AsyncIterator
+    """
+
+    sq = (select(*Contact.__table__.c).filter_by(user_id=user.id, deleted_at=None).order_by(Contact.id)
+          .execution_options(yield_per=batch_size, replica=True))
+    result = await db.stream(sq)
+    async for partition in result.partitions():
+        yield partition
+
+
+async def database_time(db: AsyncSession) -> datetime:
+    """
+    Reads the current UTC time from the database clock, the clock that stamps ``updated_at``.
+
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: The current time, without a time zone.
+    :rtype: datetime
+    """
+    return (await db.execute(select(utcnow()))).scalar_one()
+
+
+async def get_contact_changes(user: User, db: AsyncSession, until: datetime, limit: int = 100,
+                              since: Tuple[datetime, int] | None = None):
+    """
+    Retrieves the contacts of a user changed or deleted after a sync position, oldest change first.
+
+    Changes are paginated by keyset on (updated_at, id), which the (user_id, updated_at, id) index
+    serves, so a sync reads only the changed rows however large the contact book is. Without
+    ``since`` the live contacts are returned, as a full first sync. The query runs on the primary:
+    a lagging replica could hide a change behind a position the client has already passed.
+
+    :param user: The User instance representing the user.
+    :type user: User
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :param until: Changes made after this time, by the database clock, are left for the next sync.
+    :type until: datetime
+    :param limit: The maximum number of contacts to retrieve.
+    :type limit: int
+    :param since: The updated_at and id of the last change the client has seen.
+    :type since: tuple | None
+    :return: A list of Contact instances, deleted ones with ``deleted_at`` set.
+    :rtype: list
+    """
+
+    sq = select(Contact).filter_by(user_id=user.id).filter(Contact.updated_at <= until)
+    if since is not None:
+        sq = sq.filter(tuple_(Contact.updated_at, Contact.id) > tuple_(*since))
+    else:
+        sq = sq.filter(Contact.deleted_at.is_(None))
+    sq = sq.order_by(Contact.updated_at, Contact.id).limit(limit)
+    result = await db.execute(sq)
+    return result.scalars().all()
+
+
+async def get_contact_suggestions(user: User, db: AsyncSession):
+    """
+    Retrieves the searchable fields of every contact of a user for the autocomplete index.
+
+    :param user: The User instance representing the user.
+    :type user: User
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: A list of (id, name, surname, email) tuples.
+    :rtype: list
+    """
+
+    sq = select(Contact.id, Contact.name, Contact.surname, Contact.email).filter_by(user=user, deleted_at=None)
+    result = await db.execute(sq)
+    return [tuple(row) for row in result.all()]
+
+
 async def search_contact(user: User,
                          db: AsyncSession,
                          contact_name: str,
                          surname: str,
-                         email: str):
+                         email: str,
+                         limit: int = 10,
+                         after: Tuple[float, int] | None = None):
     """
-    Searches for a contact based on the provided criteria.
+    Searches for contacts matching all of the provided criteria, best match first.
+
+    Every supplied field must match with ILIKE '%term%', which the trigram indexes serve on PostgreSQL.
+    Matches are ranked by the sum of the per field trigram similarity (a portable exact/prefix/substring
+    score on other databases) and paginated by keyset on (rank, id).
 
     :param user: The User instance representing the user.
     :type user: User
@@ -147,44 +294,60 @@ async def search_contact(user: User,
     :type surname: str
     :param email: The email of the contact to search for.
     :type email: str
-    :return: The first matching Contact instance or None if no match is found.
-    :rtype: Contact or None
+    :param limit: The maximum number of contacts to retrieve.
+    :type limit: int
+    :param after: The rank and id of the last contact of the previous page.
+    :type after: tuple | None
+    :return: A list of (Contact, rank) rows.
+    :rtype: list
     """
 
-    sq = select(Contact).filter_by(user=user)
-    if contact_name:
-        sq = sq.filter(or_(Contact.name.ilike(f'%{contact_name}%')))
-    elif surname:
-        sq = sq.filter(or_(Contact.surname.ilike(f'%{surname}%')))
-    elif email:
-        sq = sq.filter(or_(Contact.email.ilike(f'%{email}%')))
+    criteria = [(column, term) for column, term in
+                ((Contact.name, contact_name), (Contact.surname, surname), (Contact.email, email)) if term]
+    rank = sum((similarity(column, term) for column, term in criteria), literal(0.0)).label("rank")
+    sq = select(Contact, rank).filter_by(user=user, deleted_at=None).execution_options(replica=True)
+    for column, term in criteria:
+        sq = sq.filter(column.ilike(like_pattern(term), escape="\\"))
+    if after is not None:
+        after_rank, after_id = after
+        sq = sq.filter(or_(rank < after_rank, and_(rank == after_rank, Contact.id > after_id)))
+    sq = sq.order_by(rank.desc(), Contact.id).limit(limit)
 
     result = await db.execute(sq)
-    contact_found = result.scalars().first()
-    return contact_found
+    return result.all()
 
 
-async def upcoming_birthdays(user: User, db: AsyncSession):
+async def upcoming_birthdays(user: User, db: AsyncSession, days: int = 7, today: date | None = None):
     """
-    Retrieves contacts with upcoming birthdays within the next 7 days.
+    Retrieves contacts whose birthday falls between today and ``days`` days from today, both ends
+    included, soonest first.
+
+    The window is matched in SQL on the indexed month/day of the birthday, so only the matching rows
+    are loaded. Windows that cross New Year wrap around, and contacts without a birthday are skipped.
 
     :param user: The User instance representing the user.
     :type user: User
     :param db: The database session.
     :type db: AsyncSession
+    :param days: How many days after today the window ends; the window spans ``days + 1`` dates.
+    :type days: int
+    :param today: The first day of the window, defaults to the current date.
+    :type today: date | None
     :return: A list of Contact instances with upcoming birthdays.
     :rtype: list
     """
 
-    current_date = datetime.now().date()
-    future_birthday = current_date + timedelta(days=7)
-    sq = select(Contact).filter_by(user=user)
+    current_date = today or datetime.now().date()
+    start = current_date.month * 100 + current_date.day
+    sq = (select(Contact).filter_by(user=user, deleted_at=None).filter(Contact.birthday.is_not(None))
+          .execution_options(replica=True))
+    if days < 365:
+        future_birthday = current_date + timedelta(days=days)
+        end = future_birthday.month * 100 + future_birthday.day
+        if future_birthday.year == current_date.year:
+            sq = sq.filter(birthday_month_day.between(start, end))
+        else:
+            sq = sq.filter(or_(birthday_month_day >= start, birthday_month_day <= end))
+    sq = sq.order_by(case((birthday_month_day >= start, 0), else_=1), birthday_month_day, Contact.id)
     result = await db.execute(sq)
-    list_bd_contacts = result.scalars().all()
-    happy_contacts = []
-    for data in list_bd_contacts:
-        ccy = data.birthday.replace(year=current_date.year)
-        cfy = data.birthday.replace(year=future_birthday.year)
-        if ccy >= current_date and cfy <= future_birthday:
-            happy_contacts.append(data)
-    return happy_contacts
+    return result.scalars().all()
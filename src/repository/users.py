@@ -1,8 +1,22 @@
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
-from src.database.models import User
+from src.database.models import Contact, User
 from src.schemas import UserUpdateModel, UserModel
+from src.services.contact_cache import contact_cache
+from src.services.user_cache import user_cache
+
+
+async def _update_user_columns(user: User, values: dict, db: AsyncSession) -> None:
+    """
+    Writes ``values`` to the row of a user with a single UPDATE and applies them to the instance
+    as its committed state, so no refresh is needed and detached (cached) instances stay current.
+    """
+    await db.execute(update(User).filter_by(id=user.id).values(**values))
+    await db.commit()
+    for key, value in values.items():
+        set_committed_value(user, key, value)
 
 
 async def get_user_by_email(email: str, db: AsyncSession) -> User:
@@ -16,6 +30,8 @@ async def get_user_by_email(email: str, db: AsyncSession) -> User:
     :returns: The user from the database corresponding to the given email.
     :rtype: User
     """
+    # Read from the primary: the result is cached and backs authorisation, so a lagging replica
+    # would bring back a user that was just confirmed, logged out or created.
     sq = select(User).filter_by(email=email)
     result = await db.execute(sq)
     user = result.scalar_one_or_none()
@@ -31,10 +47,9 @@ async def confirmed_email(email: str, db: AsyncSession) -> None:
     :param db: An asynchronous database session.
     :type db: AsyncSession
     """
-    user = await get_user_by_email(email, db)
-    user.confirmed = True
+    await db.execute(update(User).filter_by(email=email).values(confirmed=True))
     await db.commit()
-    await db.refresh(user)
+    await user_cache.invalidate(email)
 
 
 async def create_user(body: UserModel, db: AsyncSession) -> User:
@@ -48,10 +63,9 @@ async def create_user(body: UserModel, db: AsyncSession) -> User:
     :returns: The user from the database
     :rtype: User
     """
-    user = User(**body.model_dump())
-    db.add(user)
+    result = await db.execute(insert(User).values(**body.model_dump()).returning(User))
+    user = result.scalar_one()
     await db.commit()
-    await db.refresh(user)
     return user
 
 
@@ -66,9 +80,22 @@ async def update_token(user: User, token: str | None, db: AsyncSession) -> None:
     :param db: An asynchronous database session.
     :type db: AsyncSession
     """
-    user.refresh_token = token
-    await db.commit()
-    await db.refresh(user)
+    await _update_user_columns(user, {"refresh_token": token}, db)
+    await user_cache.invalidate(user.email)
+
+
+async def update_password(user: User, password: str, db: AsyncSession) -> None:
+    """
+    Updates the password hash of a user.
+
+    :param user: The user object to update the password for.
+    :type user: User
+    :param password: The new password hash.
+    :type password: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    """
+    await _update_user_columns(user, {"password": password}, db)
 
 
 async def update_user(body: UserUpdateModel, db: AsyncSession, user: User) -> User:
@@ -84,16 +111,11 @@ async def update_user(body: UserUpdateModel, db: AsyncSession, user: User) -> Us
     :returns: The user from the database
     :rtype: User
     """
-    if body.name is not None:
-        user.name = body.name
-    if body.surname is not None:
-        user.surname = body.surname
-    if body.phone is not None:
-        user.phone = body.phone
-    if body.email is not None:
-        user.email = body.email
-        await db.commit()
-        await db.refresh(user)
+    old_email = user.email
+    values = body.model_dump(include={"name", "surname", "phone", "email"}, exclude_none=True)
+    if values:
+        await _update_user_columns(user, values, db)
+        await user_cache.invalidate(old_email)
     return user
 
 
@@ -110,15 +132,14 @@ async def update_avatar(user: User, url: str, db: AsyncSession) -> User:
     :returns: The user from the database corresponding to the given email.
     :rtype: User
     """
-    user.avatar = url
-    await db.commit()
-    await db.refresh(user)
+    await _update_user_columns(user, {"avatar": url}, db)
+    await user_cache.invalidate(user.email)
     return user
 
 
 async def remove_user(user: User, db: AsyncSession) -> User:
     """
-    Removes a user from the database.
+    Removes a user and their contacts from the database.
 
     :param user: The user object to remove.
     :type user: User
@@ -127,6 +148,11 @@ async def remove_user(user: User, db: AsyncSession) -> User:
     :returns: The user object
     :rtype: User
     """
-    await db.delete(user)
+    # contacts.user_id is not nullable, so the contacts of the user go with it.
+    await db.execute(delete(Contact).filter_by(user_id=user.id))
+    result = await db.execute(delete(User).filter_by(id=user.id).returning(User))
+    removed = result.scalar_one_or_none()
     await db.commit()
-    return user
+    await contact_cache.bump(user.id)
+    await user_cache.invalidate(user.email)
+    return removed
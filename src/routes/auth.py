@@ -1,7 +1,6 @@
-from fastapi import APIRouter, HTTPException, Depends, Path, Query, status, BackgroundTasks, Security, Request
+from fastapi import APIRouter, HTTPException, Depends, Path, Query, status, Security, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 
-from fastapi_limiter.depends import RateLimiter
 
 from src.database.db import get_db
 from src.schemas import UserModel, TokenModel, RequestEmail, UserResponseSignupModel
@@ -10,6 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.rate_limit import HybridRateLimiter
 from src.services.email import send_email
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -17,15 +17,13 @@ security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponseSignupModel, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request,
+async def signup(body: UserModel, request: Request,
                  db: AsyncSession = Depends(get_db)):
     """
     Signs up a new user.
 
     :param body: UserModel instance containing user information.
     :type body: UserModel
-    :param background_tasks: FastAPI BackgroundTasks for asynchronous tasks.
-    :type background_tasks: BackgroundTasks
     :param request: FastAPI Request instance containing request information.
     :type request: Request
     :param db: An asynchronous database session.
@@ -36,9 +34,9 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exist")
-    body.password = auth_service.password_manager.get_password_hash(body.password)
+    body.password = await auth_service.password_manager.get_password_hash_async(body.password)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user, request.base_url)
+    await send_email(new_user, str(request.base_url))
     return new_user
 
 
@@ -47,6 +45,8 @@ async def login_user(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
     """
     Logs in a user and returns access and refresh tokens.
 
+    A password stored with an outdated scheme or cost is rehashed with the current settings.
+
     :param body: OAuth2PasswordRequestForm instance containing login information.
     :type body: OAuth2PasswordRequestForm
     :param db: An asynchronous database session.
@@ -59,8 +59,11 @@ async def login_user(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.password_manager.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.password_manager.verify_and_update_async(body.password, user.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password")
+    if new_hash:
+        await repository_users.update_password(user, new_hash, db)
     access_token = await auth_service.create_access_token(user)
     refresh_token = await auth_service.create_refresh_token(user)
     await repository_users.update_token(user, refresh_token, db)
@@ -82,6 +85,7 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(sec
     """
     token = credentials.credentials
     user = await auth_service.authorised_user(token, db)
+    auth_service.jwt_manager.forget(token)
     if user.refresh_token != token:
         await repository_users.update_token(user, None, db)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
@@ -115,16 +119,14 @@ async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
 
 @router.post('/request_email',
              description='No more than 10 requests per 10 minutes',
-             dependencies=[Depends(RateLimiter(times=10, seconds=600))])
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
+             dependencies=[Depends(HybridRateLimiter(times=10, seconds=600))])
+async def request_email(body: RequestEmail, request: Request,
                         db: AsyncSession = Depends(get_db)):
     """
     Requests email confirmation for a user.
 
     :param body: RequestEmail instance containing the user's email.
     :type body: RequestEmail
-    :param background_tasks: FastAPI BackgroundTasks for asynchronous tasks.
-    :type background_tasks: BackgroundTasks
     :param request: FastAPI Request instance containing request information.
     :type request: Request
     :param db: An asynchronous database session.
@@ -137,5 +139,5 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     if user.confirmed:
         return {"message": "Your email is already confirmed"}
     if user:
-        background_tasks.add_task(send_email, user, request.base_url)
+        await send_email(user, str(request.base_url))
     return {"message": "Check your email for confirmation."}
@@ -1,38 +1,141 @@
-from typing import List
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
 
-from fastapi import APIRouter, HTTPException, Depends, Path, Query, status, Security
+from fastapi import APIRouter, HTTPException, Depends, Path, Query, status, Security, UploadFile, File, Header
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials
-from fastapi_limiter.depends import RateLimiter
+from pydantic import BaseModel
 
 from src.database.db import get_db
 from src.routes.auth import security
-from src.schemas import ContactResponse, ContactModel
+from src.conf.config import settings
+from src.schemas import (ContactResponse, ContactModel, ContactPageResponse, ContactSuggestion, ContactImportResponse,
+                         ContactChangesResponse)
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.repository import contacts as response_contacts
 from src.services.auth import auth_service
+from src.services.rate_limit import HybridRateLimiter
+from src.services import contacts_io
+from src.services.autocomplete import autocomplete_index
+from src.services.contact_cache import contact_cache, etag_matches, make_etag
+from src.services.pagination import encode_cursor, decode_cursor, InvalidCursorError
 
 router = APIRouter(prefix="/contacts", tags=["contacts"])
 
 
-@router.get("/", response_model=List[ContactResponse], status_code=status.HTTP_200_OK,
+async def cached_json(user_id: int, name: str, build: Callable[[], Awaitable[Optional[BaseModel]]],
+                      if_none_match: Optional[str] = None) -> Optional[Response]:
+    """
+    Answers from the contact cache of a user, building and caching the response on a miss.
+
+    Responses carry a strong ETag derived from the contacts version of the user. When the
+    If-None-Match header of the request still matches, 304 Not Modified is returned before
+    the cache or the database is read.
+
+    :param user_id: The id of the user.
+    :type user_id: int
+    :param name: The cache entry name, unique for the request.
+    :type name: str
+    :param build: Coroutine function reading the response model from the primary database, None if
+        not found. The result is cached under the current version, so it must not come from a replica.
+    :type build: Callable
+    :param if_none_match: The If-None-Match request header.
+    :type if_none_match: str | None
+    :return: The JSON or 304 response, or None if ``build`` found nothing.
+    :rtype: Response | None
+    """
+    version = await contact_cache.version(user_id)
+    headers = {"Cache-Control": "private, no-cache"}
+    payload = None
+    if version is not None:
+        headers["ETag"] = make_etag(user_id, version, name)
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        payload = await contact_cache.get(user_id, version, name)
+    if payload is None:
+        model = await build()
+        if model is None:
+            return None
+        payload = model.model_dump_json().encode()
+        await contact_cache.set(user_id, version, name, payload)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+
+@router.get("/", response_model=ContactPageResponse, status_code=status.HTTP_200_OK,
              description='No more than 10 requests per minute',
-             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+             dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
 async def get_contacts(limit: int = Query(10, ge=10, le=500), offset: int = Query(0, ge=0, le=200),
+                       cursor: str = Query(None),
+                       if_none_match: str = Header(None),
                        credentials: HTTPAuthorizationCredentials = Security(security),
                        db: AsyncSession = Depends(get_db)):
     """
     Gets the contact information for a given user.
 
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the following page; ``offset`` is ignored then.
+    Pages are served from the contact cache of the user until the contacts change, and a request
+    whose If-None-Match still matches the ETag of the page gets 304 Not Modified.
+
     :param limit: The maximum number of contacts to retrieve.
     :type limit: int
     :param offset: The number of contacts to skip before retrieving.
     :type offset: int
+    :param cursor: An opaque cursor returned with the previous page.
+    :type cursor: str
+    :param if_none_match: The ETag of the copy of the page held by the client.
+    :type if_none_match: str
     :param credentials: user token
     :type credentials: str
     :param db: An asynchronous database session.
     :type db: AsyncSession
-    :return: A list of Contact instances.
+    :return: A page of Contact instances and the cursor of the next page.
+    :rtype: dict
+    """
+    token = credentials.credentials
+    user = await auth_service.authorised_user(token, db)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+    after_id = None
+    if cursor:
+        try:
+            after_id = int(decode_cursor(cursor)["id"])
+        except (InvalidCursorError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    async def build():
+        contacts = await response_contacts.get_contacts(limit, offset, db, user, after_id=after_id)
+        next_cursor = encode_cursor({"id": contacts[-1].id}) if len(contacts) == limit else None
+        return ContactPageResponse.model_validate({"items": contacts, "next_cursor": next_cursor},
+                                                  from_attributes=True)
+
+    name = f"list:{limit}:after:{after_id}" if after_id is not None else f"list:{limit}:offset:{offset}"
+    return await cached_json(user.id, name, build, if_none_match)
+
+
+@router.get("/autocomplete", response_model=List[ContactSuggestion], status_code=status.HTTP_200_OK,
+             description='No more than 120 requests per minute',
+             dependencies=[Depends(HybridRateLimiter(times=120, seconds=60))])
+async def autocomplete_contacts(q: str = Query(min_length=1, max_length=150), limit: int = Query(10, ge=1, le=50),
+                                credentials: HTTPAuthorizationCredentials = Security(security),
+                                db: AsyncSession = Depends(get_db)):
+    """
+    Suggests contacts whose name, surname or email starts with the typed prefix.
+
+    Served from an in-memory index of the user's contacts, built on first use.
+
+    :param q: The typed prefix.
+    :type q: str
+    :param limit: The maximum number of suggestions.
+    :type limit: int
+    :param credentials: user token
+    :type credentials: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: A list of matching contacts.
     :rtype: list
     """
     token = credentials.credentials
@@ -42,20 +145,114 @@ async def get_contacts(limit: int = Query(10, ge=10, le=500), offset: int = Quer
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized",
         )
-    contacts = await response_contacts.get_contacts(limit, offset, db, user)
-    return contacts
+    index = await autocomplete_index.get(user.id, lambda: response_contacts.get_contact_suggestions(user, db))
+    return [{"id": contact_id, "name": name, "surname": surname, "email": email}
+            for contact_id, name, surname, email in index.search(q, limit)]
+
+
+@router.get("/changes", response_model=ContactChangesResponse, status_code=status.HTTP_200_OK,
+            description='No more than 30 requests per minute',
+            dependencies=[Depends(HybridRateLimiter(times=30, seconds=60))])
+async def get_contact_changes(since: str = Query(None), limit: int = Query(100, ge=1, le=1000),
+                              credentials: HTTPAuthorizationCredentials = Security(security),
+                              db: AsyncSession = Depends(get_db)):
+    """
+    Returns the contacts created, changed or deleted since the last sync, oldest change first.
+
+    Pass the ``next_token`` of the previous response as ``since``; without it every live contact is
+    returned. Deleted contacts come back with ``deleted_at`` set. Keep requesting while ``has_more``
+    is true. Changes of the last few seconds are held back until concurrent writes have settled,
+    so none are skipped; ``CONTACT_SYNC_SETTLE_SECONDS`` must exceed the longest write transaction
+    on contacts, since a row is stamped before its transaction commits.
+
+    :param since: The sync token returned by the previous call.
+    :type since: str
+    :param limit: The maximum number of changes to return.
+    :type limit: int
+    :param credentials: user token
+    :type credentials: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: The changes, the token of the next sync and whether more changes are waiting.
+    :rtype: dict
+    """
+    token = credentials.credentials
+    user = await auth_service.authorised_user(token, db)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+    after = None
+    if since:
+        try:
+            data = decode_cursor(since)
+            after = datetime.fromisoformat(data["t"]), int(data["id"])
+        except (InvalidCursorError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token")
+    until = await response_contacts.database_time(db) - timedelta(seconds=settings.contact_sync_settle_seconds)
+    changes = await response_contacts.get_contact_changes(user, db, until, limit=limit, since=after)
+    if changes:
+        next_token = encode_cursor({"t": changes[-1].updated_at.isoformat(), "id": changes[-1].id})
+    elif since:
+        next_token = since
+    else:
+        next_token = encode_cursor({"t": until.isoformat(), "id": 0})
+    return {"changes": changes, "next_token": next_token, "has_more": len(changes) == limit}
+
+
+@router.get("/export", response_class=StreamingResponse, status_code=status.HTTP_200_OK,
+            description='No more than 2 requests per minute',
+            dependencies=[Depends(HybridRateLimiter(times=2, seconds=60))])
+async def export_contacts(file_format: str = Query("ndjson", alias="format", pattern="^(csv|ndjson|vcard)$"),
+                          gzip: bool = Query(False),
+                          credentials: HTTPAuthorizationCredentials = Security(security),
+                          db: AsyncSession = Depends(get_db)):
+    """
+    Downloads all contacts of the user as an NDJSON, CSV or vCard file.
+
+    The file is streamed while the contacts are read, so its size is not limited by server memory.
+
+    :param file_format: ndjson, csv or vcard.
+    :type file_format: str
+    :param gzip: Whether to gzip the file.
+    :type gzip: bool
+    :param credentials: user token
+    :type credentials: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: The contact file.
+    :rtype: StreamingResponse
+    """
+    token = credentials.credentials
+    user = await auth_service.authorised_user(token, db)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+    filename = f"contacts.{contacts_io.FILE_EXTENSIONS[file_format]}"
+    media_type = contacts_io.MEDIA_TYPES[file_format]
+    if gzip:
+        filename, media_type = f"{filename}.gz", "application/gzip"
+    chunks = contacts_io.export_chunks(response_contacts.stream_contacts(user, db), file_format, compress=gzip)
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
 @router.get("/{contact_id}", response_model=ContactResponse,
              description='No more than 10 requests per minute',
-             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contact(contact_id: int = Path(ge=1), credentials: HTTPAuthorizationCredentials = Security(security),
+             dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
+async def get_contact(contact_id: int = Path(ge=1), if_none_match: str = Header(None),
+                      credentials: HTTPAuthorizationCredentials = Security(security),
                       db: AsyncSession = Depends(get_db)):
     """
-    Retrieves a contact from database session.
+    Retrieves a contact, from the contact cache of the user when it has not changed since last read.
 
     :param contact_id: An id of the contact
     :type contact_id: int
+    :param if_none_match: The ETag of the copy of the contact held by the client.
+    :type if_none_match: str
     :param credentials: user token
     :type credentials: str
     :param db: An asynchronous database session.
@@ -70,18 +267,23 @@ async def get_contact(contact_id: int = Path(ge=1), credentials: HTTPAuthorizati
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized",
         )
-    contact = await response_contacts.get_contact(contact_id, db, user)
-    if contact is None:
+
+    async def build():
+        contact = await response_contacts.get_contact(contact_id, db, user)
+        return ContactResponse.model_validate(contact, from_attributes=True) if contact is not None else None
+
+    response = await cached_json(user.id, f"contact:{contact_id}", build, if_none_match)
+    if response is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="NOT FOUND",
         )
-    return contact
+    return response
 
 
 @router.post("", response_model=ContactResponse, status_code=status.HTTP_201_CREATED,
              description='No more than 5 requests per minute',
-             dependencies=[Depends(RateLimiter(times=5, seconds=60))])
+             dependencies=[Depends(HybridRateLimiter(times=5, seconds=60))])
 async def create_contact(body: ContactModel,
                          credentials: HTTPAuthorizationCredentials = Security(security),
                          db: AsyncSession = Depends(get_db)):
@@ -110,9 +312,49 @@ async def create_contact(body: ContactModel,
     return contact
 
 
+@router.post("/import", response_model=ContactImportResponse, status_code=status.HTTP_200_OK,
+             description='No more than 2 requests per minute',
+             dependencies=[Depends(HybridRateLimiter(times=2, seconds=60))])
+async def import_contacts(file: UploadFile = File(),
+                          file_format: str = Query(None, alias="format", pattern="^(csv|ndjson|vcard)$"),
+                          credentials: HTTPAuthorizationCredentials = Security(security),
+                          db: AsyncSession = Depends(get_db)):
+    """
+    Imports contacts in bulk from a CSV (with a header row), NDJSON or vCard file.
+
+    Records that fail validation or whose phone number is already taken are skipped and reported
+    with their line number; the other records are imported.
+
+    :param file: The uploaded contact file.
+    :type file: UploadFile
+    :param file_format: csv, ndjson or vcard, guessed from the file name or content type if omitted.
+    :type file_format: str
+    :param credentials: user token
+    :type credentials: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: The numbers of received, imported and failed records and the reasons of the failures.
+    :rtype: dict
+    """
+    token = credentials.credentials
+    user = await auth_service.authorised_user(token, db)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+    file_format = file_format or contacts_io.detect_format(file.filename, file.content_type)
+    if file_format is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported file format")
+    try:
+        return await contacts_io.import_contacts(file.file, file_format, db, user)
+    except contacts_io.ContactFileError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+
+
 @router.put("/{contact_id}", response_model=ContactResponse, status_code=status.HTTP_201_CREATED,
              description='No more than 10 requests per minute',
-             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+             dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
 async def update_contact(body: ContactModel, contact_id: int = Path(ge=1),
                          credentials: HTTPAuthorizationCredentials = Security(security),
                          db: AsyncSession = Depends(get_db)):
@@ -148,7 +390,7 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1),
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT,
              description='No more than 5 requests per minute',
-             dependencies=[Depends(RateLimiter(times=5, seconds=60))])
+             dependencies=[Depends(HybridRateLimiter(times=5, seconds=60))])
 async def remove_contact(contact_id: int = Path(ge=1),
                          credentials: HTTPAuthorizationCredentials = Security(security),
                          db: AsyncSession = Depends(get_db)):
@@ -181,17 +423,21 @@ async def remove_contact(contact_id: int = Path(ge=1),
     return contact
 
 
-@router.get("/search/{user_id}", response_model=ContactResponse, status_code=status.HTTP_200_OK,
+@router.get("/search/{user_id}", response_model=ContactPageResponse, status_code=status.HTTP_200_OK,
              description='No more than 15 requests per minute',
-             dependencies=[Depends(RateLimiter(times=15, seconds=60))])
+             dependencies=[Depends(HybridRateLimiter(times=15, seconds=60))])
 async def search_contact(credentials: HTTPAuthorizationCredentials = Security(security),
-                         contact_name: str = Query(None, min_length=2),
-                         surname: str = Query(None, min_length=2),
-                         email: str = Query(None),
+                         contact_name: str = Query(None, min_length=2, max_length=150),
+                         surname: str = Query(None, min_length=2, max_length=150),
+                         email: str = Query(None, max_length=150),
+                         limit: int = Query(10, ge=1, le=50),
+                         cursor: str = Query(None),
                          db: AsyncSession = Depends(get_db)
                          ):
     """
-    Searches for a contact based on the provided criteria.
+    Searches for contacts matching all of the provided criteria, best match first.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the following page.
 
     :param credentials: user token
     :type credentials: str
@@ -203,8 +449,12 @@ async def search_contact(credentials: HTTPAuthorizationCredentials = Security(se
     :type surname: str
     :param email: The email of the contact to search for.
     :type email: str
-    :return: The first matching Contact instance
-    :rtype: Contact
+    :param limit: The maximum number of contacts to retrieve.
+    :type limit: int
+    :param cursor: An opaque cursor returned with the previous page.
+    :type cursor: str
+    :return: A page of matching Contact instances and the cursor of the next page.
+    :rtype: dict
     """
     token = credentials.credentials
     user = await auth_service.authorised_user(token, db)
@@ -213,25 +463,35 @@ async def search_contact(credentials: HTTPAuthorizationCredentials = Security(se
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized",
         )
-    contact = await response_contacts.search_contact(user, db, contact_name, surname, email)
-    if contact is None:
-        raise HTTPException(
-            status_code=404,
-            detail="NOT FOUND",
-        )
-    return contact
+    if not (contact_name or surname or email):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No search criteria")
+    after = None
+    if cursor:
+        try:
+            data = decode_cursor(cursor)
+            after = float(data["rank"]), int(data["id"])
+        except (InvalidCursorError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    rows = await response_contacts.search_contact(user, db, contact_name, surname, email, limit=limit, after=after)
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor({"rank": rows[-1].rank, "id": rows[-1].Contact.id})
+    return {"items": [row.Contact for row in rows], "next_cursor": next_cursor}
 
 
 @router.get("/birthdays/{user_id}", response_model=List[ContactResponse],
              description='No more than 10 requests per minute',
-             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+             dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
 async def upcoming_birthdays(credentials: HTTPAuthorizationCredentials = Security(security),
+                             days: int = Query(7, ge=1, le=366),
                              db: AsyncSession = Depends(get_db)):
     """
-    Retrieves contacts with upcoming birthdays within the next 7 days.
+    Retrieves contacts with upcoming birthdays within the next ``days`` days.
 
     :param credentials: user token
     :type credentials: str
+    :param days: The size of the window in days.
+    :type days: int
     :param db: The database session.
     :type db: AsyncSession
     :return: A list of Contact instances with upcoming birthdays.
@@ -244,7 +504,7 @@ async def upcoming_birthdays(credentials: HTTPAuthorizationCredentials = Securit
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized",
         )
-    contacts = await response_contacts.upcoming_birthdays(user, db)
+    contacts = await response_contacts.upcoming_birthdays(user, db, days=days)
     if not contacts:
         raise HTTPException(
             status_code=404,
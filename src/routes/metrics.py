@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, HTTPException, Security, status
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.db import get_db, sessionmanager
+from src.routes.auth import security
+from src.schemas import PoolStatusResponse
+from src.services.auth import auth_service
+from src.services.rate_limit import HybridRateLimiter
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/db_pool", response_model=PoolStatusResponse, status_code=status.HTTP_200_OK,
+            description='No more than 10 requests per minute',
+            dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
+async def db_pool_status(credentials: HTTPAuthorizationCredentials = Security(security),
+                         db: AsyncSession = Depends(get_db)):
+    """
+    Reports database connection pool occupancy and checkout wait times of this worker. Only users
+    listed in the ``metrics_admins`` setting may read it.
+
+    :param credentials: user token
+    :type credentials: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: Pool statistics.
+    :rtype: dict
+    """
+    token = credentials.credentials
+    current_user = await auth_service.authorised_user(token, db)
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+    if current_user.email not in settings.metrics_admins:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Forbidden",
+        )
+    return sessionmanager.pool_status()
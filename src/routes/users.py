@@ -1,35 +1,47 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Security, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, status, Security, UploadFile, File, Request, Response
 from fastapi.security import HTTPAuthorizationCredentials
-from fastapi_limiter.depends import RateLimiter
-import cloudinary
-import cloudinary.uploader
+from redis.exceptions import RedisError
 
 from src.database.db import get_db
 from src.routes.auth import security
 from src.conf.config import settings
-from src.schemas import UserResponse, UserUpdateModel, UserDeleteResponse, UserUpdateResponse
+from src.schemas import (UserUpdateModel, UserDeleteResponse, UserUpdateResponse, AvatarJobResponse,
+                         AvatarStatusResponse)
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.avatars import AvatarTooLargeError, process_avatar, spool_upload
+from src.services.jobs import job_queue
+from src.services.rate_limit import HybridRateLimiter
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-@router.patch('/avatar', response_model=UserResponse)
-async def update_avatar_user(file: UploadFile = File(), credentials: HTTPAuthorizationCredentials = Security(security),
+@router.patch('/avatar', response_model=AvatarJobResponse, status_code=status.HTTP_202_ACCEPTED,
+              description='No more than 5 requests per minute',
+              dependencies=[Depends(HybridRateLimiter(times=5, seconds=60))])
+async def update_avatar_user(request: Request, response: Response, file: UploadFile = File(),
+                             credentials: HTTPAuthorizationCredentials = Security(security),
                              db: AsyncSession = Depends(get_db)):
     """
     Updates a user's avatar.
 
+    The upload is spooled to disk and stored by a background job. The response points to the
+    status of the job in ``status_url`` and the Location header.
+
+    :param request: FastAPI Request instance containing request information.
+    :type request: Request
+    :param response: The response, used to set the Location header.
+    :type response: Response
     :param file: The file to uploading.
     :type file: UploadFile
     :param credentials: user token
     :type credentials: str
     :param db: An asynchronous database session.
     :type db: AsyncSession
-    :returns: The user instance
-    :rtype: User
+    :returns: The avatar job and its status URL
+    :rtype: dict
     """
     token = credentials.credentials
     current_user = await auth_service.authorised_user(token, db)
@@ -38,23 +50,64 @@ async def update_avatar_user(file: UploadFile = File(), credentials: HTTPAuthori
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized",
         )
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'NotesApp/{current_user.name}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'NotesApp/{current_user.name}') \
-        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    user = await repository_users.update_avatar(current_user, src_url, db)
-    return user
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Avatar must be an image")
+    try:
+        path = await spool_upload(file.file, settings.avatar_spool_dir, settings.avatar_max_size)
+    except AvatarTooLargeError as err:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(err))
+    try:
+        job_id = await job_queue.enqueue(process_avatar.__name__, current_user.email, str(path),
+                                         owner=current_user.email)
+    except RedisError:
+        path.unlink(missing_ok=True)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Avatar processing is unavailable")
+    status_url = str(request.url_for("get_avatar_status", job_id=job_id))
+    response.headers["Location"] = status_url
+    return {"job_id": job_id, "status_url": status_url}
+
+
+@router.get('/avatar/{job_id}', response_model=AvatarStatusResponse,
+            description='No more than 60 requests per minute',
+            dependencies=[Depends(HybridRateLimiter(times=60, seconds=60))])
+async def get_avatar_status(job_id: str, credentials: HTTPAuthorizationCredentials = Security(security),
+                            db: AsyncSession = Depends(get_db)):
+    """
+    Gets the status of an avatar upload.
+
+    The status is ``queued``, ``running``, ``retrying``, ``done`` or ``dead``; ``avatar`` holds the new
+    avatar URL once the job is done. Finished jobs are kept for a day.
+
+    :param job_id: The id returned by the avatar upload.
+    :type job_id: str
+    :param credentials: user token
+    :type credentials: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :returns: The status of the job
+    :rtype: dict
+    """
+    token = credentials.credentials
+    current_user = await auth_service.authorised_user(token, db)
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+    try:
+        job = await job_queue.status(job_id)
+    except RedisError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Avatar processing is unavailable")
+    if job is None or job["name"] != process_avatar.__name__ or job["owner"] != current_user.email:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+    return {"job_id": job_id, "status": job["status"], "avatar": (job["result"] or {}).get("avatar")}
 
 
 @router.put("/", response_model=UserUpdateResponse,
             description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+            dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
 async def update_user(body: UserUpdateModel, credentials: HTTPAuthorizationCredentials = Security(security),
                       db: AsyncSession = Depends(get_db)):
     """
@@ -82,7 +135,7 @@ async def update_user(body: UserUpdateModel, credentials: HTTPAuthorizationCrede
 
 @router.delete("/", response_model=UserDeleteResponse,
                description='No more than 10 requests per minute',
-               dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+               dependencies=[Depends(HybridRateLimiter(times=10, seconds=60))])
 async def delete_user(credentials: HTTPAuthorizationCredentials = Security(security),
                       db: AsyncSession = Depends(get_db)):
     """
@@ -1,5 +1,5 @@
-from typing import Optional
-from datetime import date
+from typing import List, Optional
+from datetime import date, datetime
 
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
 
@@ -25,6 +25,18 @@ class UserResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class AvatarJobResponse(BaseModel):
+    job_id: str
+    status: str = "queued"
+    status_url: str
+
+
+class AvatarStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    avatar: str | None = None
+
+
 class UserUpdateModel(BaseModel):
     name: Optional[str] = Field(None)
     email: Optional[EmailStr] = Field(None)
@@ -64,5 +76,54 @@ class ContactResponse(ContactModel):
     id: int
 
 
+class ContactSuggestion(BaseModel):
+    id: int
+    name: str | None
+    surname: str | None
+    email: str | None
+
+
+class ContactChange(ContactResponse):
+    updated_at: datetime
+    deleted_at: datetime | None = None
+
+
+class ContactChangesResponse(BaseModel):
+    changes: List[ContactChange]
+    next_token: str
+    has_more: bool
+
+
+class ContactImportError(BaseModel):
+    line: int
+    error: str
+
+
+class ContactImportResponse(BaseModel):
+    received: int
+    imported: int
+    failed: int
+    errors: List[ContactImportError]
+
+
+class ContactPageResponse(BaseModel):
+    items: List[ContactResponse]
+    next_cursor: str | None = None
+
+
 class RequestEmail(BaseModel):
     email: EmailStr
+
+
+class PoolStatusResponse(BaseModel):
+    size: int | None = None
+    checked_in: int | None = None
+    checked_out: int | None = None
+    overflow: int | None = None
+    checkouts: int | None = None
+    timeouts: int | None = None
+    wait_avg_ms: float | None = None
+    wait_max_ms: float | None = None
+    wait_p50_ms: float | None = None
+    wait_p95_ms: float | None = None
+    wait_p99_ms: float | None = None
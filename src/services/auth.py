@@ -8,7 +8,8 @@ Contents:
 - AuthService: A class handling user authentication and authorization.
 
 Dependencies:
-- fastapi, jose, passlib, datetime, sqlalchemy, src.database.db, src.repository.users1, src.conf.config
+- fastapi, jose, passlib, datetime, sqlalchemy, src.database.db, src.repository.users1, src.services.user_cache,
+  src.conf.config
 
 Usage:
 1. Import the necessary classes and modules:
@@ -17,9 +18,14 @@ Usage:
 2. Initialize the required settings:
     - secret_key: Secret key used for JWT token encoding.
     - algorithm: JWT token encoding algorithm.
+    - password_hash_workers: Number of threads hashing and verifying passwords.
+    - password_schemes and cost parameters: Hash schemes, the first one is used for new hashes.
+    - jwt_decode_cache_size: Number of verified tokens kept decoded until they expire.
 
 3. Initialize the authentication service:
-    auth_service = AuthService(PasswordManager(), JWTManager(secret_key, algorithm), repository_users, redis_sessionmanager)
+    password_manager = PasswordManager(password_hash_workers, password_schemes, **password_context_settings(settings))
+    jwt_manager = JWTManager(secret_key, algorithm, jwt_decode_cache_size)
+    auth_service = AuthService(password_manager, jwt_manager, repository_users, user_cache)
 
 4. Use the authentication service for various operations:
     - authenticate_user(email: str, password: str, db: AsyncSession) -> User: Authenticate a user based on email and password.
@@ -30,8 +36,12 @@ Usage:
 
 Note: Replace 'User' with your actual user class or data structure.
 """
-from typing import Dict, Any, Optional
-import pickle
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Sequence
 
 from fastapi import HTTPException, status, Depends
 from jose import JWTError, jwt
@@ -40,8 +50,9 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db, redis_sessionmanager
+from src.database.db import get_db
 from src.repository import users as repository_users
+from src.services.user_cache import user_cache
 
 from src.conf.config import settings
 
@@ -51,9 +62,16 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 class PasswordManager:
     """
     Class responsible for managing password encryption and verification.
+
+    Hashing is CPU bound and takes hundreds of milliseconds, so request handlers use the async methods,
+    which run it on a bounded thread pool instead of the event loop.
+
+    The first of ``schemes`` hashes new passwords, the others are only verified and marked deprecated.
+    ``context_settings`` are passed to passlib's CryptContext (e.g. ``bcrypt__rounds=12``).
     """
-    def __init__(self):
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def __init__(self, max_workers: int = 4, schemes: Sequence[str] = ("bcrypt",), **context_settings):
+        self.pwd_context = CryptContext(schemes=list(schemes), deprecated="auto", **context_settings)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password")
 
     def verify_password(self, plain_password, hashed_password):
         return self.pwd_context.verify(plain_password, hashed_password)
@@ -61,14 +79,107 @@ class PasswordManager:
     def get_password_hash(self, password: str):
         return self.pwd_context.hash(password)
 
+    def needs_update(self, hashed_password):
+        return self.pwd_context.needs_update(hashed_password)
+
+    def verify_and_update(self, plain_password, hashed_password):
+        """
+        Verifies a password and rehashes it when its scheme or cost parameters are outdated.
+
+        :return: Whether the password is valid, and the new hash or None if the stored one is current.
+        :rtype: tuple
+        """
+        if not self.verify_password(plain_password, hashed_password):
+            return False, None
+        if self.needs_update(hashed_password):
+            return True, self.get_password_hash(plain_password)
+        return True, None
+
+    async def verify_password_async(self, plain_password, hashed_password):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.verify_password, plain_password, hashed_password)
+
+    async def get_password_hash_async(self, password: str):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.get_password_hash, password)
+
+    async def verify_and_update_async(self, plain_password, hashed_password):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.verify_and_update, plain_password, hashed_password)
+
+
+def password_context_settings(config) -> Dict[str, Any]:
+    """
+    Collects the passlib cost parameters of the configured password schemes.
+
+    :param config: The application settings.
+    :type config: Settings
+    :return: CryptContext keyword arguments.
+    :rtype: dict
+    """
+    scheme_settings = {
+        "bcrypt": {"bcrypt__rounds": config.password_bcrypt_rounds},
+        "argon2": {"argon2__type": "ID",
+                   "argon2__time_cost": config.password_argon2_time_cost,
+                   "argon2__memory_cost": config.password_argon2_memory_cost,
+                   "argon2__parallelism": config.password_argon2_parallelism},
+    }
+    context_settings = {}
+    for scheme in config.password_schemes:
+        context_settings.update(scheme_settings.get(scheme, {}))
+    return context_settings
+
 
 class JWTManager:
     """
     Class responsible for JWT token creation and decoding.
+
+    Verified claims are kept in a bounded LRU cache keyed by the SHA-256 of the token until the token
+    expires, so a client reusing a bearer token pays for the signature check once. Only the decoding
+    is cached: scope checks and every user/refresh token lookup still run on each request, and
+    ``forget`` drops a token as soon as it is rotated.
     """
-    def __init__(self, secret_key: str, algorithm: str):
+    def __init__(self, secret_key: str, algorithm: str, cache_size: int = 4096):
         self.secret_key = secret_key
         self.algorithm = algorithm
+        self.cache_size = cache_size
+        self._decoded: OrderedDict[bytes, Dict[str, Any]] = OrderedDict()
+
+    @staticmethod
+    def _cache_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _decode(self, token: str) -> Dict[str, Any]:
+        key = self._cache_key(token)
+        payload = self._decoded.get(key)
+        if payload is not None:
+            if payload["exp"] > time.time():
+                self._decoded.move_to_end(key)
+                return payload
+            del self._decoded[key]
+        payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        if self.cache_size and isinstance(payload.get("exp"), (int, float)):
+            self._decoded[key] = payload
+            while len(self._decoded) > self.cache_size:
+                self._decoded.popitem(last=False)
+        return payload
+
+    def forget(self, token: str) -> None:
+        self._decoded.pop(self._cache_key(token), None)
+
+    def subject(self, token: str) -> Optional[str]:
+        """
+        Returns the subject of a valid token of any scope.
+
+        :param token: The bearer token.
+        :type token: str
+        :return: The subject, or None if the token is invalid or expired.
+        :rtype: str | None
+        """
+        try:
+            return self._decode(token).get("sub")
+        except JWTError:
+            return None
 
     def create_token(self, data: Dict[str, Any], scope: str, expires_delta: Optional[float] = None):
         to_encode = data.copy()
@@ -82,7 +193,7 @@ class JWTManager:
 
     def decode_token(self, token: str = Depends(oauth2_scheme)):
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            payload = self._decode(token)
             if payload['scope'] == 'refresh_token':
                 email = payload['sub']
                 return email
@@ -93,7 +204,7 @@ class JWTManager:
 
     def decode_email_token(self, token: str = Depends(oauth2_scheme)):
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            payload = self._decode(token)
             if payload['scope'] == 'email_token':
                 email = payload['sub']
                 return email
@@ -107,15 +218,15 @@ class AuthService:
     """
     Class providing user authentication and authorization services.
     """
-    def __init__(self, password_manager, jwt_manager, user_repository, redis):
-        self.r = redis
+    def __init__(self, password_manager, jwt_manager, user_repository, user_cache):
+        self.user_cache = user_cache
         self.password_manager = password_manager
         self.jwt_manager = jwt_manager
         self.user_repository = user_repository
 
     async def authenticate_user(self, email: str, password: str, db: AsyncSession):
         user = await self.user_repository.get_user_by_email(email, db)
-        if user is None or not self.password_manager.verify_password(password, user.password):
+        if user is None or not await self.password_manager.verify_password_async(password, user.password):
             return None
         return user
 
@@ -124,15 +235,13 @@ class AuthService:
             email = self.jwt_manager.decode_token(token)
         except JWTError:
             return None
-        user = self.r.redis.get(f"user:{email}")
+        user = await self.user_cache.get(email)
         if user is None:
+            generation = await self.user_cache.generation(email)
             user = await self.user_repository.get_user_by_email(email, db)
             if user is None:
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
-            self.r.redis.set(f"user:{email}", pickle.dumps(user))
-            self.r.redis.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            await self.user_cache.set(user, generation)
         return user
 
     async def create_access_token(self, user):
@@ -157,4 +266,7 @@ class AuthService:
 secret_key = settings.secret_key
 algorithm = settings.algorithm
 
-auth_service = AuthService(PasswordManager(), JWTManager(secret_key, algorithm), repository_users, redis_sessionmanager)
+password_manager = PasswordManager(settings.password_hash_workers, settings.password_schemes,
+                                   **password_context_settings(settings))
+jwt_manager = JWTManager(secret_key, algorithm, settings.jwt_decode_cache_size)
+auth_service = AuthService(password_manager, jwt_manager, repository_users, user_cache)
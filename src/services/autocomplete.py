@@ -0,0 +1,171 @@
+"""
+Module Name: autocomplete.py
+Description: Per-user in-memory prefix index serving contact type-ahead without touching the database.
+
+Every user gets a sorted array of lower-cased (term, contact id) pairs built from the name, surname
+and email of their contacts; a prefix lookup is a binary search followed by a short scan. Indexes are
+built lazily on first use, kept in a bounded LRU with a TTL, and updated incrementally when contacts
+change. Other workers drop their copy through the InvalidationBus and rebuild it on next use.
+"""
+import asyncio
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.conf.config import settings
+from src.services.invalidation import invalidation_bus
+
+Suggestion = Tuple[int, Optional[str], Optional[str], Optional[str]]
+
+
+class PrefixIndex:
+    """
+    Sorted array of the searchable terms of one user's contacts.
+    """
+    def __init__(self, contacts: Iterable[Suggestion] = ()):
+        self._contacts: Dict[int, Suggestion] = {}
+        entries = []
+        for contact in contacts:
+            self._contacts[contact[0]] = contact
+            entries.extend(self._entries(contact))
+        self._entries_sorted: List[Tuple[str, int]] = sorted(entries)
+
+    @staticmethod
+    def _entries(contact: Suggestion) -> set:
+        contact_id, *values = contact
+        return {(value.lower(), contact_id) for value in values if value}
+
+    def __len__(self) -> int:
+        return len(self._contacts)
+
+    def add(self, contact: Suggestion) -> None:
+        self.discard(contact[0])
+        self._contacts[contact[0]] = contact
+        for entry in self._entries(contact):
+            insort(self._entries_sorted, entry)
+
+    def discard(self, contact_id: int) -> None:
+        contact = self._contacts.pop(contact_id, None)
+        if contact is None:
+            return
+        for entry in self._entries(contact):
+            i = bisect_left(self._entries_sorted, entry)
+            if i < len(self._entries_sorted) and self._entries_sorted[i] == entry:
+                del self._entries_sorted[i]
+
+    def search(self, prefix: str, limit: int) -> List[Suggestion]:
+        prefix = prefix.lower()
+        found: Dict[int, Suggestion] = {}
+        i = bisect_left(self._entries_sorted, (prefix, -1))
+        while i < len(self._entries_sorted) and len(found) < limit:
+            term, contact_id = self._entries_sorted[i]
+            if not term.startswith(prefix):
+                break
+            found.setdefault(contact_id, self._contacts[contact_id])
+            i += 1
+        return list(found.values())
+
+
+class AutocompleteIndex:
+    """
+    Class responsible for the per-user prefix indexes of a worker.
+    """
+    namespace = "autocomplete"
+
+    def __init__(self, max_users: int, ttl: float, bus=None):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.bus = bus
+        self._indexes: OrderedDict[int, Tuple[float, PrefixIndex]] = OrderedDict()
+        self._building: Dict[int, asyncio.Future] = {}
+        if bus is not None:
+            bus.subscribe(self.namespace, lambda user_id: self.forget(int(user_id)))
+
+    def _loaded(self, user_id: int) -> Optional[PrefixIndex]:
+        entry = self._indexes.get(user_id)
+        if entry is None:
+            return None
+        expires_at, index = entry
+        if expires_at < time.monotonic():
+            del self._indexes[user_id]
+            return None
+        self._indexes.move_to_end(user_id)
+        return index
+
+    def forget(self, user_id: int) -> None:
+        self._indexes.pop(user_id, None)
+
+    async def get(self, user_id: int, loader: Callable[[], Awaitable[Iterable[Suggestion]]]) -> PrefixIndex:
+        """
+        Returns the index of a user, building it with ``loader`` if it is not loaded yet.
+
+        Concurrent requests for the same user share a single build. If the request building the
+        index is cancelled, the requests waiting for it start a new build.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param loader: Coroutine function returning (id, name, surname, email) of every contact.
+        :type loader: Callable
+        :return: The prefix index.
+        :rtype: PrefixIndex
+        """
+        index = self._loaded(user_id)
+        if index is not None:
+            return index
+        building = self._building.get(user_id)
+        if building is not None:
+            try:
+                return await asyncio.shield(building)
+            except asyncio.CancelledError:
+                # Only the request building the index was cancelled: build it for this one instead.
+                if not building.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self.get(user_id, loader)
+        future = asyncio.get_running_loop().create_future()
+        self._building[user_id] = future
+        try:
+            index = PrefixIndex(await loader())
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as err:
+            future.set_exception(err)
+            future.exception()
+            raise
+        finally:
+            del self._building[user_id]
+        self._indexes[user_id] = (time.monotonic() + self.ttl, index)
+        while len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+        future.set_result(index)
+        return index
+
+    async def contact_changed(self, user_id: int, contact: Suggestion) -> None:
+        index = self._loaded(user_id)
+        if index is not None:
+            index.add(contact)
+        await self._notify(user_id)
+
+    async def contact_removed(self, user_id: int, contact_id: int) -> None:
+        index = self._loaded(user_id)
+        if index is not None:
+            index.discard(contact_id)
+        await self._notify(user_id)
+
+    async def contacts_reloaded(self, user_id: int) -> None:
+        """
+        Drops the index of a user on every worker after a bulk change of their contacts.
+        """
+        self.forget(user_id)
+        await self._notify(user_id)
+
+    async def _notify(self, user_id: int) -> None:
+        if self._building.get(user_id) is not None:
+            # A build in progress may have read the contacts before this change.
+            self._building[user_id].add_done_callback(lambda _: self.forget(user_id))
+        if self.bus is not None:
+            await self.bus.publish(self.namespace, user_id, local=False)
+
+
+autocomplete_index = AutocompleteIndex(settings.autocomplete_max_users, settings.autocomplete_ttl, invalidation_bus)
@@ -0,0 +1,100 @@
+"""
+Module Name: avatars.py
+Description: Background processing of uploaded avatars.
+
+The upload route copies the uploaded image into ``AVATAR_SPOOL_DIR`` chunk by chunk on a thread,
+enforcing ``AVATAR_MAX_SIZE`` as it goes, and queues a ``process_avatar`` job. The worker stores the
+image with the configured storage backend, saves its URL on the user and removes the spooled
+file; a job that is dead-lettered removes it as well. The spool directory must be shared by the API
+and the worker processes.
+"""
+import asyncio
+import contextlib
+import os
+import uuid
+from pathlib import Path
+from typing import BinaryIO
+
+from src.database.db import sessionmanager
+from src.database.models import User
+from src.repository import users as repository_users
+from src.services.jobs import job_queue
+from src.services.storage import avatar_storage
+
+
+class AvatarTooLargeError(ValueError):
+    pass
+
+
+def _spool(source: BinaryIO, directory: Path, max_size: int, chunk_size: int) -> Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / uuid.uuid4().hex
+    size = 0
+    try:
+        with open(path, "wb") as target:
+            while chunk := source.read(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise AvatarTooLargeError(f"Avatars are limited to {max_size} bytes")
+                target.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+async def spool_upload(source: BinaryIO, directory: str, max_size: int, chunk_size: int = 64 * 1024) -> Path:
+    """
+    Copies an upload into a new file of the spool directory without blocking the event loop.
+
+    :param source: The uploaded file.
+    :type source: BinaryIO
+    :param directory: The spool directory.
+    :type directory: str
+    :param max_size: The largest accepted upload in bytes.
+    :type max_size: int
+    :param chunk_size: The size of the chunks copied at once.
+    :type chunk_size: int
+    :return: The spooled file.
+    :rtype: Path
+    :raises AvatarTooLargeError: If the upload is larger than ``max_size``; nothing is left behind.
+    """
+    return await asyncio.to_thread(_spool, source, Path(directory), max_size, chunk_size)
+
+
+async def discard_avatar(email: str, path: str) -> None:
+    """
+    Removes the spooled image of an avatar job that was dead-lettered.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        await asyncio.to_thread(os.remove, path)
+
+
+def avatar_key(user: User) -> str:
+    """
+    The storage key of the avatar of a user, unique per user unlike names and stable unlike emails.
+    """
+    return f"NotesApp/{user.id}"
+
+
+@job_queue.task("avatars", on_dead=discard_avatar)
+async def process_avatar(email: str, path: str):
+    """
+    Job storing a spooled avatar and saving its URL on the user.
+
+    :param email: The email of the user.
+    :type email: str
+    :param path: The spooled image.
+    :type path: str
+    :return: The avatar URL as ``{"avatar": url}``, or None if the user no longer exists.
+    :rtype: dict | None
+    """
+    async with sessionmanager.session() as db:
+        user = await repository_users.get_user_by_email(email, db)
+    if user is not None:
+        src_url = await avatar_storage.save(path, avatar_key(user))
+        async with sessionmanager.session() as db:
+            await repository_users.update_avatar(user, src_url, db)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+    return {"avatar": src_url} if user is not None else None
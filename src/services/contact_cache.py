@@ -0,0 +1,168 @@
+"""
+Module Name: contact_cache.py
+Description: Redis cache of serialized contact responses, versioned per user.
+
+Every user has a version in Redis, and cached payloads are keyed by that version. A write to the
+contacts of a user replaces the version with a new random one, which invalidates all of the user's
+cached pages and contacts in O(1); the stale entries are never read again and expire with their TTL.
+
+Versions are random rather than counters, so a version lost to a Redis restart or eviction is
+replaced by one no earlier ETag can match. They expire with the cache TTL as well: if a bump fails
+after a write, the old version is served by other workers for at most that long, while the worker
+that failed stops sending ETags for the user until a bump goes through.
+
+Entries carry a TTL and payloads above a size limit are not cached. Redis errors are logged and
+treated as cache misses.
+
+The version also gives every response a strong ETag, so a conditional request whose tag still
+matches is answered with 304 Not Modified after a single Redis read, without touching the database.
+"""
+import hashlib
+import logging
+import secrets
+from typing import Optional, Set
+
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.db import redis_sessionmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ContactCache:
+    """
+    Class responsible for caching serialized contact responses of users.
+    """
+    def __init__(self, redis, ttl: int, max_entry_size: int):
+        self.r = redis
+        self.ttl = ttl
+        self.max_entry_size = max_entry_size
+        self._unbumped: Set[int] = set()
+
+    @staticmethod
+    def version_key(user_id: int) -> str:
+        return f"contacts:ver:{user_id}"
+
+    @staticmethod
+    def key(user_id: int, version: str, name: str) -> str:
+        return f"contacts:{user_id}:v{version}:{name}"
+
+    async def version(self, user_id: int) -> Optional[str]:
+        """
+        Returns the current contacts version of a user, creating one if there is none.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :return: The version, or None if Redis is unavailable or the last bump of the user failed.
+        :rtype: str | None
+        """
+        if user_id in self._unbumped and not await self._bump(user_id):
+            return None
+        key = self.version_key(user_id)
+        try:
+            version = await self.r.redis.get(key)
+            if version is None:
+                fresh = secrets.token_hex(8)
+                if await self.r.redis.set(key, fresh, ex=self.ttl, nx=True):
+                    return fresh
+                version = await self.r.redis.get(key)
+        except RedisError as err:
+            logger.warning("Could not read the contacts version of user %s: %s", user_id, err)
+            return None
+        return version.decode() if version is not None else None
+
+    async def get(self, user_id: int, version: str, name: str) -> Optional[bytes]:
+        """
+        Looks up a cached payload of a user.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param version: The current version of the user, see ``version``.
+        :type version: str
+        :param name: The name of the entry, unique for the request it answers.
+        :type name: str
+        :return: The cached payload, None for a miss.
+        :rtype: bytes | None
+        """
+        try:
+            return await self.r.redis.get(self.key(user_id, version, name))
+        except RedisError as err:
+            logger.warning("Could not read cached contacts of user %s: %s", user_id, err)
+            return None
+
+    async def set(self, user_id: int, version: Optional[str], name: str, payload: bytes) -> None:
+        """
+        Caches a payload under the version it was read at.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        :param version: The version read before the data was read, None to skip caching.
+        :type version: str | None
+        :param name: The name of the entry.
+        :type name: str
+        :param payload: The serialized response.
+        :type payload: bytes
+        """
+        if version is None or len(payload) > self.max_entry_size:
+            return
+        try:
+            await self.r.redis.set(self.key(user_id, version, name), payload, ex=self.ttl)
+        except RedisError as err:
+            logger.warning("Could not cache contacts of user %s: %s", user_id, err)
+
+    async def bump(self, user_id: int) -> None:
+        """
+        Invalidates every cached contact response of a user. Call it after the change is committed.
+
+        :param user_id: The id of the user.
+        :type user_id: int
+        """
+        await self._bump(user_id)
+
+    async def _bump(self, user_id: int) -> bool:
+        try:
+            await self.r.redis.set(self.version_key(user_id), secrets.token_hex(8), ex=self.ttl)
+        except RedisError as err:
+            logger.warning("Could not bump the contacts version of user %s: %s", user_id, err)
+            self._unbumped.add(user_id)
+            return False
+        self._unbumped.discard(user_id)
+        return True
+
+
+def make_etag(user_id: int, version: str, name: str) -> str:
+    """
+    Builds the strong ETag of a cached contact response.
+
+    :param user_id: The id of the user.
+    :type user_id: int
+    :param version: The contacts version of the user.
+    :type version: str
+    :param name: The name of the cache entry of the response.
+    :type name: str
+    :return: The quoted entity tag.
+    :rtype: str
+    """
+    digest = hashlib.blake2b(f"{user_id}:{version}:{name}".encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Tells whether an If-None-Match header matches an ETag, using the weak comparison RFC 9110 asks for.
+
+    :param if_none_match: The If-None-Match request header.
+    :type if_none_match: str | None
+    :param etag: The current entity tag.
+    :type etag: str
+    :return: True if the client copy is current.
+    :rtype: bool
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+contact_cache = ContactCache(redis_sessionmanager, settings.contact_cache_ttl, settings.contact_cache_max_entry_size)
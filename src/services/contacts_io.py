@@ -0,0 +1,364 @@
+"""
+Module Name: contacts_io.py
+Description: Bulk import and export of contact files in CSV, NDJSON and vCard format.
+
+Uploads are read record by record from the spooled upload file, so memory stays bounded by the batch
+size rather than by the file size. Every record is validated with ``ContactModel``; a record that
+fails validation is reported with its line number instead of aborting the import. Parsing and
+validation are CPU bound and run in the thread pool one batch at a time.
+
+Exports are produced the other way round: contacts streamed from the database a batch at a time are
+serialized into chunks, optionally gzip compressed on the fly, and sent as they are ready.
+"""
+import asyncio
+import csv
+import io
+import json
+import re
+import zlib
+from itertools import islice
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from src.conf.config import settings
+from src.database.models import User
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactModel
+
+CONTACT_FIELDS = ("name", "surname", "email", "phone", "birthday", "description")
+FORMATS = ("csv", "ndjson", "vcard")
+_EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".vcf": "vcard", ".vcard": "vcard"}
+_CONTENT_TYPES = {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/jsonl": "ndjson",
+                  "text/vcard": "vcard", "text/x-vcard": "vcard"}
+
+EXPORT_FIELDS = ("id",) + CONTACT_FIELDS
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "vcard": "text/vcard"}
+FILE_EXTENSIONS = {"csv": "csv", "ndjson": "ndjson", "vcard": "vcf"}
+
+Record = Tuple[int, Dict[str, Any]]
+ValidatedRecord = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+class ContactFileError(ValueError):
+    """
+    Raised when an uploaded file can not be read in the requested format.
+    """
+
+
+def detect_format(filename: str | None, content_type: str | None) -> Optional[str]:
+    """
+    Guesses the format of an upload from its file extension or content type.
+
+    :param filename: The name of the uploaded file.
+    :type filename: str | None
+    :param content_type: The content type of the upload.
+    :type content_type: str | None
+    :return: One of FORMATS or None if it can not be told.
+    :rtype: str | None
+    """
+    if filename:
+        for extension, fmt in _EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                return fmt
+    return _CONTENT_TYPES.get((content_type or "").split(";")[0].strip().lower())
+
+
+def _text(file: BinaryIO) -> io.TextIOWrapper:
+    return io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+
+def read_csv(file: BinaryIO) -> Iterator[Record]:
+    """
+    Reads contacts from a CSV file with a header row naming the columns.
+    """
+    reader = csv.reader(_text(file))
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [column.strip().lower() for column in header]
+    for row in reader:
+        if any(value.strip() for value in row):
+            yield reader.line_num, dict(zip(header, row))
+
+
+def read_ndjson(file: BinaryIO) -> Iterator[Record]:
+    """
+    Reads contacts from a file with one JSON object per line.
+    """
+    for line_number, line in enumerate(_text(file), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else {"__error__": "Not a JSON object"}
+
+
+_VCARD_ESCAPES = re.compile(r"\\([\\;,nN])")
+
+
+def _vcard_value(value: str) -> str:
+    return _VCARD_ESCAPES.sub(lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+
+def _vcard_birthday(value: str) -> str:
+    value = value.strip()
+    if re.fullmatch(r"\d{8}", value):
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return value[:10]
+
+
+def _vcard_lines(file: BinaryIO) -> Iterator[Tuple[int, str]]:
+    """
+    Yields logical vCard lines, joining folded continuation lines to the line they belong to.
+    """
+    pending, pending_number = None, 0
+    for line_number, line in enumerate(_text(file), start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending_number, pending
+        pending, pending_number = line, line_number
+    if pending is not None:
+        yield pending_number, pending
+
+
+def read_vcard(file: BinaryIO) -> Iterator[Record]:
+    """
+    Reads contacts from a vCard (3.0 or 4.0) file, taking N, FN, EMAIL, TEL, BDAY and NOTE.
+    """
+    card, start = None, 0
+    for line_number, line in _vcard_lines(file):
+        prop, _, value = line.partition(":")
+        name = prop.split(";")[0].split(".")[-1].upper()
+        if name == "BEGIN" and value.strip().upper() == "VCARD":
+            card, start = {}, line_number
+        elif card is None:
+            continue
+        elif name == "END":
+            yield start, card
+            card = None
+        elif name == "N":
+            parts = (re.split(r"(?<!\\);", value) + ["", ""])[:2]
+            card.setdefault("surname", _vcard_value(parts[0]))
+            card.setdefault("name", _vcard_value(parts[1]))
+        elif name == "FN":
+            card.setdefault("fn", _vcard_value(value))
+        elif name == "EMAIL":
+            card.setdefault("email", _vcard_value(value))
+        elif name == "TEL":
+            card.setdefault("phone", _vcard_value(value).removeprefix("tel:"))
+        elif name == "BDAY":
+            card.setdefault("birthday", _vcard_birthday(value))
+        elif name == "NOTE":
+            card.setdefault("description", _vcard_value(value))
+    if card is not None:
+        raise ContactFileError(f"Unterminated vCard starting at line {start}")
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson, "vcard": read_vcard}
+
+
+def _clean(value: Any) -> Any:
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _errors(err: ValidationError) -> List[str]:
+    return [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in err.errors()]
+
+
+def validate_record(record: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Validates a raw record with ContactModel.
+
+    Blank and missing fields are stored as NULL instead of taking the model defaults, so rows without
+    a phone do not all collide on the default number.
+
+    :param record: The raw record read from the file.
+    :type record: dict
+    :return: The contact values, or None and the reason the record was rejected.
+    :rtype: tuple
+    """
+    if "__error__" in record:
+        return None, record["__error__"]
+    values = {field: _clean(record.get(field)) for field in CONTACT_FIELDS}
+    if values["name"] is None and values["surname"] is None and record.get("fn"):
+        values["name"] = _clean(record["fn"])
+    try:
+        return ContactModel(**values).model_dump(), None
+    except ValidationError as err:
+        return None, "; ".join(_errors(err))
+
+
+def validated_records(file: BinaryIO, fmt: str) -> Iterator[ValidatedRecord]:
+    """
+    Reads and validates the records of a contact file one by one.
+
+    :param file: The binary file object of the upload.
+    :type file: BinaryIO
+    :param fmt: One of FORMATS.
+    :type fmt: str
+    :return: (line number, contact values or None, error or None) per record.
+    :rtype: Iterator
+    :raises ContactFileError: If the file is not readable in the given format.
+    """
+    try:
+        for line_number, record in READERS[fmt](file):
+            values, error = validate_record(record)
+            yield line_number, values, error
+    except (UnicodeDecodeError, csv.Error) as err:
+        raise ContactFileError(f"Malformed {fmt} file: {err}") from err
+
+
+async def record_batches(file: BinaryIO, fmt: str, batch_size: int) -> AsyncIterator[List[ValidatedRecord]]:
+    """
+    Reads validated records in batches, parsing every batch in the thread pool.
+
+    The next batch is parsed while the caller processes the current one.
+    """
+    records = validated_records(file, fmt)
+    pending = asyncio.ensure_future(run_in_threadpool(lambda: list(islice(records, batch_size))))
+    try:
+        while True:
+            batch = await pending
+            if not batch:
+                return
+            pending = asyncio.ensure_future(run_in_threadpool(lambda: list(islice(records, batch_size))))
+            yield batch
+    finally:
+        # Let a batch still being parsed finish before the records generator can be closed.
+        await asyncio.wait([pending])
+
+
+async def import_contacts(file: BinaryIO, fmt: str, db: AsyncSession, user: User,
+                          batch_size: int = settings.contact_import_batch_size,
+                          max_errors: int = settings.contact_import_max_errors) -> Dict[str, Any]:
+    """
+    Imports the contacts of a file for a user in batches, collecting the rejected records.
+
+    A record is rejected when it fails validation, repeats a phone number seen earlier in the file,
+    or its phone number already belongs to a stored contact.
+
+    :param file: The binary file object of the upload.
+    :type file: BinaryIO
+    :param fmt: One of FORMATS.
+    :type fmt: str
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :param user: The User instance representing the user.
+    :type user: User
+    :param batch_size: The number of records validated and inserted at a time.
+    :type batch_size: int
+    :param max_errors: The maximum number of rejected records listed in the report.
+    :type max_errors: int
+    :return: The numbers of received, imported and failed records and the first errors.
+    :rtype: dict
+    :raises ContactFileError: If the file is not readable in the given format.
+    """
+    report = {"received": 0, "imported": 0, "failed": 0, "errors": []}
+    seen_phones = set()
+    async for batch in record_batches(file, fmt, batch_size):
+        rows, phone_lines, errors = [], {}, []
+        for line_number, values, error in batch:
+            report["received"] += 1
+            if error is None and values["phone"] is not None:
+                if values["phone"] in seen_phones:
+                    error = "phone: Appears earlier in the file"
+                else:
+                    seen_phones.add(values["phone"])
+                    phone_lines[values["phone"]] = line_number
+            if error is not None:
+                errors.append((line_number, error))
+            else:
+                rows.append(values)
+        inserted = await repository_contacts.insert_contacts(rows, db, user)
+        report["imported"] += len(inserted)
+        errors.extend((phone_lines[phone], "phone: Already used by another contact")
+                      for phone in phone_lines.keys() - set(inserted))
+        report["failed"] += len(errors)
+        for line_number, error in sorted(errors)[:max_errors - len(report["errors"])]:
+            report["errors"].append({"line": line_number, "error": error})
+    return report
+
+
+def _csv_lines(rows: Sequence) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([getattr(row, field) for field in EXPORT_FIELDS] for row in rows)
+    return buffer.getvalue()
+
+
+def _ndjson_lines(rows: Sequence) -> str:
+    return "".join(json.dumps({field: getattr(row, field) for field in EXPORT_FIELDS}, default=str) + "\n"
+                   for row in rows)
+
+
+def _vcard_escape(value: Any) -> str:
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace(",", "\\,").replace(";", "\\;"))
+
+
+def _vcard_fold(line: str) -> str:
+    return "\r\n ".join(line[i:i + 74] for i in range(0, len(line), 74)) + "\r\n"
+
+
+def _vcard(row) -> str:
+    full_name = " ".join(part for part in (row.name, row.surname) if part)
+    lines = ["BEGIN:VCARD", "VERSION:3.0",
+             f"N:{_vcard_escape(row.surname or '')};{_vcard_escape(row.name or '')};;;",
+             f"FN:{_vcard_escape(full_name)}"]
+    for prop, value in (("TEL", row.phone), ("EMAIL", row.email), ("BDAY", row.birthday),
+                        ("NOTE", row.description)):
+        if value is not None:
+            lines.append(f"{prop}:{_vcard_escape(value)}")
+    lines.append("END:VCARD")
+    return "".join(_vcard_fold(line) for line in lines)
+
+
+def _vcard_cards(rows: Sequence) -> str:
+    return "".join(_vcard(row) for row in rows)
+
+
+SERIALIZERS: Dict[str, Tuple[str, Callable[[Sequence], str]]] = {
+    "csv": (",".join(EXPORT_FIELDS) + "\r\n", _csv_lines),
+    "ndjson": ("", _ndjson_lines),
+    "vcard": ("", _vcard_cards),
+}
+
+
+async def export_chunks(batches: AsyncIterator[Sequence], fmt: str, compress: bool = False) -> AsyncIterator[bytes]:
+    """
+    Serializes batches of contacts into chunks of a contact file.
+
+    :param batches: Batches of rows with the contact columns.
+    :type batches: AsyncIterator
+    :param fmt: One of FORMATS.
+    :type fmt: str
+    :param compress: Whether to gzip the output.
+    :type compress: bool
+    :return: The chunks of the file, one per batch.
+    :rtype: AsyncIterator
+    """
+    header, serialize = SERIALIZERS[fmt]
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor is not None else data
+
+    if header:
+        yield encode(header)
+    async for rows in batches:
+        chunk = encode(serialize(rows))
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
@@ -1,47 +1,47 @@
-from pathlib import Path
+import logging
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+from redis.exceptions import RedisError
 
 from src.services.auth import auth_service
+from src.services.jobs import job_queue
+from src.services.mailer import mailer, render_message
 from src.database.models import User
 
-from src.conf.config import settings
+logger = logging.getLogger(__name__)
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME=settings.mail_from_name,
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+
+@job_queue.task("email")
+async def send_verification_email(email: str, name: str, host: str):
+    """
+    Job delivering the verification email of a user. The mailer makes a single attempt and the job
+    raises if it fails, so retries are left to the job queue.
+
+    :param email: The address of the user.
+    :type email: str
+    :param name: The name of the user.
+    :type name: str
+    :param host: The hostname or URL where the verification link will point to.
+    :type host: str
+    """
+    token_verification = await auth_service.create_email_token(User(email=email, name=name))
+    message = render_message(email, "Confirm your email ", "email_template.html",
+                             host=host, username=name, token=token_verification)
+    await mailer.send(message, max_attempts=1)
 
 
 async def send_email(user: User, host: str):
     """
     Email verify the user's email address.
 
+    The email is sent by a background job in the worker process. If the job cannot be queued the
+    error is logged and the user can request the email again.
+
     :param user: The user object for whom the email verification is being sent.
     :type user: User
     :param host: The hostname or URL where the verification link will point to.
     :type host: str
     """
     try:
-        token_verification = await auth_service.create_email_token(user)
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[user.email],
-            template_body={"host": host, "name": user.name, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+        await job_queue.enqueue("send_verification_email", user.email, user.name, host)
+    except RedisError as err:
+        logger.error("Could not queue the verification email of %s: %s", user.email, err)
@@ -0,0 +1,94 @@
+"""
+Module Name: invalidation.py
+Description: Broadcasts cache invalidations to every application worker over Redis pub/sub.
+
+In-process caches register a callback for a namespace. Publishing ``namespace:key`` runs the
+callbacks of the local worker right away and, through the Redis channel, those of every other
+worker, so per-worker copies are dropped as soon as the source data changes. Messages carry the id
+of the publishing worker, which ignores its own echo.
+"""
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from redis.exceptions import RedisError
+
+from src.database.db import redis_sessionmanager
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus:
+    """
+    Class responsible for publishing and dispatching cache invalidation messages.
+    """
+    def __init__(self, redis, channel: str = "cache:invalidate"):
+        self.r = redis
+        self.channel = channel
+        self._callbacks: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._task: Optional[asyncio.Task] = None
+        self.origin = uuid.uuid4().hex
+
+    def subscribe(self, namespace: str, callback: Callable[[str], None]) -> None:
+        self._callbacks[namespace].append(callback)
+
+    def dispatch(self, message: str) -> None:
+        namespace, _, key = message.partition(":")
+        for callback in self._callbacks.get(namespace, ()):
+            callback(key)
+
+    def receive(self, data: str) -> None:
+        origin, _, message = data.partition(" ")
+        if origin != self.origin:
+            self.dispatch(message)
+
+    async def publish(self, namespace: str, key, local: bool = True) -> None:
+        """
+        Invalidates ``key`` of ``namespace`` on every worker.
+
+        :param namespace: The cache namespace.
+        :type namespace: str
+        :param key: The invalidated key.
+        :param local: Whether to run the callbacks of this worker too, False when the caller
+            already updated its local copy.
+        :type local: bool
+        """
+        message = f"{namespace}:{key}"
+        if local:
+            self.dispatch(message)
+        try:
+            await self.r.redis.publish(self.channel, f"{self.origin} {message}")
+        except RedisError as err:
+            logger.warning("Could not publish cache invalidation %s: %s", message, err)
+
+    async def listen(self) -> None:
+        while True:
+            pubsub = self.r.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    data = message["data"]
+                    self.receive(data.decode() if isinstance(data, bytes) else data)
+            except RedisError as err:
+                logger.warning("Cache invalidation listener disconnected: %s", err)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+invalidation_bus = InvalidationBus(redis_sessionmanager)
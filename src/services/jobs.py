@@ -0,0 +1,382 @@
+"""
+Module Name: jobs.py
+Description: Durable background jobs on Redis, run by the separate worker process (worker.py).
+
+A job is a hash ``jobs:job:<id>`` holding the task name, its JSON arguments and its state, and its
+id moves between the lists and sorted sets of its queue:
+
+- ``jobs:<queue>:ready``: jobs waiting for a worker, in FIFO order.
+- ``jobs:<queue>:processing``: jobs a worker has taken; BLMOVE takes a job atomically, so a worker
+  dying right after it still leaves the id here.
+- ``jobs:<queue>:deadlines``: the visibility deadline of every taken job. Workers extend it while a
+  job runs; once it passes, the job is considered lost and retried.
+- ``jobs:<queue>:delayed``: failed jobs waiting for their retry time.
+- ``jobs:<queue>:dead``: jobs that failed ``max_attempts`` times, kept for inspection.
+
+Jobs run at least once: a job whose worker stalls past its deadline may run again, so task
+handlers must be idempotent. Finished job records are kept for ``result_ttl`` seconds so clients
+can poll their status. A task can register an ``on_dead`` handler releasing what its jobs hold,
+such as spooled files; it is called with the job arguments when a job is dead-lettered.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.db import redis_sessionmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Task:
+    """
+    A registered job handler.
+    """
+    def __init__(self, func: Callable[..., Awaitable[Any]], name: str, queue: str, max_attempts: int,
+                 on_dead: Optional[Callable[..., Awaitable[Any]]] = None):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.on_dead = on_dead
+
+
+class JobQueue:
+    """
+    Class responsible for storing, handing out and settling background jobs in Redis.
+    """
+    def __init__(self, redis, prefix: str = "jobs", visibility_timeout: float = 60, max_attempts: int = 5,
+                 retry_backoff: float = 5, result_ttl: int = 86400, dead_ttl: int = 604800):
+        self.r = redis
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.result_ttl = result_ttl
+        self.dead_ttl = dead_ttl
+        self.tasks: Dict[str, Task] = {}
+
+    def job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def queue_key(self, queue: str, name: str) -> str:
+        return f"{self.prefix}:{queue}:{name}"
+
+    def task(self, queue: str, name: Optional[str] = None, max_attempts: Optional[int] = None,
+             on_dead: Optional[Callable[..., Awaitable[Any]]] = None):
+        """
+        Registers a coroutine function as the handler of a task.
+
+        :param queue: The queue the jobs of the task go to.
+        :type queue: str
+        :param name: The task name, the function name by default.
+        :type name: str | None
+        :param max_attempts: How often a job is tried before it is dead-lettered.
+        :type max_attempts: int | None
+        :param on_dead: Coroutine function called with the job arguments when a job is dead-lettered.
+        :type on_dead: Callable | None
+        :return: A decorator returning the function unchanged.
+        """
+        def register(func):
+            task_name = name or func.__name__
+            self.tasks[task_name] = Task(func, task_name, queue, max_attempts or self.max_attempts, on_dead)
+            return func
+        return register
+
+    async def enqueue(self, name: str, *args, owner: Optional[str] = None, **kwargs) -> str:
+        """
+        Stores a job and queues it.
+
+        :param name: The name of a registered task.
+        :type name: str
+        :param args: JSON serializable positional arguments of the handler.
+        :param owner: Who may read the status of the job; stored with it, not passed to the handler.
+        :type owner: str | None
+        :param kwargs: JSON serializable keyword arguments of the handler.
+        :return: The job id.
+        :rtype: str
+        :raises RedisError: If the job could not be stored.
+        """
+        task = self.tasks[name]
+        job_id = uuid.uuid4().hex
+        record = {"name": name, "queue": task.queue, "payload": json.dumps({"args": args, "kwargs": kwargs}),
+                  "attempts": 0, "max_attempts": task.max_attempts, "status": "queued", "enqueued_at": time.time()}
+        if owner is not None:
+            record["owner"] = owner
+        async with self.r.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.job_key(job_id), mapping=record)
+            pipe.lpush(self.queue_key(task.queue, "ready"), job_id)
+            await pipe.execute()
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads the state of a job.
+
+        :param job_id: The job id.
+        :type job_id: str
+        :return: The status, owner, attempts, error and result of the job, None if it is unknown or expired.
+        :rtype: dict | None
+        """
+        record = await self.r.redis.hgetall(self.job_key(job_id))
+        if not record:
+            return None
+        record = {key.decode(): value.decode() for key, value in record.items()}
+        return {"id": job_id, "name": record["name"], "status": record["status"], "owner": record.get("owner"),
+                "attempts": int(record["attempts"]), "error": record.get("error"),
+                "result": json.loads(record["result"]) if "result" in record else None}
+
+    async def reserve(self, queue: str, timeout: float = 1) -> Optional[Dict[str, Any]]:
+        """
+        Takes the next job of a queue, waiting up to ``timeout`` seconds for one.
+
+        :param queue: The queue name.
+        :type queue: str
+        :param timeout: The longest time to block.
+        :type timeout: float
+        :return: The job, or None if the queue stayed empty.
+        :rtype: dict | None
+        """
+        processing = self.queue_key(queue, "processing")
+        job_id = await self.r.redis.blmove(self.queue_key(queue, "ready"), processing, timeout, "RIGHT", "LEFT")
+        if job_id is None:
+            return None
+        job_id = job_id.decode()
+        key = self.job_key(job_id)
+        async with self.r.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.queue_key(queue, "deadlines"), {job_id: time.time() + self.visibility_timeout})
+            pipe.hmget(key, "name", "payload", "status", "max_attempts")
+            _, (name, payload, status, max_attempts) = await pipe.execute()
+        if name is None or status == b"done":
+            # Expired, or already finished by a worker that was presumed lost.
+            await self._settle(queue, job_id)
+            return None
+        async with self.r.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, "attempts", 1)
+            pipe.hset(key, "status", "running")
+            attempts, _ = await pipe.execute()
+        payload = json.loads(payload)
+        return {"id": job_id, "name": name.decode(), "queue": queue, "args": payload["args"],
+                "kwargs": payload["kwargs"], "attempts": attempts, "max_attempts": int(max_attempts)}
+
+    async def _settle(self, queue: str, job_id: str, *commands: Callable) -> bool:
+        """
+        Removes a taken job from its queue and runs ``commands`` on the same transaction, unless the
+        reaper took the job over first.
+        """
+        deadlines = self.queue_key(queue, "deadlines")
+
+        async def settle(pipe):
+            if await pipe.zscore(deadlines, job_id) is None:
+                return False
+            pipe.multi()
+            pipe.lrem(self.queue_key(queue, "processing"), 1, job_id)
+            pipe.zrem(deadlines, job_id)
+            for command in commands:
+                command(pipe)
+            return True
+
+        return await self.r.redis.transaction(settle, deadlines, value_from_callable=True)
+
+    async def extend(self, job: Dict[str, Any]) -> None:
+        """
+        Pushes the visibility deadline of a running job forward.
+        """
+        await self.r.redis.zadd(self.queue_key(job["queue"], "deadlines"),
+                                {job["id"]: time.time() + self.visibility_timeout}, xx=True)
+
+    async def complete(self, job: Dict[str, Any], result: Any = None) -> None:
+        """
+        Marks a job as done and keeps its result for ``result_ttl`` seconds.
+        """
+        key = self.job_key(job["id"])
+
+        def done(pipe):
+            pipe.hset(key, mapping={"status": "done", "result": json.dumps(result)})
+            pipe.hdel(key, "error")
+            pipe.expire(key, self.result_ttl)
+
+        if not await self._settle(job["queue"], job["id"], done):
+            # The job was already requeued; the status lets the next worker skip it.
+            async with self.r.redis.pipeline(transaction=True) as pipe:
+                done(pipe)
+                await pipe.execute()
+
+    def _retry_or_bury(self, queue: str, job_id: str, attempts: int, max_attempts: int, error: str):
+        key = self.job_key(job_id)
+
+        def retry_or_bury(pipe):
+            if attempts < max_attempts:
+                retry_at = time.time() + self.retry_backoff * 2 ** (attempts - 1)
+                pipe.zadd(self.queue_key(queue, "delayed"), {job_id: retry_at})
+                pipe.hset(key, mapping={"status": "retrying", "error": error})
+            else:
+                pipe.lpush(self.queue_key(queue, "dead"), job_id)
+                pipe.hset(key, mapping={"status": "dead", "error": error})
+                pipe.expire(key, self.dead_ttl)
+        return retry_or_bury
+
+    async def _buried(self, name: str, args: List[Any], kwargs: Dict[str, Any]) -> None:
+        task = self.tasks.get(name)
+        if task is None or task.on_dead is None:
+            return
+        try:
+            await task.on_dead(*args, **kwargs)
+        except Exception:
+            logger.exception("Cleaning up after dead %s job failed", name)
+
+    async def fail(self, job: Dict[str, Any], error: str) -> None:
+        """
+        Schedules a failed job for a retry with exponential backoff, or dead-letters it after its
+        last attempt.
+        """
+        retry_or_bury = self._retry_or_bury(job["queue"], job["id"], job["attempts"], job["max_attempts"], error)
+        if await self._settle(job["queue"], job["id"], retry_or_bury) and job["attempts"] >= job["max_attempts"]:
+            await self._buried(job["name"], job["args"], job["kwargs"])
+
+    async def requeue_expired(self, queue: str) -> int:
+        """
+        Fails the taken jobs of a queue whose visibility deadline passed.
+
+        :return: The number of jobs taken over.
+        :rtype: int
+        """
+        now = time.time()
+        deadlines = self.queue_key(queue, "deadlines")
+        processing = await self.r.redis.lrange(self.queue_key(queue, "processing"), 0, -1)
+        if not processing:
+            return 0
+        scores = await self.r.redis.zmscore(deadlines, processing)
+        expired = 0
+        for job_id, deadline in zip(processing, scores):
+            job_id = job_id.decode()
+            if deadline is None:
+                # Taken but not stamped yet, or its worker died in between: give it a full timeout.
+                await self.r.redis.zadd(deadlines, {job_id: now + self.visibility_timeout}, nx=True)
+                continue
+            if deadline > now:
+                continue
+            name, payload, attempts, max_attempts = await self.r.redis.hmget(self.job_key(job_id), "name", "payload",
+                                                                             "attempts", "max_attempts")
+            if attempts is None:
+                await self._settle(queue, job_id)
+                continue
+            attempts, max_attempts = int(attempts), int(max_attempts)
+            if await self._settle(queue, job_id, self._retry_or_bury(queue, job_id, attempts, max_attempts,
+                                                                     "Visibility timeout expired")):
+                logger.warning("Job %s on %s timed out after %s attempts", job_id, queue, attempts)
+                expired += 1
+                if attempts >= max_attempts:
+                    payload = json.loads(payload)
+                    await self._buried(name.decode(), payload["args"], payload["kwargs"])
+        return expired
+
+    async def promote_due(self, queue: str, limit: int = 100) -> int:
+        """
+        Moves the delayed jobs of a queue whose retry time came back to the ready list.
+
+        :return: The number of jobs moved.
+        :rtype: int
+        """
+        delayed = self.queue_key(queue, "delayed")
+        due = await self.r.redis.zrangebyscore(delayed, "-inf", time.time(), start=0, num=limit)
+        moved = 0
+        for job_id in due:
+            async def promote(pipe):
+                if await pipe.zscore(delayed, job_id) is None:
+                    return False
+                pipe.multi()
+                pipe.zrem(delayed, job_id)
+                pipe.lpush(self.queue_key(queue, "ready"), job_id)
+                return True
+
+            moved += await self.r.redis.transaction(promote, delayed, value_from_callable=True)
+        return moved
+
+
+class Worker:
+    """
+    Runs the jobs of several queues with a fixed number of concurrent jobs per queue.
+    """
+    def __init__(self, jobs: JobQueue, concurrency: Dict[str, int], poll_timeout: float = 1,
+                 maintenance_interval: float = 1, idle_sleep: float = 0.05):
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.poll_timeout = poll_timeout
+        self.maintenance_interval = maintenance_interval
+        self.idle_sleep = idle_sleep
+        self._stopping = asyncio.Event()
+
+    async def process(self, job: Dict[str, Any]) -> None:
+        """
+        Runs one job, extending its visibility deadline while it runs, and settles it.
+        """
+        task = self.jobs.tasks.get(job["name"])
+        if task is None:
+            await self.jobs.fail({**job, "attempts": job["max_attempts"]}, f"Unknown task {job['name']}")
+            return
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            result = await task.func(*job["args"], **job["kwargs"])
+        except Exception as err:
+            logger.exception("Job %s (%s) failed on attempt %s of %s", job["id"], job["name"], job["attempts"],
+                             job["max_attempts"])
+            heartbeat.cancel()
+            await self.jobs.fail(job, f"{type(err).__name__}: {err}")
+        else:
+            heartbeat.cancel()
+            await self.jobs.complete(job, result)
+
+    async def _heartbeat(self, job: Dict[str, Any]) -> None:
+        while True:
+            await asyncio.sleep(self.jobs.visibility_timeout / 3)
+            try:
+                await self.jobs.extend(job)
+            except RedisError as err:
+                logger.warning("Could not extend job %s: %s", job["id"], err)
+
+    async def consume(self, queue: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await self.jobs.reserve(queue, self.poll_timeout)
+                if job is None:
+                    await asyncio.sleep(self.idle_sleep)
+                    continue
+                await self.process(job)
+            except RedisError as err:
+                logger.warning("Job queue %s unavailable: %s", queue, err)
+                await asyncio.sleep(self.poll_timeout)
+
+    async def maintain(self) -> None:
+        while not self._stopping.is_set():
+            for queue in self.concurrency:
+                try:
+                    await self.jobs.requeue_expired(queue)
+                    await self.jobs.promote_due(queue)
+                except RedisError as err:
+                    logger.warning("Job queue %s maintenance failed: %s", queue, err)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.maintenance_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> None:
+        """
+        Runs until ``stop`` is called; running jobs are finished first.
+        """
+        consumers: List[Awaitable] = [self.consume(queue) for queue, count in self.concurrency.items()
+                                      for _ in range(count)]
+        await asyncio.gather(self.maintain(), *consumers)
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+
+job_queue = JobQueue(redis_sessionmanager, visibility_timeout=settings.jobs_visibility_timeout,
+                     max_attempts=settings.jobs_max_attempts, retry_backoff=settings.jobs_retry_backoff,
+                     result_ttl=settings.jobs_result_ttl, dead_ttl=settings.jobs_dead_ttl)
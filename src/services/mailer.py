@@ -0,0 +1,268 @@
+"""
+Module Name: mailer.py
+Description: Queued email delivery over a small pool of persistent SMTP connections.
+
+Messages are put on a bounded asyncio queue and delivered by ``pool_size`` worker tasks, each
+holding one SMTP connection open between messages, so at most ``pool_size`` connections are open
+and a burst of signups does not pay a TLS handshake and login per email. A worker takes up to
+``batch_size`` queued messages at once and sends them one after another over its connection.
+
+Connection failures and temporary (4xx) replies are retried with exponential backoff and jitter on a
+fresh connection; permanent (5xx) replies are not. A message waiting for a retry goes back on the
+queue after its delay instead of holding up the rest of its batch. Every failure is logged, and
+``send`` raises the final error to callers that wait for the delivery; callers that retry on their
+own, such as jobs, pass ``max_attempts=1``. Connections idle for longer than ``idle_timeout`` are
+reopened before use instead of tripping over a connection the server has already dropped.
+"""
+import asyncio
+import logging
+import random
+import socket
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
+from pathlib import Path
+from typing import List, Optional, Set
+
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+templates = Environment(loader=FileSystemLoader(Path(__file__).parent / "templates"),
+                        autoescape=select_autoescape(["html"]))
+
+
+class _Delivery:
+    __slots__ = ("message", "future", "attempt", "max_attempts")
+
+    def __init__(self, message: EmailMessage, future: Optional[asyncio.Future], max_attempts: int):
+        self.message = message
+        self.future = future
+        self.attempt = 1
+        self.max_attempts = max_attempts
+
+    def settle(self, err: Optional[BaseException] = None) -> None:
+        if self.future is None or self.future.done():
+            return
+        if err is None:
+            self.future.set_result(None)
+        else:
+            self.future.set_exception(err)
+
+
+def render_message(recipient: str, subject: str, template_name: str, **context) -> EmailMessage:
+    """
+    Builds an HTML message from a template.
+
+    :param recipient: The address of the recipient.
+    :type recipient: str
+    :param subject: The subject line.
+    :type subject: str
+    :param template_name: The name of the template in the templates folder.
+    :type template_name: str
+    :param context: The template variables.
+    :return: The message, without a sender.
+    :rtype: EmailMessage
+    """
+    message = EmailMessage()
+    message["To"] = recipient
+    message["Subject"] = subject
+    message.set_content(templates.get_template(template_name).render(**context), subtype="html")
+    return message
+
+
+def is_permanent(err: Exception) -> bool:
+    return isinstance(err, aiosmtplib.SMTPResponseException) and err.code >= 500
+
+
+class SMTPConnection:
+    """
+    A lazily opened SMTP connection that is reopened after errors and long idle periods.
+    """
+    def __init__(self, mailer: "Mailer"):
+        self.mailer = mailer
+        self.smtp: Optional[aiosmtplib.SMTP] = None
+        self.last_used = 0.0
+
+    async def get(self) -> aiosmtplib.SMTP:
+        if self.smtp is not None and (not self.smtp.is_connected
+                                      or time.monotonic() - self.last_used > self.mailer.idle_timeout):
+            await self.close()
+        if self.smtp is None:
+            smtp = aiosmtplib.SMTP(**await self.mailer.connection_options())
+            await smtp.connect()
+            self.smtp = smtp
+        self.last_used = time.monotonic()
+        return self.smtp
+
+    async def close(self) -> None:
+        smtp, self.smtp = self.smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+
+class Mailer:
+    """
+    Class responsible for queueing emails and delivering them over pooled SMTP connections.
+    """
+    def __init__(self, hostname: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 sender: Optional[str] = None, use_tls: bool = False, start_tls: Optional[bool] = None,
+                 validate_certs: bool = True, timeout: float = 30, pool_size: int = 2, batch_size: int = 20,
+                 queue_size: int = 1000, max_attempts: int = 5, backoff: float = 1, idle_timeout: float = 60):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.validate_certs = validate_certs
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._workers: List[asyncio.Task] = []
+        self._retries: Set[asyncio.Task] = set()
+        self._local_hostname: Optional[str] = None
+
+    async def connection_options(self) -> dict:
+        if self._local_hostname is None:
+            # aiosmtplib would resolve it with a blocking getfqdn on every connect.
+            self._local_hostname = await asyncio.get_running_loop().run_in_executor(None, socket.getfqdn)
+        return dict(hostname=self.hostname, port=self.port, username=self.username, password=self.password,
+                    use_tls=self.use_tls, start_tls=self.start_tls, validate_certs=self.validate_certs,
+                    timeout=self.timeout, local_hostname=self._local_hostname)
+
+    async def enqueue(self, message: EmailMessage) -> None:
+        """
+        Queues a message for delivery without waiting for it. Failed deliveries are logged.
+
+        :param message: The message; its sender defaults to the configured one.
+        :type message: EmailMessage
+        """
+        await self.queue.put(_Delivery(self._prepare(message), None, self.max_attempts))
+
+    async def send(self, message: EmailMessage, max_attempts: Optional[int] = None) -> None:
+        """
+        Queues a message and waits until it is delivered.
+
+        :param message: The message; its sender defaults to the configured one.
+        :type message: EmailMessage
+        :param max_attempts: The number of delivery attempts, defaults to the configured one.
+        :type max_attempts: int | None
+        :raises aiosmtplib.SMTPException: If the message was refused or every attempt failed.
+        :raises OSError: If the server could not be reached on the last attempt.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(_Delivery(self._prepare(message), future, max_attempts or self.max_attempts))
+        await future
+
+    def _prepare(self, message: EmailMessage) -> EmailMessage:
+        if "From" not in message and self.sender:
+            message["From"] = self.sender
+        return message
+
+    async def _deliver(self, connection: SMTPConnection, delivery: _Delivery) -> None:
+        message = delivery.message
+        try:
+            smtp = await connection.get()
+            await smtp.send_message(message)
+        except Exception as err:
+            await connection.close()
+            retryable = isinstance(err, (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError))
+            if not retryable or is_permanent(err) or delivery.attempt >= delivery.max_attempts:
+                logger.error("Could not send email to %s: %s", message["To"], err)
+                delivery.settle(err)
+                return
+            delay = self.backoff * 2 ** (delivery.attempt - 1) * random.uniform(0.5, 1)
+            logger.warning("Sending email to %s failed (attempt %d of %d), retrying in %.1fs: %s",
+                           message["To"], delivery.attempt, delivery.max_attempts, delay, err)
+            delivery.attempt += 1
+            task = asyncio.create_task(self._requeue(delivery, delay))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+            return
+        delivery.settle()
+
+    async def _requeue(self, delivery: _Delivery, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+            await self.queue.put(delivery)
+        except asyncio.CancelledError:
+            if delivery.future is not None:
+                delivery.future.cancel()
+            raise
+
+    async def _batch(self) -> List[_Delivery]:
+        batch = [await self.queue.get()]
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _worker(self) -> None:
+        connection = SMTPConnection(self)
+        try:
+            while True:
+                batch = await self._batch()
+                try:
+                    for delivery in batch:
+                        await self._deliver(connection, delivery)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+        finally:
+            await connection.close()
+
+    async def _drain(self) -> None:
+        while True:
+            await self.queue.join()
+            if not self._retries:
+                return
+            await asyncio.wait(self._retries)
+
+    def start(self) -> None:
+        """
+        Starts the delivery workers.
+        """
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.pool_size)]
+
+    async def stop(self, timeout: float = 10) -> None:
+        """
+        Delivers the queued messages and their retries, waiting up to ``timeout`` seconds, then closes
+        the connections. Callers still waiting for a retry when it times out are cancelled.
+
+        :param timeout: The longest time to wait for the queue to drain.
+        :type timeout: float
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Mailer stopped with %d emails still queued and %d waiting for a retry",
+                           self.queue.qsize(), len(self._retries))
+        tasks = [*self._workers, *self._retries]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+
+
+mailer = Mailer(settings.mail_server, settings.mail_port, settings.mail_username, settings.mail_password,
+                sender=formataddr((settings.mail_from_name, settings.mail_from)),
+                use_tls=settings.mail_ssl_tls, start_tls=settings.mail_starttls,
+                validate_certs=settings.mail_validate_certs, timeout=settings.mail_timeout,
+                pool_size=settings.mail_pool_size, batch_size=settings.mail_batch_size,
+                queue_size=settings.mail_queue_size, max_attempts=settings.mail_max_attempts,
+                backoff=settings.mail_retry_backoff, idle_timeout=settings.mail_idle_timeout)
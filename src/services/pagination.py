@@ -0,0 +1,51 @@
+"""
+Module Name: pagination.py
+Description: Opaque cursor helpers for keyset pagination of list endpoints.
+
+A cursor is the url-safe base64 encoding of a small JSON document holding the sort key
+of the last row a client has seen. Clients treat it as an opaque string and pass it back
+unchanged to get the next page.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Dict
+
+
+class InvalidCursorError(ValueError):
+    """
+    Raised when a cursor can not be decoded.
+    """
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    """
+    Encodes a sort key into an opaque cursor string.
+
+    :param data: The sort key values of the last returned row.
+    :type data: dict
+    :return: The opaque cursor.
+    :rtype: str
+    """
+    raw = json.dumps(data, separators=(",", ":"), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Decodes an opaque cursor string back into its sort key.
+
+    :param cursor: The cursor received from a client.
+    :type cursor: str
+    :return: The sort key values.
+    :rtype: dict
+    :raises InvalidCursorError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (binascii.Error, ValueError) as err:
+        raise InvalidCursorError("Invalid cursor") from err
+    if not isinstance(data, dict):
+        raise InvalidCursorError("Invalid cursor")
+    return data
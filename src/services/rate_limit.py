@@ -0,0 +1,266 @@
+"""
+Module Name: rate_limit.py
+Description: Rate limiter deciding most requests in process, with the budget shared through Redis.
+
+``fastapi_limiter.RateLimiter`` runs a Lua script in Redis for every request. HybridRateLimiter keeps
+the same contract, at most ``times`` requests per key in a fixed window of ``seconds``, but every
+worker leases a batch of the window's tokens from Redis at once and spends them locally. A worker
+goes back to Redis only when its batch runs out, so with a lease of ``n`` tokens one request in
+``n`` pays the round trip. Redis never hands out more than ``times`` tokens per window, so the limit
+holds across all workers; tokens still leased when a window ends are lost, which can only admit
+fewer requests than the limit, never more.
+
+Once Redis reports the window as spent, the worker rejects the key locally until the window ends.
+The lease is a fraction of ``times`` (``RATE_LIMIT_LEASE_FRACTION``) but at least
+``RATE_LIMIT_MIN_LEASE`` tokens, and never more than half the limit: 10 per minute leases 3 tokens,
+5 per minute 2, and only limits below 4 go to Redis for every request.
+
+Leasing under-admits when the requests of one key are spread over several workers: tokens leased by
+a worker can only be spent there, so another worker may reject a request while they are unused.
+With ``W`` workers serving a key, up to ``W * (lease - 1)`` requests of a window can be rejected
+below the limit. The limit itself is never exceeded.
+
+If Redis is unavailable the worker falls back to counting the window on its own, which enforces
+the limit per worker instead of failing every request. The Redis client, key prefix, identifier
+and 429 callback come from ``FastAPILimiter.init``.
+
+``user_identifier`` keys requests on the subject of their bearer token instead of the client
+address, so users behind one proxy get separate budgets and a token spread over many addresses
+shares one. The limit of a route is scaled by the multiplier of the user's plan in
+``RATE_LIMIT_PLANS``; the plan comes from the user cache, or from the primary database when the user
+is not cached, so a user always gets the same limit. The limit is not part of the rate key: a plan
+change applies to the budget already spent in the window. Requests without a valid token are keyed
+by address and get the default plan. Keys hold the route template rather than the request path, so
+path parameters do not open a new budget.
+"""
+import logging
+import math
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Depends
+from fastapi_limiter import FastAPILimiter
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.conf.config import settings
+from src.database.db import get_db
+from src.repository import users as repository_users
+from src.services.auth import jwt_manager
+from src.services.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+LEASE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local granted = math.min(tonumber(ARGV[3]), limit - used)
+if granted <= 0 then
+    return {0, redis.call('PTTL', KEYS[1])}
+end
+if redis.call('INCRBY', KEYS[1], granted) == granted then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return {granted, redis.call('PTTL', KEYS[1])}
+"""
+
+
+def route_path(request: Request) -> str:
+    """
+    Returns the path template of the route a request matched, so that requests to ``/contacts/1`` and
+    ``/contacts/2`` share one budget. Falls back to the request path outside of a route.
+
+    :param request: The incoming request.
+    :type request: Request
+    :return: The route path, e.g. ``/contacts/{contact_id}``.
+    :rtype: str
+    """
+    route = request.scope.get("route")
+    return route.path if route is not None else request.scope["path"]
+
+
+async def user_identifier(request: Request) -> str:
+    """
+    Rate limit identifier keying authenticated requests on the token subject and anonymous ones on
+    the client address, per route.
+
+    The subject is stored in ``request.state.rate_limit_user`` and, if the user is cached, their plan
+    in ``request.state.rate_limit_plan``; the limiter looks up the plan of users not cached yet, at the
+    cache generation stored in ``request.state.rate_limit_generation``.
+
+    :param request: The incoming request.
+    :type request: Request
+    :return: The rate key, ``user:<subject>:<route>`` or ``<address>:<route>``.
+    :rtype: str
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    subject = jwt_manager.subject(token) if scheme.lower() == "bearer" and token else None
+    if subject is None:
+        forwarded = request.headers.get("X-Forwarded-For")
+        address = forwarded.split(",")[0] if forwarded else request.client.host
+        return f"{address}:{route_path(request)}"
+    request.state.rate_limit_user = subject
+    try:
+        user = await user_cache.get(subject)
+        if user is None:
+            request.state.rate_limit_generation = await user_cache.generation(subject)
+    except RedisError as err:
+        logger.warning("Could not read the plan of %s: %s", subject, err)
+        user = None
+    if user is not None:
+        request.state.rate_limit_plan = user.plan
+    return f"user:{subject}:{route_path(request)}"
+
+
+async def request_plan(request: Request, db: AsyncSession) -> Optional[str]:
+    """
+    Returns the plan of the user a request was identified as, reading it from the primary database
+    and caching the user if ``user_identifier`` did not find them in the cache.
+
+    :param request: The identified request.
+    :type request: Request
+    :param db: An asynchronous database session.
+    :type db: AsyncSession
+    :return: The plan, or None for anonymous requests and unknown users.
+    :rtype: str | None
+    """
+    plan = getattr(request.state, "rate_limit_plan", None)
+    subject = getattr(request.state, "rate_limit_user", None)
+    if plan is not None or subject is None:
+        return plan
+    user = await repository_users.get_user_by_email(subject, db)
+    if user is None:
+        return None
+    try:
+        await user_cache.set(user, getattr(request.state, "rate_limit_generation", None))
+    except RedisError as err:
+        logger.warning("Could not cache user %s: %s", subject, err)
+    request.state.rate_limit_plan = user.plan
+    return user.plan
+
+
+class _Bucket:
+    __slots__ = ("tokens", "expires", "exhausted")
+
+    def __init__(self, tokens: int, expires: float, exhausted: bool):
+        self.tokens = tokens
+        self.expires = expires
+        self.exhausted = exhausted
+
+
+class HybridRateLimiter:
+    """
+    Dependency limiting a route to ``times`` requests per window, a drop-in for ``RateLimiter``.
+
+    ``times`` is the limit of the default plan; requests identified as a user of another plan get
+    ``times`` scaled by the multiplier of that plan.
+    """
+    def __init__(self, times: int = 1, milliseconds: int = 0, seconds: int = 0, minutes: int = 0,
+                 hours: int = 0, identifier: Optional[Callable] = None, callback: Optional[Callable] = None,
+                 lease: Optional[int] = None):
+        self.times = times
+        self.milliseconds = milliseconds + 1000 * seconds + 60000 * minutes + 3600000 * hours
+        self.identifier = identifier
+        self.callback = callback
+        self.lease = lease
+        self.plans = settings.rate_limit_plans
+        self.default_plan = settings.rate_limit_default_plan
+        self.max_keys = settings.rate_limit_local_max_keys
+        self.clock = time.monotonic
+        self._buckets: Dict[str, _Bucket] = {}
+        self._script = None
+        self._script_redis = None
+
+    def limit(self, plan: Optional[str]) -> int:
+        multiplier = self.plans.get(plan, self.plans.get(self.default_plan, 1))
+        return max(1, math.ceil(self.times * multiplier))
+
+    def lease_size(self, times: int) -> int:
+        if self.lease:
+            return self.lease
+        lease = max(settings.rate_limit_min_lease, math.ceil(times * settings.rate_limit_lease_fraction))
+        return max(1, min(lease, times // 2))
+
+    def key(self, rate_key: str, request: Request) -> str:
+        return f"{FastAPILimiter.prefix}:hybrid:{rate_key}:{request.method}:{self.milliseconds}"
+
+    async def _lease(self, key: str, times: int, tokens: int) -> Tuple[int, int]:
+        """
+        Takes up to ``tokens`` tokens of the current window from Redis.
+
+        :param key: The rate limit key.
+        :type key: str
+        :param times: The limit of the key.
+        :type times: int
+        :param tokens: The number of tokens wanted.
+        :type tokens: int
+        :return: The number of tokens granted and the milliseconds left in the window.
+        :rtype: tuple[int, int]
+        """
+        if self._script is None or self._script_redis is not FastAPILimiter.redis:
+            self._script = FastAPILimiter.redis.register_script(LEASE_SCRIPT)
+            self._script_redis = FastAPILimiter.redis
+        granted, pttl = await self._script(keys=[key], args=[times, self.milliseconds, tokens])
+        return int(granted), int(pttl)
+
+    def _store(self, key: str, bucket: _Bucket) -> None:
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            now = self.clock()
+            for stale in [k for k, b in self._buckets.items() if b.expires <= now]:
+                del self._buckets[stale]
+            while len(self._buckets) >= self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+        self._buckets[key] = bucket
+
+    async def acquire(self, key: str, times: int) -> int:
+        """
+        Spends one token of a key.
+
+        :param key: The rate limit key.
+        :type key: str
+        :param times: The limit of the key.
+        :type times: int
+        :return: 0 if the request is allowed, else the milliseconds until the window ends.
+        :rtype: int
+        """
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.expires > now:
+            if bucket.tokens > 0:
+                bucket.tokens -= 1
+                return 0
+            if bucket.exhausted:
+                return max(1, math.ceil((bucket.expires - now) * 1000))
+        lease = self.lease_size(times)
+        try:
+            granted, pttl = await self._lease(key, times, lease)
+        except RedisError as err:
+            logger.warning("Rate limit lease failed, limiting %s in this worker only: %s", key, err)
+            if bucket is None or bucket.expires <= now:
+                bucket = _Bucket(times, now + self.milliseconds / 1000, True)
+                self._store(key, bucket)
+            bucket.exhausted = True
+            if bucket.tokens > 0:
+                bucket.tokens -= 1
+                return 0
+            return max(1, math.ceil((bucket.expires - now) * 1000))
+        # The window started at Redis before the reply arrived, so measuring it from ``now`` never outlives it.
+        expires = now + max(pttl, 0) / 1000
+        if granted:
+            self._store(key, _Bucket(granted - 1, expires, granted < lease))
+            return 0
+        self._store(key, _Bucket(0, expires, True))
+        return max(pttl, 1)
+
+    async def __call__(self, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+        if not FastAPILimiter.redis:
+            raise Exception("You must call FastAPILimiter.init in startup event of fastapi!")
+        identifier = self.identifier or FastAPILimiter.identifier
+        callback = self.callback or FastAPILimiter.http_callback
+        rate_key = await identifier(request)
+        times = self.limit(await request_plan(request, db))
+        pexpire = await self.acquire(self.key(rate_key, request), times)
+        if pexpire != 0:
+            return await callback(request, response, pexpire)
@@ -0,0 +1,98 @@
+"""
+Module Name: storage.py
+Description: Storage backends for user avatars.
+
+``AvatarStorage`` is the interface the avatar job uses: ``save`` stores an image file under a key
+and returns its public URL. ``CloudinaryStorage`` uploads to Cloudinary, running the blocking
+client on a thread; ``LocalStorage`` copies files into a directory served by the application and is
+meant for development and tests. ``AVATAR_STORAGE`` selects the backend.
+"""
+import asyncio
+import re
+from abc import ABC, abstractmethod
+import shutil
+import time
+from pathlib import Path
+
+import cloudinary
+import cloudinary.uploader
+
+from src.conf.config import settings
+
+
+class AvatarStorage(ABC):
+    """
+    Interface of the avatar storage backends.
+    """
+    @abstractmethod
+    async def save(self, path: str, key: str) -> str:
+        """
+        Stores an image, replacing the one stored under the same key.
+
+        :param path: The image file.
+        :type path: str
+        :param key: The storage key, ``NotesApp/<user id>``.
+        :type key: str
+        :return: The public URL of the stored avatar.
+        :rtype: str
+        """
+
+
+class CloudinaryStorage(AvatarStorage):
+    """
+    Stores avatars on Cloudinary and serves them cropped to ``size`` x ``size``.
+    """
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str, size: int = 250):
+        self.size = size
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+
+    def _upload(self, path: str, key: str) -> str:
+        r = cloudinary.uploader.upload(path, public_id=key, overwrite=True)
+        return cloudinary.CloudinaryImage(key) \
+            .build_url(width=self.size, height=self.size, crop='fill', version=r.get('version'))
+
+    async def save(self, path: str, key: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(None, self._upload, path, key)
+
+
+class LocalStorage(AvatarStorage):
+    """
+    Stores avatars as files under ``root``, served at ``base_url``.
+    """
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+
+    @staticmethod
+    def filename(key: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", key).lstrip(".")
+
+    def _copy(self, path: str, filename: str) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        target = self.root / filename
+        partial = target.with_name(f".{filename}.partial")
+        shutil.copyfile(path, partial)
+        partial.replace(target)
+
+    async def save(self, path: str, key: str) -> str:
+        filename = self.filename(key)
+        await asyncio.to_thread(self._copy, path, filename)
+        # The version makes clients fetch the new image instead of a cached one.
+        return f"{self.base_url}/{filename}?v={time.time_ns()}"
+
+
+def get_avatar_storage() -> AvatarStorage:
+    """
+    Builds the avatar storage backend selected by ``AVATAR_STORAGE``.
+
+    :return: The storage backend.
+    :rtype: AvatarStorage
+    """
+    if settings.avatar_storage == "local":
+        return LocalStorage(settings.avatar_local_dir, settings.avatar_local_url)
+    if settings.avatar_storage == "cloudinary":
+        return CloudinaryStorage(settings.cloudinary_name, settings.cloudinary_api_key, settings.cloudinary_api_secret)
+    raise ValueError(f"Unknown avatar storage {settings.avatar_storage!r}")
+
+
+avatar_storage = get_avatar_storage()
@@ -0,0 +1,221 @@
+"""
+Module Name: user_cache.py
+Description: Redis cache of the authenticated user used by AuthService.authorised_user.
+
+A cached user is stored as a compact JSON record holding only the columns authentication needs
+and a schema version. Records with another version are treated as a cache miss, so changing the
+layout never breaks running workers. A hit is rehydrated into a detached User instance that can
+be used in queries and relationships without loading it from the database.
+
+Every user also has a generation in Redis, a random token replaced on each invalidation. A record
+is tagged with the generation read before the user was loaded from the database and is served only
+while that generation is current, so a fill racing with an update can write the old user back but
+that copy is never read.
+
+In front of Redis every worker keeps a small LRU cache with a short TTL. Updates to a user
+publish an invalidation on the InvalidationBus so all workers drop their local copy.
+"""
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from sqlalchemy.orm.attributes import instance_state
+
+from src.conf.config import settings
+from src.database.db import redis_sessionmanager
+from src.database.models import User
+from src.services.invalidation import invalidation_bus
+
+logger = logging.getLogger(__name__)
+
+CACHE_SCHEMA_VERSION = 3
+USER_CACHE_FIELDS = ("id", "name", "surname", "email", "phone", "confirmed", "avatar", "refresh_token",
+                     "plan")
+UNCACHED_COLUMNS = frozenset(column.key for column in User.__mapper__.column_attrs
+                             if column.key not in USER_CACHE_FIELDS)
+_identity_key = User.__mapper__.identity_key_from_primary_key
+
+
+def encode_user(user: User, generation: str = "") -> bytes:
+    """
+    Serializes the cached columns of a user into a versioned JSON record.
+
+    :param user: The user to serialize.
+    :type user: User
+    :param generation: The generation of the user read before it was loaded.
+    :type generation: str
+    :return: The encoded record.
+    :rtype: bytes
+    """
+    record = {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+    record["v"] = CACHE_SCHEMA_VERSION
+    record["g"] = generation
+    return json.dumps(record, separators=(",", ":")).encode()
+
+
+def decode_record(data: bytes | str, generation: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Parses an encoded record.
+
+    :param data: The encoded record.
+    :type data: bytes | str
+    :param generation: The current generation of the user, None to accept any.
+    :type generation: str | None
+    :return: The cached columns, or None if the record is malformed, has another schema version or
+        was written at another generation.
+    :rtype: dict | None
+    """
+    try:
+        record = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or record.pop("v", None) != CACHE_SCHEMA_VERSION:
+        return None
+    tag = record.pop("g", None)
+    if generation is not None and tag != generation:
+        return None
+    if set(record) != set(USER_CACHE_FIELDS):
+        return None
+    return record
+
+
+def user_from_record(record: Dict[str, Any]) -> User:
+    """
+    Builds a detached User instance from the cached columns.
+
+    Columns that are not cached (such as the password hash) are left unloaded.
+
+    :param record: The cached columns.
+    :type record: dict
+    :return: The detached user.
+    :rtype: User
+    """
+    user = User._sa_class_manager.new_instance()
+    # Fill the instance dict directly: the loaded values become the committed state without
+    # running the constructor and attribute events, which dominate the cost of a cache hit.
+    user.__dict__.update(record)
+    # What make_transient_to_detached does for a fresh instance, without inspecting every attribute:
+    # give it an identity and mark the columns that are not cached as expired.
+    state = instance_state(user)
+    state.key = _identity_key((record["id"],))
+    state.expired_attributes.update(UNCACHED_COLUMNS)
+    return user
+
+
+class UserCache:
+    """
+    Class responsible for caching authenticated users in process and in Redis.
+    """
+    namespace = "user"
+
+    def __init__(self, redis, ttl: int, bus=None, local_size: int = 1024, local_ttl: float = 30):
+        self.r = redis
+        self.ttl = ttl
+        self.bus = bus
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        if bus is not None:
+            bus.subscribe(self.namespace, self.forget_local)
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:v{CACHE_SCHEMA_VERSION}:{email}"
+
+    @staticmethod
+    def generation_key(email: str) -> str:
+        return f"user:gen:{email}"
+
+    def _get_local(self, email: str) -> Optional[Dict[str, Any]]:
+        entry = self._local.get(email)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._local[email]
+            return None
+        self._local.move_to_end(email)
+        return record
+
+    def _set_local(self, email: str, record: Dict[str, Any]) -> None:
+        self._local[email] = (time.monotonic() + self.local_ttl, record)
+        self._local.move_to_end(email)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    def forget_local(self, email: str) -> None:
+        self._local.pop(email, None)
+
+    async def get(self, email: str) -> Optional[User]:
+        record = self._get_local(email)
+        if record is None:
+            data, generation = await self.r.redis.mget(self.key(email), self.generation_key(email))
+            if data is None or generation is None:
+                return None
+            record = decode_record(data, generation.decode())
+            if record is None:
+                return None
+            self._set_local(email, record)
+        return user_from_record(record)
+
+    async def generation(self, email: str) -> str:
+        """
+        Returns the current generation of a user, creating one if there is none. Read it after a
+        miss and before loading the user, and pass it to ``set``.
+
+        :param email: The email of the user.
+        :type email: str
+        :return: The generation.
+        :rtype: str
+        """
+        key = self.generation_key(email)
+        generation = await self.r.redis.get(key)
+        if generation is None:
+            fresh = secrets.token_hex(8)
+            if await self.r.redis.set(key, fresh, ex=self.ttl, nx=True):
+                return fresh
+            generation = await self.r.redis.get(key)
+        return generation.decode() if generation is not None else ""
+
+    async def set(self, user: User, generation: Optional[str]) -> None:
+        """
+        Caches a user under the generation read before it was loaded.
+
+        The local cache is filled by the next ``get``, which checks the generation is still current.
+
+        :param user: The user loaded from the database.
+        :type user: User
+        :param generation: The generation returned by ``generation``, None to skip caching.
+        :type generation: str | None
+        """
+        if generation is None:
+            return
+        await self.r.redis.set(self.key(user.email), encode_user(user, generation), ex=self.ttl)
+
+    async def delete(self, email: str) -> None:
+        await self.r.redis.delete(self.key(email))
+
+    async def invalidate(self, email: str) -> None:
+        """
+        Drops a user from Redis and from the local cache of every worker.
+
+        :param email: The email of the changed user.
+        :type email: str
+        """
+        self.forget_local(email)
+        try:
+            await self.r.redis.set(self.generation_key(email), secrets.token_hex(8), ex=self.ttl)
+            await self.delete(email)
+        except RedisError as err:
+            logger.warning("Could not drop cached user %s: %s", email, err)
+        if self.bus is not None:
+            await self.bus.publish(self.namespace, email)
+
+
+user_cache = UserCache(redis_sessionmanager, settings.user_cache_ttl, invalidation_bus,
+                       settings.user_cache_local_size, settings.user_cache_local_ttl)
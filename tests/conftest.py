@@ -56,9 +56,9 @@ def client():
         session = TestingSessionLocal()
         try:
             yield session
-        except Exception as err:
-            print(err)
+        except Exception:
             await session.rollback()
+            raise
         finally:
             await session.close()
 
@@ -1,4 +1,4 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock
 
 import pytest
 from sqlalchemy import select
@@ -14,18 +14,19 @@ user_mock = {
 
 
 def test_create_user(client, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.services.email.send_email", mock_send_email)
+    mock_send_email = AsyncMock()
+    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
     response = client.post("/auth/signup", json=user_mock)
     assert response.status_code == 201, response.text
     data = response.json()
     assert data.get("email") == user_mock.get("email")
     assert data.get("name") == user_mock.get("name")
+    mock_send_email.assert_awaited_once()
 
 
 def test_repeat_create_user(client, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.services.email.send_email", mock_send_email)
+    mock_send_email = AsyncMock()
+    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
     response = client.post("/auth/signup", json=user_mock)
     assert response.status_code == 409, response.text
     data = response.json()
@@ -0,0 +1,87 @@
+import contextlib
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fakeredis import FakeServer, aioredis
+from fastapi import Request, Response
+from sqlalchemy import select
+
+from src.conf.config import settings
+from src.database.models import User
+from src.services.auth import auth_service
+from src.services.jobs import Worker, job_queue
+from src.services.rate_limit import HybridRateLimiter
+from src.services.storage import LocalStorage
+from tests.conftest import TestingSessionLocal, user
+
+
+@contextlib.asynccontextmanager
+async def session():
+    async with TestingSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture()
+def avatars(monkeypatch, tmp_path):
+    async def allow(self, request: Request, response: Response):
+        pass
+
+    redis = MagicMock()
+    redis.redis = aioredis.FakeRedis(server=FakeServer())
+    monkeypatch.setattr(job_queue, "r", redis)
+    monkeypatch.setattr(HybridRateLimiter, "__call__", allow)
+    monkeypatch.setattr(auth_service, "user_cache", AsyncMock(get=AsyncMock(return_value=None)))
+    monkeypatch.setattr(settings, "avatar_spool_dir", str(tmp_path / "spool"))
+    monkeypatch.setattr(settings, "avatar_max_size", 1000)
+    monkeypatch.setattr("src.services.avatars.avatar_storage", LocalStorage(str(tmp_path / "media"), "/media"))
+    monkeypatch.setattr("src.services.avatars.sessionmanager", MagicMock(session=session))
+    monkeypatch.setattr("src.repository.users.user_cache", AsyncMock())
+    return tmp_path
+
+
+@pytest.fixture()
+def headers():
+    token = auth_service.jwt_manager.create_token({"sub": user["email"]}, "refresh_token")
+    return {"Authorization": f"Bearer {token}"}
+
+
+def upload(client, headers, data=b"\x89PNG image", content_type="image/png"):
+    return client.patch("/users/avatar", headers=headers, files={"file": ("avatar.png", data, content_type)})
+
+
+@pytest.mark.asyncio
+async def test_upload_is_processed_by_a_job(client, avatars, headers):
+    response = upload(client, headers)
+    assert response.status_code == 202, response.text
+    data = response.json()
+    assert data["status"] == "queued"
+    assert response.headers["location"] == data["status_url"]
+    assert data["status_url"].endswith(f"/users/avatar/{data['job_id']}")
+    assert len(list((avatars / "spool").iterdir())) == 1
+
+    job = await job_queue.reserve("avatars")
+    await Worker(job_queue, {"avatars": 1}).process(job)
+
+    response = client.get(data["status_url"], headers=headers)
+    assert response.status_code == 200, response.text
+    status = response.json()
+    assert status["status"] == "done"
+    async with TestingSessionLocal() as db:
+        user_id = (await db.execute(select(User.id).filter_by(email=user["email"]))).scalar_one()
+    assert status["avatar"].startswith(f"/media/NotesApp_{user_id}?v=")
+    assert (avatars / "media" / f"NotesApp_{user_id}").read_bytes() == b"\x89PNG image"
+    assert list((avatars / "spool").iterdir()) == []
+
+
+def test_upload_limits(client, avatars, headers):
+    assert upload(client, headers, data=b"x" * 1001).status_code == 413
+    assert upload(client, headers, content_type="text/plain").status_code == 415
+    assert list((avatars / "spool").iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_status_of_other_jobs_is_hidden(client, avatars, headers):
+    job_id = await job_queue.enqueue("process_avatar", "other@example.com", "/tmp/x",
+                                     owner="other@example.com")
+    assert client.get(f"/users/avatar/{job_id}", headers=headers).status_code == 404
+    assert client.get("/users/avatar/unknown", headers=headers).status_code == 404
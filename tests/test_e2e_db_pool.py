@@ -0,0 +1,64 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fastapi import Request, Response
+
+from main import app
+from src.conf.config import settings
+from src.database.db import DatabaseSessionManager, InstrumentedQueuePool, get_db
+from src.services.auth import auth_service
+from src.services.rate_limit import HybridRateLimiter
+from tests.conftest import SQLALCHEMY_DATABASE_URL, user
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_do_not_exhaust_pool():
+    manager = DatabaseSessionManager(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool,
+                                     pool_size=2, max_overflow=0, pool_timeout=2)
+
+    async def override_get_db():
+        async with manager.session() as session:
+            yield session
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
+    confirmed_token = await auth_service.create_email_token(type("User", (), user))
+    unknown_token = await auth_service.create_email_token(type("User", (), {"email": "nobody@example.com"}))
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*(
+                client.get(f"/auth/confirmed_email/{confirmed_token if i % 2 else unknown_token}")
+                for i in range(200)
+            ))
+    finally:
+        if previous is None:
+            app.dependency_overrides.pop(get_db, None)
+        else:
+            app.dependency_overrides[get_db] = previous
+        status = manager.pool_status()
+        await manager._engine.dispose()
+
+    assert sorted({response.status_code for response in responses}) == [200, 400]
+    assert status["checkouts"] == 200
+    assert status["checked_out"] == 0
+    assert status["timeouts"] == 0
+
+
+def test_pool_metrics_are_for_admins_only(client, monkeypatch):
+    async def allow(self, request: Request, response: Response):
+        pass
+
+    monkeypatch.setattr(HybridRateLimiter, "__call__", allow)
+    monkeypatch.setattr(auth_service, "user_cache", AsyncMock(get=AsyncMock(return_value=None)))
+    token = auth_service.jwt_manager.create_token({"sub": user["email"]}, "refresh_token")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/metrics/db_pool").status_code == 403
+    assert client.get("/metrics/db_pool", headers=headers).status_code == 403
+    monkeypatch.setattr(settings, "metrics_admins", [user["email"]])
+    response = client.get("/metrics/db_pool", headers=headers)
+    assert response.status_code == 200, response.text
+    assert "checked_out" in response.json()
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import column, table, text, update
+
+from src.database.db import DatabaseSessionManager, InstrumentedQueuePool
+from src.database.models import User
+from src.repository.users import get_user_by_email
+
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.sqlite"
+origin = table("origin", column("name"))
+
+
+class TestDatabaseSessionManager(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = DatabaseSessionManager(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool,
+                                              pool_size=2, max_overflow=0, pool_timeout=5)
+
+    async def asyncTearDown(self):
+        await self.manager._engine.dispose()
+
+    async def test_pool_status_reports_checkout_waits(self):
+        async def query():
+            async with self.manager._engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(query() for _ in range(6)))
+        status = self.manager.pool_status()
+        self.assertEqual(status["size"], 2)
+        self.assertEqual(status["checkouts"], 6)
+        self.assertEqual(status["timeouts"], 0)
+        self.assertGreater(status["wait_max_ms"], 0)
+        self.assertGreaterEqual(status["wait_p99_ms"], status["wait_p50_ms"])
+
+    async def test_session_returns_connections_under_load(self):
+        async def query(i):
+            async with self.manager.session() as session:
+                await session.execute(text("SELECT 1"))
+                if i % 3 == 0:
+                    raise ValueError(i)
+
+        results = await asyncio.gather(*(query(i) for i in range(200)), return_exceptions=True)
+        self.assertEqual(sum(isinstance(result, ValueError) for result in results), 67)
+        status = self.manager.pool_status()
+        self.assertEqual(status["checked_out"], 0)
+        self.assertEqual(status["timeouts"], 0)
+
+    async def test_session_rolls_back_and_propagates(self):
+        with self.assertRaises(RuntimeError):
+            async with self.manager.session() as session:
+                await session.execute(text("SELECT 1"))
+                self.assertTrue(session.in_transaction())
+                raise RuntimeError("boom")
+        self.assertEqual(self.manager.pool_status()["checked_out"], 0)
+
+
+class TestReplicaRouting(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        urls = [f"sqlite+aiosqlite:///{os.path.join(self.directory.name, name)}.sqlite"
+                for name in ("primary", "replica1", "replica2")]
+        self.manager = DatabaseSessionManager(urls[0], replica_urls=urls[1:])
+        for name, engine in zip(("primary", "replica1", "replica2"),
+                                [self.manager._engine, *self.manager.replicas.engines]):
+            async with engine.begin() as connection:
+                await connection.execute(text("CREATE TABLE origin (name TEXT)"))
+                await connection.execute(text("INSERT INTO origin VALUES (:name)"), {"name": name})
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        self.directory.cleanup()
+
+    async def read(self, session, replica=True):
+        result = await session.execute(text("SELECT name FROM origin").execution_options(replica=replica))
+        return result.scalar_one()
+
+    async def test_marked_reads_rotate_over_replicas(self):
+        async with self.manager.session() as session:
+            self.assertEqual({await self.read(session) for _ in range(4)}, {"replica1", "replica2"})
+            self.assertEqual(await self.read(session, replica=False), "primary")
+
+    async def test_reads_stay_on_primary_after_a_write(self):
+        async with self.manager.session() as session:
+            self.assertNotEqual(await self.read(session), "primary")
+            await session.execute(update(origin).values(name="written"))
+            self.assertEqual(await self.read(session), "written")
+            await session.commit()
+            self.assertEqual(await self.read(session), "written")
+
+    async def test_user_lookup_ignores_lagging_replicas(self):
+        for engine, confirmed in ((self.manager._engine, True), *((replica, False)
+                                                                   for replica in self.manager.replicas.engines)):
+            async with engine.begin() as connection:
+                await connection.run_sync(User.__table__.create)
+                await connection.execute(User.__table__.insert().values(
+                    email="user@example.com", name="user", password="password", confirmed=confirmed))
+        for _ in range(4):
+            async with self.manager.session() as session:
+                self.assertTrue((await get_user_by_email("user@example.com", session)).confirmed)
+
+    async def test_unhealthy_replicas_are_skipped(self):
+        replica = self.manager.replicas.engines[0]
+        await replica.dispose()
+        path = os.path.join(self.directory.name, "replica1.sqlite")
+        os.remove(path)
+        os.mkdir(path)
+        await self.manager.replicas.check()
+        async with self.manager.session() as session:
+            self.assertEqual({await self.read(session) for _ in range(4)}, {"replica2"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,17 @@
 import unittest
-from datetime import datetime, timedelta
-from unittest.mock import MagicMock, AsyncMock
+from datetime import date, datetime, timedelta
+from unittest.mock import MagicMock, AsyncMock, patch
 
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Contact, User
 from src.repository.contacts import (get_contacts, get_contact, create_contact, remove_contact, update_contact,
-                                     search_contact, upcoming_birthdays)
+                                     search_contact, upcoming_birthdays, get_contact_changes, database_time)
 from src.schemas import ContactResponse
+from tests.conftest import TestingSessionLocal
 
 
 class TestUserRepository(unittest.IsolatedAsyncioTestCase):
@@ -15,6 +19,12 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.session = AsyncMock(spec=AsyncSession)
         self.user = User(id=1, email='user@example.com', name='user', password='password', confirmed=True)
         self.contact = Contact(id=1, name='test', email='contact@example.com', user_id=self.user.id, user=self.user)
+        patcher = patch("src.repository.contacts.autocomplete_index", new_callable=AsyncMock)
+        self.autocomplete_index = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.repository.contacts.contact_cache", new_callable=AsyncMock)
+        self.contact_cache = patcher.start()
+        self.addCleanup(patcher.stop)
 
     async def test_get_contacts(self):
         limit = 10
@@ -25,6 +35,18 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.session.execute.return_value = mock_response
         result = await get_contacts(limit, ofset, self.session, self.user)
         self.assertEqual(result, expected_response)
+        self.assertNotIn("replica", self.session.execute.call_args.args[0].get_execution_options())
+
+    async def test_get_contacts_after_id(self):
+        expected_response = [Contact(id=11), Contact(id=12)]
+        mock_response = MagicMock()
+        mock_response.scalars.return_value.all.return_value = expected_response
+        self.session.execute.return_value = mock_response
+        result = await get_contacts(10, 0, self.session, self.user, after_id=10)
+        self.assertEqual(result, expected_response)
+        statement = str(self.session.execute.call_args.args[0])
+        self.assertIn("contacts.id >", statement)
+        self.assertNotIn("OFFSET", statement)
 
     async def test_get_contact(self):
         expected_response = self.contact
@@ -33,26 +55,50 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.session.execute.return_value = mock_response
         result = await get_contact(self.contact.id, self.session, self.user)
         self.assertEqual(result, expected_response)
+        self.assertNotIn("replica", self.session.execute.call_args.args[0].get_execution_options())
 
     async def test_create_contact(self):
         body = ContactResponse(id=1, name="test name", surname="test surname", email="test@email.com",
                                phone="1234567890", birthdate=datetime.now().date())
+        mock_response = MagicMock()
+        mock_response.scalar_one.return_value = Contact(id=1, name=body.name, email=body.email, user_id=self.user.id)
+        self.session.execute.return_value = mock_response
         result = await create_contact(body, self.session, self.user)
-        self.assertEqual(result.user, self.user)
+        self.assertEqual(result.user_id, self.user.id)
         self.assertEqual(result.name, body.name)
         self.assertEqual(result.email, body.email)
+        self.assertIn("RETURNING", str(self.session.execute.call_args.args[0]))
+        self.session.refresh.assert_not_awaited()
+        self.autocomplete_index.contact_changed.assert_awaited_once_with(
+            self.user.id, (1, body.name, None, body.email))
+        self.contact_cache.bump.assert_awaited_once_with(self.user.id)
+
+    async def test_create_contact_integrity_error(self):
+        body = ContactResponse(id=1, name="test name", surname="test surname", email="test@email.com",
+                               phone="1234567890")
+        self.session.execute.side_effect = IntegrityError("INSERT", {}, Exception())
+        result = await create_contact(body, self.session, self.user)
+        self.assertIsNone(result)
+        self.session.rollback.assert_awaited_once()
+        self.autocomplete_index.contact_changed.assert_not_awaited()
+        self.contact_cache.bump.assert_not_awaited()
 
     async def test_update_contact(self):
         body = ContactResponse(id=1, name="test name", surname="test surname", email="test@email.com",
                                phone="1234567890", birthdate=datetime.now().date())
-        expected_response = Contact()
+        expected_response = Contact(id=1, name=body.name, email=body.email, user_id=self.user.id)
         mock_response = MagicMock()
         mock_response.scalar_one_or_none.return_value = expected_response
         self.session.execute.return_value = mock_response
         result = await update_contact(body.id, body, self.session, self.user)
-        self.assertEqual(result.user, self.user)
+        self.assertEqual(result.user_id, self.user.id)
         self.assertEqual(result.name, body.name)
         self.assertEqual(result.email, body.email)
+        self.session.execute.assert_awaited_once()
+        statement = str(self.session.execute.call_args.args[0])
+        self.assertIn("UPDATE contacts", statement)
+        self.assertIn("contacts.user_id", statement)
+        self.assertIn("RETURNING", statement)
 
     async def test_remove_contact(self):
         expected_response = self.contact
@@ -61,11 +107,17 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.session.execute.return_value = mock_response
         result = await remove_contact(self.contact.id, self.session, self.user)
         self.assertEqual(result, self.contact)
+        self.session.execute.assert_awaited_once()
+        statement = str(self.session.execute.call_args.args[0])
+        self.assertIn("UPDATE contacts SET", statement)
+        self.assertIn("deleted_at", statement)
+        self.contact_cache.bump.assert_awaited_once_with(self.user.id)
+        self.autocomplete_index.contact_removed.assert_awaited_once_with(self.user.id, self.contact.id)
 
     async def test_search_contact(self):
-        expected_response = self.contact
+        expected_response = [(self.contact, 0.6)]
         mock_response = MagicMock()
-        mock_response.scalars.return_value.first.return_value = expected_response
+        mock_response.all.return_value = expected_response
         self.session.execute.return_value = mock_response
         result = await search_contact(self.user, self.session, contact_name="", surname="tes", email="")
         self.assertEqual(result, expected_response)
@@ -84,6 +136,132 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.assertGreaterEqual(result[1].birthday, current_date)
 
 
+class TestUpcomingBirthdaysQuery(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = TestingSessionLocal()
+        self.user = (await self.session.execute(select(User).limit(1))).scalar_one()
+        birthdays = [date(1990, 12, 30), date(1985, 1, 2), date(2000, 2, 29), date(1970, 3, 1), date(1995, 6, 15), None]
+        self.session.add_all([Contact(name=f"bd{i}", phone=f"55500000{i:02d}", birthday=birthday, user=self.user)
+                              for i, birthday in enumerate(birthdays)])
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.execute(delete(Contact).where(Contact.name.like("bd%")))
+        await self.session.commit()
+        await self.session.close()
+
+    async def test_window_wraps_new_year(self):
+        result = await upcoming_birthdays(self.user, self.session, days=7, today=date(2023, 12, 28))
+        self.assertEqual([contact.name for contact in result], ["bd0", "bd1"])
+
+    async def test_leap_day_in_common_year(self):
+        result = await upcoming_birthdays(self.user, self.session, days=1, today=date(2023, 2, 28))
+        self.assertEqual([contact.name for contact in result], ["bd2", "bd3"])
+
+    async def test_whole_year_skips_missing_birthdays(self):
+        result = await upcoming_birthdays(self.user, self.session, days=366, today=date(2023, 6, 15))
+        self.assertEqual([contact.name for contact in result], ["bd4", "bd0", "bd1", "bd2", "bd3"])
+
+
+class TestSearchContactQuery(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = TestingSessionLocal()
+        self.user = (await self.session.execute(select(User).limit(1))).scalar_one()
+        names = ["Annabel", "Joanna", "Anna", "An_na"]
+        self.session.add_all([Contact(name=name, surname="search", phone=f"55510000{i:02d}", user=self.user)
+                              for i, name in enumerate(names)])
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.execute(delete(Contact).where(Contact.surname == "search"))
+        await self.session.commit()
+        await self.session.close()
+
+    async def search_names(self, **criteria):
+        criteria = {"contact_name": "", "surname": "", "email": "", **criteria}
+        rows = await search_contact(self.user, self.session, **criteria)
+        return [row.Contact.name for row in rows]
+
+    async def test_best_match_first(self):
+        self.assertEqual(await self.search_names(contact_name="anna"), ["Anna", "Annabel", "Joanna"])
+
+    async def test_prefix_ranks_above_substring(self):
+        self.assertEqual(await self.search_names(contact_name="annab"), ["Annabel"])
+
+    async def test_wildcards_are_escaped(self):
+        self.assertEqual(await self.search_names(contact_name="n_n"), ["An_na"])
+
+    async def test_all_criteria_are_combined(self):
+        self.assertEqual(await self.search_names(contact_name="anna", surname="searc"), ["Anna", "Annabel", "Joanna"])
+        self.assertEqual(await self.search_names(contact_name="anna", surname="nobody"), [])
+
+    async def test_keyset_pages(self):
+        first = await search_contact(self.user, self.session, "anna", "", "", limit=2)
+        second = await search_contact(self.user, self.session, "anna", "", "", limit=2,
+                                      after=(first[-1].rank, first[-1].Contact.id))
+        self.assertEqual([row.Contact.name for row in first + second], ["Anna", "Annabel", "Joanna"])
+
+
+class TestContactChangesQuery(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = patch("src.repository.contacts.autocomplete_index", new_callable=AsyncMock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.repository.contacts.contact_cache", new_callable=AsyncMock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = TestingSessionLocal()
+        self.user = (await self.session.execute(select(User).limit(1))).scalar_one()
+        self.session.add_all([Contact(name=f"sync{i}", phone=f"55520000{i:02d}", user=self.user) for i in range(5)])
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.execute(delete(Contact).where(Contact.name.like("sync%")))
+        await self.session.commit()
+        await self.session.close()
+
+    async def changes(self, since=None, limit=100):
+        return await get_contact_changes(self.user, self.session, datetime.utcnow(), limit=limit, since=since)
+
+    async def test_full_sync_pages_then_only_churn(self):
+        first = await self.changes(limit=3)
+        rest = await self.changes(since=(first[-1].updated_at, first[-1].id))
+        contacts = [contact for contact in first + rest if contact.name.startswith("sync")]
+        self.assertEqual([contact.name for contact in contacts], [f"sync{i}" for i in range(5)])
+        position = (rest[-1].updated_at, rest[-1].id)
+        self.assertEqual(await self.changes(since=position), [])
+
+        body = ContactResponse(id=0, name="sync1b", surname=None, email=None, phone="5552000001")
+        await update_contact(contacts[1].id, body, self.session, self.user)
+        await remove_contact(contacts[3].id, self.session, self.user)
+        changes = await self.changes(since=position)
+        self.assertEqual([(contact.name, contact.deleted_at is not None) for contact in changes],
+                         [("sync1b", False), ("sync3", True)])
+        self.assertIsNone(changes[1].phone)
+
+    async def test_tombstones_are_hidden_from_reads(self):
+        contacts = await get_contacts(100, 0, self.session, self.user)
+        removed = next(contact for contact in contacts if contact.name == "sync0")
+        await remove_contact(removed.id, self.session, self.user)
+        self.assertIsNone(await get_contact(removed.id, self.session, self.user))
+        self.assertIsNone(await remove_contact(removed.id, self.session, self.user))
+        self.assertNotIn("sync0", [contact.name for contact in await get_contacts(100, 0, self.session, self.user)])
+        self.assertEqual(await self.changes(), [c for c in await self.changes() if c.deleted_at is None])
+
+    async def test_changes_are_stamped_by_the_database_clock(self):
+        before = await database_time(self.session)
+        contacts = await get_contacts(100, 0, self.session, self.user)
+        removed = next(contact for contact in contacts if contact.name == "sync2")
+        removed = await remove_contact(removed.id, self.session, self.user)
+        self.assertLessEqual(before, removed.updated_at)
+        self.assertLessEqual(removed.updated_at, await database_time(self.session))
+        statement = update(Contact).values(name="x").compile(dialect=postgresql.dialect())
+        self.assertIn("updated_at=TIMEZONE('utc', CLOCK_TIMESTAMP())", str(statement))
+
+    async def test_changes_after_until_wait_for_the_next_sync(self):
+        until = datetime.utcnow() - timedelta(seconds=60)
+        changes = await get_contact_changes(self.user, self.session, until)
+        self.assertNotIn("sync0", [contact.name for contact in changes])
 
 
 if __name__ == '__main__':
@@ -1,11 +1,12 @@
 import unittest
-from unittest.mock import MagicMock, AsyncMock
+from unittest.mock import MagicMock, AsyncMock, patch
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.repository.users import (
-    get_user_by_email, confirmed_email, create_user, update_token, update_user, update_avatar, remove_user
+    get_user_by_email, confirmed_email, create_user, update_token, update_user, update_avatar, remove_user,
+    update_password
 )
 from src.schemas import UserModel, UserUpdateModel
 
@@ -14,8 +15,12 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         self.session = AsyncMock(spec=AsyncSession)
         self.user = User(id=1, email='user@example.com', name='user', password='password', confirmed=True)
-
-
+        patcher = patch("src.repository.users.user_cache", new_callable=AsyncMock)
+        self.user_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.repository.users.contact_cache", new_callable=AsyncMock)
+        self.contact_cache = patcher.start()
+        self.addCleanup(patcher.stop)
 
     async def test_get_user_by_email(self):
         expected_response = self.user
@@ -33,11 +38,16 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         await confirmed_email(self.user.email, self.session)
         result = await get_user_by_email(self.user.email, self.session)
         self.assertTrue(result.confirmed)
+        self.user_cache.invalidate.assert_awaited_once_with(self.user.email)
 
     async def test_create_user(self):
         body = UserModel(name=self.user.name, email=self.user.email, password=self.user.password)
-        mock_db = self.session
-        result = await create_user(body, mock_db)
+        mock_response = MagicMock()
+        mock_response.scalar_one.return_value = User(**body.model_dump(), confirmed=False)
+        self.session.execute.return_value = mock_response
+        result = await create_user(body, self.session)
+        self.assertIn("RETURNING", str(self.session.execute.call_args.args[0]))
+        self.session.refresh.assert_not_awaited()
         self.assertEqual(result.name, body.name)
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.password, body.password)
@@ -54,6 +64,13 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         result = await get_user_by_email(self.user.email, self.session)
         self.assertEqual(result.refresh_token, token)
 
+    async def test_update_password(self):
+        await update_password(self.user, "new hash", self.session)
+        self.assertEqual(self.user.password, "new hash")
+        self.assertIn("UPDATE users", str(self.session.execute.call_args.args[0]))
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_not_awaited()
+
     async def test_update_user(self):
         body = UserUpdateModel(name="testupdate", surname="test", email="testemail@mail.com", phone="1234567890")
         result = await update_user(body, self.session, self.user)
@@ -61,6 +78,7 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.surname, body.surname)
         self.assertEqual(result.phone, body.phone)
+        self.user_cache.invalidate.assert_awaited_once_with('user@example.com')
 
     async def test_update_avatar(self):
         url = 'http://test.com'
@@ -68,8 +86,14 @@ class TestUserRepository(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.avatar, url)
 
     async def test_remove_user(self):
+        mock_response = MagicMock()
+        mock_response.scalar_one_or_none.return_value = self.user
+        self.session.execute.return_value = mock_response
         result = await remove_user(self.user, self.session)
+        self.assertIn("RETURNING", str(self.session.execute.call_args.args[0]))
         self.assertEqual(result, self.user)
+        self.contact_cache.bump.assert_awaited_once_with(self.user.id)
+        self.user_cache.invalidate.assert_awaited_once_with(self.user.email)
 
 
 if __name__ == '__main__':
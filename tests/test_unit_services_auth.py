@@ -0,0 +1,163 @@
+import time
+import unittest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+from fakeredis import FakeServer, aioredis
+from fastapi import HTTPException
+
+from jose import jwt, ExpiredSignatureError
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import User
+from src.services.auth import AuthService, PasswordManager, JWTManager
+from src.services.invalidation import InvalidationBus
+from src.services.user_cache import UserCache, encode_user, decode_record, user_from_record, CACHE_SCHEMA_VERSION
+
+
+def spy(method):
+    async def call(*args, **kwargs):
+        return await method(*args, **kwargs)
+    return AsyncMock(side_effect=call)
+
+
+class TestAuthService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.session = AsyncMock(spec=AsyncSession)
+        self.user = User(id=1, email='user@example.com', name='user', password='password', confirmed=True)
+        self.redis = MagicMock()
+        self.redis.redis = aioredis.FakeRedis(server=FakeServer())
+        self.user_repository = AsyncMock()
+        self.jwt_manager = JWTManager("secret", "HS256")
+        self.bus = InvalidationBus(self.redis)
+        self.user_cache = UserCache(self.redis, 900, self.bus)
+        self.auth_service = AuthService(PasswordManager(), self.jwt_manager, self.user_repository, self.user_cache)
+        self.token = self.jwt_manager.create_token({"sub": self.user.email}, "refresh_token")
+
+    async def test_authorised_user_cache_miss(self):
+        self.user_repository.get_user_by_email.return_value = self.user
+        result = await self.auth_service.authorised_user(self.token, self.session)
+        self.assertEqual(result, self.user)
+        self.assertEqual(await self.redis.redis.ttl(UserCache.key(self.user.email)), 900)
+        self.assertEqual((await self.user_cache.get(self.user.email)).email, self.user.email)
+
+    async def test_authorised_user_cache_hit(self):
+        await self.user_cache.set(self.user, await self.user_cache.generation(self.user.email))
+        result = await self.auth_service.authorised_user(self.token, self.session)
+        self.assertEqual(result.id, self.user.id)
+        self.assertEqual(result.email, self.user.email)
+        self.assertTrue(result.confirmed)
+        self.user_repository.get_user_by_email.assert_not_awaited()
+
+    def test_cached_user_is_detached(self):
+        user = user_from_record(decode_record(encode_user(self.user)))
+        state = inspect(user)
+        self.assertTrue(state.detached)
+        self.assertEqual(state.identity, (self.user.id,))
+        self.assertEqual(state.expired_attributes, {"password", "created_at"})
+        self.assertFalse(state.modified)
+
+    async def test_authorised_user_stale_schema_version(self):
+        generation = await self.user_cache.generation(self.user.email)
+        await self.redis.redis.set(UserCache.key(self.user.email), encode_user(self.user, generation).replace(
+            f'"v":{CACHE_SCHEMA_VERSION}'.encode(), b'"v":0'))
+        self.user_repository.get_user_by_email.return_value = self.user
+        result = await self.auth_service.authorised_user(self.token, self.session)
+        self.assertEqual(result, self.user)
+        self.user_repository.get_user_by_email.assert_awaited_once()
+
+    async def test_authorised_user_local_hit(self):
+        await self.user_cache.set(self.user, await self.user_cache.generation(self.user.email))
+        with patch.object(self.redis.redis, "mget", spy(self.redis.redis.mget)) as mget:
+            await self.auth_service.authorised_user(self.token, self.session)
+            result = await self.auth_service.authorised_user(self.token, self.session)
+        self.assertEqual(result.email, self.user.email)
+        mget.assert_awaited_once()
+
+    async def test_invalidate_drops_local_copy_and_publishes(self):
+        await self.user_cache.set(self.user, await self.user_cache.generation(self.user.email))
+        await self.auth_service.authorised_user(self.token, self.session)
+        with patch.object(self.redis.redis, "publish", spy(self.redis.redis.publish)) as publish:
+            await self.user_cache.invalidate(self.user.email)
+        publish.assert_awaited_once_with("cache:invalidate", f"{self.bus.origin} user:{self.user.email}")
+        self.assertEqual(await self.redis.redis.exists(UserCache.key(self.user.email)), 0)
+        self.assertIsNone(self.user_cache._get_local(self.user.email))
+
+    async def test_fill_racing_with_invalidate_is_not_served(self):
+        generation = await self.user_cache.generation(self.user.email)
+        # The user changes after the filling request read it from the database.
+        await self.user_cache.invalidate(self.user.email)
+        await self.user_cache.set(self.user, generation)
+        self.assertIsNone(await self.user_cache.get(self.user.email))
+        await self.user_cache.set(self.user, await self.user_cache.generation(self.user.email))
+        self.assertEqual((await self.user_cache.get(self.user.email)).email, self.user.email)
+
+    def test_remote_invalidation_drops_local_copy(self):
+        self.user_cache._set_local(self.user.email, decode_record(encode_user(self.user)))
+        self.bus.receive(f"{self.bus.origin} user:{self.user.email}")
+        self.assertIsNotNone(self.user_cache._get_local(self.user.email))
+        self.bus.receive(f"another-worker user:{self.user.email}")
+        self.assertIsNone(self.user_cache._get_local(self.user.email))
+
+    def test_local_cache_is_bounded(self):
+        user_cache = UserCache(self.redis, 900, local_size=2)
+        for email in ("a@example.com", "b@example.com", "c@example.com"):
+            user_cache._set_local(email, {})
+        self.assertEqual(list(user_cache._local), ["b@example.com", "c@example.com"])
+
+    async def test_password_hash_async_round_trip(self):
+        password_manager = PasswordManager(max_workers=1)
+        hashed = await password_manager.get_password_hash_async("123456789")
+        self.assertTrue(await password_manager.verify_password_async("123456789", hashed))
+        self.assertFalse(await password_manager.verify_password_async("987654321", hashed))
+
+    def test_verify_and_update_rehashes_outdated_cost(self):
+        old_hash = PasswordManager(schemes=["bcrypt"], bcrypt__rounds=4).get_password_hash("123456789")
+        password_manager = PasswordManager(schemes=["bcrypt"], bcrypt__rounds=5)
+        verified, new_hash = password_manager.verify_and_update("123456789", old_hash)
+        self.assertTrue(verified)
+        self.assertIn("$05$", new_hash)
+        self.assertEqual(password_manager.verify_and_update("123456789", new_hash), (True, None))
+        self.assertEqual(password_manager.verify_and_update("987654321", old_hash), (False, None))
+
+    def test_encode_user_skips_password(self):
+        record = decode_record(encode_user(self.user))
+        self.assertNotIn("password", record)
+        self.assertEqual(record["email"], self.user.email)
+
+
+class TestJWTManager(unittest.TestCase):
+    def setUp(self):
+        self.jwt_manager = JWTManager("secret", "HS256", cache_size=2)
+        self.token = self.jwt_manager.create_token({"sub": "user@example.com"}, "refresh_token")
+
+    def test_decode_token_verifies_once(self):
+        with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode:
+            self.assertEqual(self.jwt_manager.decode_token(self.token), "user@example.com")
+            self.assertEqual(self.jwt_manager.decode_token(self.token), "user@example.com")
+        decode.assert_called_once()
+
+    def test_cached_scope_is_still_checked(self):
+        self.jwt_manager.decode_token(self.token)
+        with self.assertRaises(HTTPException):
+            self.jwt_manager.decode_email_token(self.token)
+
+    def test_expired_token_is_not_served_from_cache(self):
+        self.jwt_manager.decode_token(self.token)
+        self.jwt_manager._decoded[self.jwt_manager._cache_key(self.token)]["exp"] = time.time() - 1
+        with patch("src.services.auth.jwt.decode", side_effect=ExpiredSignatureError()):
+            with self.assertRaises(HTTPException):
+                self.jwt_manager.decode_token(self.token)
+        self.assertEqual(len(self.jwt_manager._decoded), 0)
+
+    def test_forget_and_bounded_size(self):
+        self.jwt_manager.decode_token(self.token)
+        self.jwt_manager.forget(self.token)
+        self.assertEqual(len(self.jwt_manager._decoded), 0)
+        for email in ("a@example.com", "b@example.com", "c@example.com"):
+            self.jwt_manager.decode_token(self.jwt_manager.create_token({"sub": email}, "refresh_token"))
+        self.assertEqual(len(self.jwt_manager._decoded), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
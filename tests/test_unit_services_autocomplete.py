@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+
+from src.services.autocomplete import PrefixIndex, AutocompleteIndex
+from src.services.invalidation import InvalidationBus
+
+contacts = [
+    (1, "Anna", "Smith", "anna@example.com"),
+    (2, "Annabel", "Jones", "bel@example.com"),
+    (3, "Bob", "Anders", "bob@example.com"),
+]
+
+
+class TestPrefixIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = PrefixIndex(contacts)
+
+    def ids(self, prefix, limit=10):
+        return [contact[0] for contact in self.index.search(prefix, limit)]
+
+    def test_search_matches_every_field_once(self):
+        self.assertEqual(self.ids("an"), [3, 1, 2])
+        self.assertEqual(self.ids("ANNA"), [1, 2])
+        self.assertEqual(self.ids("bel@"), [2])
+        self.assertEqual(self.ids("zed"), [])
+
+    def test_search_limit(self):
+        self.assertEqual(len(self.index.search("", 2)), 2)
+
+    def test_add_replaces_and_discard_removes(self):
+        self.index.add((1, "Zoe", "Smith", "zoe@example.com"))
+        self.assertEqual(self.ids("anna"), [2])
+        self.assertEqual(self.ids("zo"), [1])
+        self.index.discard(1)
+        self.assertEqual(self.ids("zo"), [])
+        self.assertEqual(self.ids("smith"), [])
+        self.assertEqual(len(self.index), 2)
+
+
+class TestAutocompleteIndex(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.redis = AsyncMock()
+        self.bus = InvalidationBus(self.redis)
+        self.autocomplete = AutocompleteIndex(max_users=2, ttl=60, bus=self.bus)
+        self.loader = AsyncMock(return_value=contacts)
+
+    async def test_builds_lazily_once(self):
+        results = await asyncio.gather(*(self.autocomplete.get(1, self.loader) for _ in range(5)))
+        self.assertTrue(all(index is results[0] for index in results))
+        self.loader.assert_awaited_once()
+
+    async def test_cancelled_build_is_retried_by_waiters(self):
+        started = asyncio.Event()
+
+        async def slow_loader():
+            started.set()
+            await asyncio.sleep(10)
+
+        builder = asyncio.create_task(self.autocomplete.get(1, slow_loader))
+        await started.wait()
+        waiter = asyncio.create_task(self.autocomplete.get(1, self.loader))
+        await asyncio.sleep(0)
+        builder.cancel()
+        self.assertEqual(len(await waiter), len(contacts))
+        with self.assertRaises(asyncio.CancelledError):
+            await builder
+        self.loader.assert_awaited_once()
+        self.assertEqual(self.autocomplete._building, {})
+
+    async def test_incremental_update_and_remote_invalidation(self):
+        index = await self.autocomplete.get(1, self.loader)
+        await self.autocomplete.contact_changed(1, (4, "Annie", None, None))
+        self.assertEqual(index.search("annie", 10), [(4, "Annie", None, None)])
+        self.redis.redis.publish.assert_awaited_once_with("cache:invalidate", f"{self.bus.origin} autocomplete:1")
+        self.assertIs(await self.autocomplete.get(1, self.loader), index)
+        self.bus.receive("another-worker autocomplete:1")
+        self.assertIsNot(await self.autocomplete.get(1, self.loader), index)
+
+    async def test_lru_eviction(self):
+        for user_id in (1, 2, 3):
+            await self.autocomplete.get(user_id, self.loader)
+        self.assertEqual(list(self.autocomplete._indexes), [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import select
+
+from src.database.models import User
+from src.services.avatars import AvatarTooLargeError, discard_avatar, process_avatar, spool_upload
+from src.services.storage import AvatarStorage, LocalStorage
+from tests.conftest import TestingSessionLocal
+
+
+class ChunkCounter(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+class TestSpoolUpload(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    async def test_copies_in_chunks(self):
+        source = ChunkCounter(b"x" * 1000)
+        path = await spool_upload(source, self.directory.name, max_size=1000, chunk_size=100)
+        self.assertEqual(path.read_bytes(), b"x" * 1000)
+        self.assertEqual(source.reads, 11)
+
+    async def test_rejects_large_uploads_without_leaving_a_file(self):
+        with self.assertRaises(AvatarTooLargeError):
+            await spool_upload(io.BytesIO(b"x" * 1001), self.directory.name, max_size=1000, chunk_size=100)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class TestLocalStorage(unittest.IsolatedAsyncioTestCase):
+    async def test_save_replaces_the_file_and_versions_the_url(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(os.path.join(root, "avatars"), "/media/avatars/")
+            source = Path(root) / "upload"
+            source.write_bytes(b"first")
+            first = await storage.save(str(source), "NotesApp/../Anna Smith")
+            source.write_bytes(b"second")
+            second = await storage.save(str(source), "NotesApp/../Anna Smith")
+            self.assertEqual(os.listdir(storage.root), ["NotesApp_.._Anna_Smith"])
+            self.assertEqual((storage.root / "NotesApp_.._Anna_Smith").read_bytes(), b"second")
+            self.assertTrue(first.startswith("/media/avatars/NotesApp_.._Anna_Smith?v="))
+            self.assertNotEqual(first, second)
+
+
+class TestAvatarStorage(unittest.TestCase):
+    def test_backends_must_implement_save(self):
+        class Incomplete(AvatarStorage):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class TestProcessAvatar(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        for target, value in (("src.services.avatars.avatar_storage", LocalStorage(self.root.name, "/media")),
+                              ("src.services.avatars.sessionmanager", AsyncMock(session=self.session)),
+                              ("src.repository.users.user_cache", AsyncMock())):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        async with TestingSessionLocal() as session:
+            self.user = (await session.execute(select(User).limit(1))).scalar_one()
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def session():
+        async with TestingSessionLocal() as session:
+            yield session
+
+    async def test_stores_the_avatar_and_removes_the_spooled_file(self):
+        spooled = Path(self.root.name) / "spooled"
+        spooled.write_bytes(b"image")
+        result = await process_avatar(self.user.email, str(spooled))
+        self.assertTrue(result["avatar"].startswith(f"/media/NotesApp_{self.user.id}?v="))
+        self.assertFalse(spooled.exists())
+        async with TestingSessionLocal() as session:
+            user = await session.get(User, self.user.id)
+        self.assertEqual(user.avatar, result["avatar"])
+
+    async def test_users_with_the_same_name_get_their_own_avatar(self):
+        async with TestingSessionLocal() as session:
+            namesake = User(name=self.user.name, email="namesake@example.com", password="x")
+            session.add(namesake)
+            await session.commit()
+        try:
+            urls = []
+            for email, data in ((self.user.email, b"mine"), (namesake.email, b"theirs")):
+                spooled = Path(self.root.name) / "spooled"
+                spooled.write_bytes(data)
+                urls.append((await process_avatar(email, str(spooled)))["avatar"])
+            self.assertNotEqual(urls[0].split("?")[0], urls[1].split("?")[0])
+            self.assertEqual((Path(self.root.name) / f"NotesApp_{self.user.id}").read_bytes(), b"mine")
+        finally:
+            async with TestingSessionLocal() as session:
+                await session.delete(await session.get(User, namesake.id))
+                await session.commit()
+
+    async def test_dead_jobs_remove_the_spooled_file(self):
+        spooled = Path(self.root.name) / "spooled"
+        spooled.write_bytes(b"image")
+        await discard_avatar(self.user.email, str(spooled))
+        self.assertFalse(spooled.exists())
+        await discard_avatar(self.user.email, str(spooled))
+
+    async def test_missing_users_are_skipped(self):
+        spooled = Path(self.root.name) / "spooled"
+        spooled.write_bytes(b"image")
+        self.assertIsNone(await process_avatar("nobody@example.com", str(spooled)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+from fakeredis import FakeServer, aioredis
+from redis.exceptions import ConnectionError
+
+from src.routes.contacts import cached_json
+from src.schemas import ContactResponse
+from src.services.contact_cache import ContactCache, etag_matches, make_etag
+
+
+class TestContactCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.redis = aioredis.FakeRedis(server=FakeServer())
+        self.cache = ContactCache(self.redis, ttl=300, max_entry_size=16)
+
+    async def test_miss_then_hit(self):
+        version = await self.cache.version(1)
+        self.assertEqual(await self.cache.version(1), version)
+        self.assertIsNone(await self.cache.get(1, version, "contact:5"))
+        await self.cache.set(1, version, "contact:5", b'{"id":5}')
+        self.assertEqual(await self.cache.get(1, version, "contact:5"), b'{"id":5}')
+        self.assertLessEqual(await self.redis.redis.ttl(self.cache.key(1, version, "contact:5")), 300)
+
+    async def test_bump_invalidates_only_that_user(self):
+        first, other = await self.cache.version(1), await self.cache.version(2)
+        await self.cache.set(1, first, "list", b"[1]")
+        await self.cache.set(2, other, "list", b"[2]")
+        await self.cache.bump(1)
+        self.assertNotEqual(await self.cache.version(1), first)
+        self.assertIsNone(await self.cache.get(1, await self.cache.version(1), "list"))
+        self.assertEqual(await self.cache.version(2), other)
+        self.assertEqual(await self.cache.get(2, other, "list"), b"[2]")
+
+    async def test_entry_read_before_a_bump_is_never_served(self):
+        version = await self.cache.version(1)
+        await self.cache.bump(1)
+        await self.cache.set(1, version, "list", b"stale")
+        self.assertIsNone(await self.cache.get(1, await self.cache.version(1), "list"))
+
+    async def test_lost_versions_are_not_reused(self):
+        version = await self.cache.version(1)
+        self.assertGreater(await self.redis.redis.ttl(self.cache.version_key(1)), 0)
+        await self.redis.redis.flushall()
+        self.assertNotEqual(await self.cache.version(1), version)
+
+    async def test_large_payloads_are_not_cached(self):
+        await self.cache.set(1, "v", "list", b"x" * 17)
+        self.assertEqual(await self.redis.redis.keys(), [])
+
+    async def test_redis_errors_are_misses(self):
+        self.redis.redis = AsyncMock()
+        self.redis.redis.get.side_effect = ConnectionError("down")
+        self.redis.redis.set.side_effect = ConnectionError("down")
+        self.assertIsNone(await self.cache.version(1))
+        self.assertIsNone(await self.cache.get(1, "v", "list"))
+        await self.cache.set(1, None, "list", b"[]")
+        self.redis.redis.set.assert_not_awaited()
+
+    async def test_no_version_after_a_failed_bump(self):
+        version = await self.cache.version(1)
+        with patch.object(self.redis.redis, "set", side_effect=ConnectionError("down")):
+            await self.cache.bump(1)
+            self.assertIsNone(await self.cache.version(1))
+        self.assertNotIn(await self.cache.version(1), (None, version))
+
+
+class TestETag(unittest.TestCase):
+    def test_etag_depends_on_user_version_and_entry(self):
+        etag = make_etag(1, 3, "list")
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(etag, make_etag(1, 3, "list"))
+        self.assertEqual(len({etag, make_etag(2, 3, "list"), make_etag(1, 4, "list"), make_etag(1, 3, "x")}), 4)
+
+    def test_etag_matches(self):
+        etag = make_etag(1, 3, "list")
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+
+class TestCachedJson(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch("src.routes.contacts.contact_cache", new_callable=AsyncMock)
+        self.contact_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.contact_cache.version.return_value = 7
+        self.contact_cache.get.return_value = None
+        self.build = AsyncMock(return_value=ContactResponse(id=5, name="Anna", phone="5550001111", email=None))
+
+    async def test_miss_builds_caches_and_tags(self):
+        response = await cached_json(1, "contact:5", self.build)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["etag"], make_etag(1, 7, "contact:5"))
+        self.contact_cache.set.assert_awaited_once_with(1, 7, "contact:5", response.body)
+
+    async def test_matching_etag_skips_cache_and_database(self):
+        response = await cached_json(1, "contact:5", self.build, make_etag(1, 7, "contact:5"))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, b"")
+        self.contact_cache.get.assert_not_awaited()
+        self.build.assert_not_awaited()
+
+    async def test_stale_etag_gets_the_cached_payload(self):
+        self.contact_cache.get.return_value = b'{"id":5}'
+        response = await cached_json(1, "contact:5", self.build, make_etag(1, 6, "contact:5"))
+        self.assertEqual((response.status_code, response.body), (200, b'{"id":5}'))
+        self.build.assert_not_awaited()
+
+    async def test_without_redis_no_etag(self):
+        self.contact_cache.version.return_value = None
+        response = await cached_json(1, "contact:5", self.build, '"anything"')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("etag", response.headers)
+        self.contact_cache.get.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
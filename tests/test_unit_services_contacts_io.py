@@ -0,0 +1,172 @@
+import gzip
+import io
+import json
+import unittest
+from datetime import date
+from unittest.mock import AsyncMock, patch
+
+from pydantic import ValidationError
+from sqlalchemy import delete, select
+
+from src.database.models import Contact, User
+from src.repository.contacts import stream_contacts
+from src.schemas import ContactModel
+from src.services.contacts_io import (ContactFileError, detect_format, export_chunks, import_contacts, read_csv,
+                                      read_ndjson, read_vcard, validated_records)
+from tests.conftest import TestingSessionLocal
+
+
+def upload(text: str) -> io.BytesIO:
+    return io.BytesIO(text.encode())
+
+
+class TestReaders(unittest.TestCase):
+    def test_detect_format(self):
+        self.assertEqual(detect_format("contacts.CSV", None), "csv")
+        self.assertEqual(detect_format("export.jsonl", None), "ndjson")
+        self.assertEqual(detect_format(None, "text/vcard; charset=utf-8"), "vcard")
+        self.assertIsNone(detect_format("contacts.txt", "text/plain"))
+
+    def test_read_csv(self):
+        records = list(read_csv(upload('\ufeffName,Phone,Extra\nAnna,5550001111,x\n\n"Bob, Jr",5550002222,y\n')))
+        self.assertEqual(records, [(2, {"name": "Anna", "phone": "5550001111", "extra": "x"}),
+                                   (4, {"name": "Bob, Jr", "phone": "5550002222", "extra": "y"})])
+
+    def test_read_ndjson(self):
+        records = list(read_ndjson(upload('{"name": "Anna"}\n\n[1]\n{broken\n')))
+        self.assertEqual(records, [(1, {"name": "Anna"}), (3, {"__error__": "Not a JSON object"}),
+                                   (4, {"__error__": "Not a JSON object"})])
+
+    def test_read_vcard(self):
+        text = ("BEGIN:VCARD\r\nVERSION:3.0\r\nN:Smith;Anna;;;\r\nFN:Anna Smith\r\n"
+                "TEL;TYPE=cell:5550001111\r\nitem1.EMAIL:anna@example.com\r\nBDAY:19900102\r\n"
+                "NOTE:met at\\, the\r\n  conference\r\nEND:VCARD\r\n"
+                "BEGIN:VCARD\r\nFN:Bob\r\nEND:VCARD\r\n")
+        self.assertEqual(list(read_vcard(upload(text))), [
+            (1, {"surname": "Smith", "name": "Anna", "fn": "Anna Smith", "phone": "5550001111",
+                 "email": "anna@example.com", "birthday": "1990-01-02", "description": "met at, the conference"}),
+            (11, {"fn": "Bob"}),
+        ])
+
+    def test_unterminated_vcard(self):
+        with self.assertRaises(ContactFileError):
+            list(read_vcard(upload("BEGIN:VCARD\nFN:Bob\n")))
+
+    def test_validated_records(self):
+        text = "name,surname,email,phone,birthday\nAnna,,anna@example.com,,1990-01-02\nB,,not-an-email,1,\n"
+        (first, values, error), (second, _, rejected) = validated_records(upload(text), "csv")
+        self.assertEqual((first, error), (2, None))
+        self.assertEqual(values, {"name": "Anna", "surname": None, "email": "anna@example.com", "phone": None,
+                                  "birthday": date(1990, 1, 2), "description": None})
+        self.assertEqual(second, 3)
+        self.assertIn("name:", rejected)
+        self.assertIn("email:", rejected)
+        self.assertIn("phone:", rejected)
+
+    def test_emails_are_validated_like_contact_model(self):
+        emails = ["anna@bücher.example", "ANNA@XN--BCHER-KVA.EXAMPLE", '"anna smith"@example.com',
+                  '"anna"@example.com', "anna@example.com.", "Postmaster@example.com",
+                  "anna@" + "ü" * 60 + ".example", "Anna <anna@example.com>"]
+        text = "\n".join(json.dumps({"name": "Anna", "email": email}) for email in emails)
+        for email, (_, values, error) in zip(emails, validated_records(upload(text), "ndjson")):
+            with self.subTest(email=email):
+                try:
+                    expected = ContactModel(name="Anna", email=email).email
+                except ValidationError:
+                    self.assertIsNone(values)
+                    self.assertIn("email:", error)
+                else:
+                    self.assertIsNone(error)
+                    self.assertEqual(values["email"], expected)
+
+
+class TestImportContacts(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = patch("src.repository.contacts.autocomplete_index", new_callable=AsyncMock)
+        self.autocomplete_index = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.repository.contacts.contact_cache", new_callable=AsyncMock)
+        self.contact_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = TestingSessionLocal()
+        self.user = (await self.session.execute(select(User).limit(1))).scalar_one()
+        self.session.add(Contact(name="existing", phone="5552000000", user=self.user))
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.execute(delete(Contact).where(Contact.phone.like("5552%")))
+        await self.session.commit()
+        await self.session.close()
+
+    async def test_reports_rejected_rows_and_imports_the_rest(self):
+        lines = ['{"name": "imp%d", "phone": "555200%04d"}' % (i, i) for i in range(1, 26)]
+        lines[4] = '{"name": "imp5", "phone": "5552000000"}'
+        lines[9] = '{"name": "imp10", "phone": "5552000001"}'
+        lines[14] = '{"name": "x", "phone": "5552000015"}'
+        report = await import_contacts(upload("\n".join(lines)), "ndjson", self.session, self.user, batch_size=10)
+        self.assertEqual((report["received"], report["imported"], report["failed"]), (25, 22, 3))
+        self.assertEqual([error["line"] for error in report["errors"]], [5, 10, 15])
+        self.assertEqual(report["errors"][0]["error"], "phone: Already used by another contact")
+        self.assertEqual(report["errors"][1]["error"], "phone: Appears earlier in the file")
+        stored = await self.session.execute(select(Contact.name).filter(Contact.phone.like("5552%"),
+                                                                        Contact.user_id == self.user.id))
+        self.assertEqual(len(stored.all()), 23)
+        self.assertEqual(self.autocomplete_index.contacts_reloaded.await_count, 3)
+
+    async def test_error_list_is_capped(self):
+        text = "\n".join('{"name": "x"}' for _ in range(5))
+        report = await import_contacts(upload(text), "ndjson", self.session, self.user, max_errors=2)
+        self.assertEqual((report["failed"], len(report["errors"])), (5, 2))
+
+
+class TestExportContacts(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = TestingSessionLocal()
+        self.user = (await self.session.execute(select(User).limit(1))).scalar_one()
+        self.session.add_all([
+            Contact(name="Anna", surname="Smith; Jr", phone="5553000001", email="anna@example.com",
+                    birthday=date(1990, 1, 2), description="line one\nline, two " + "x" * 100, user=self.user),
+            Contact(name="Bob", phone="5553000002", user=self.user),
+            Contact(name="Carl", surname='O"Neil', phone="5553000003", user=self.user),
+        ])
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.execute(delete(Contact).where(Contact.phone.like("5553%")))
+        await self.session.commit()
+        await self.session.close()
+
+    async def export(self, fmt, compress=False):
+        chunks = [chunk async for chunk in export_chunks(stream_contacts(self.user, self.session, batch_size=2),
+                                                         fmt, compress=compress)]
+        return chunks, b"".join(chunks)
+
+    async def reimported(self, fmt, data):
+        return [values for _, values, error in validated_records(io.BytesIO(data), fmt)
+                if values and values["phone"].startswith("5553")]
+
+    async def test_formats_round_trip_through_import(self):
+        expected = None
+        for fmt in ("csv", "ndjson", "vcard"):
+            _, data = await self.export(fmt)
+            records = await self.reimported(fmt, data)
+            self.assertEqual(len(records), 3, fmt)
+            expected = expected or records
+            self.assertEqual(records, expected, fmt)
+        self.assertEqual(expected[0]["surname"], "Smith; Jr")
+        self.assertEqual(expected[0]["description"], "line one\nline, two " + "x" * 100)
+        self.assertEqual(expected[2]["surname"], 'O"Neil')
+
+    async def test_vcard_lines_are_folded(self):
+        _, data = await self.export("vcard")
+        self.assertTrue(all(len(line) <= 75 for line in data.decode().split("\r\n")))
+
+    async def test_gzip_and_one_chunk_per_batch(self):
+        chunks, data = await self.export("ndjson")
+        self.assertGreaterEqual(len(chunks), 2)
+        _, compressed = await self.export("ndjson", compress=True)
+        self.assertEqual(gzip.decompress(compressed), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fakeredis import FakeServer, aioredis
+from redis.exceptions import ConnectionError
+
+from src.database.models import User
+from src.services.email import send_email, send_verification_email
+from src.services.jobs import JobQueue, Worker
+
+
+class JobQueueTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.redis = aioredis.FakeRedis(server=FakeServer())
+        self.jobs = JobQueue(self.redis, visibility_timeout=30, max_attempts=3, retry_backoff=0)
+        self.calls = []
+
+        @self.jobs.task("default")
+        async def add(a, b):
+            self.calls.append((a, b))
+            return a + b
+
+        async def discard(*args):
+            self.calls.append(("discard", *args))
+
+        @self.jobs.task("default", max_attempts=2, on_dead=discard)
+        async def broken(*args):
+            raise ValueError("boom")
+
+    async def asyncTearDown(self):
+        await self.redis.redis.aclose()
+
+    async def lengths(self, queue="default"):
+        r = self.redis.redis
+        return {"ready": await r.llen(f"jobs:{queue}:ready"), "processing": await r.llen(f"jobs:{queue}:processing"),
+                "delayed": await r.zcard(f"jobs:{queue}:delayed"), "dead": await r.llen(f"jobs:{queue}:dead")}
+
+
+class TestJobQueue(JobQueueTestCase):
+    async def test_enqueue_reserve_complete(self):
+        job_id = await self.jobs.enqueue("add", 1, b=2)
+        self.assertEqual((await self.jobs.status(job_id))["status"], "queued")
+        job = await self.jobs.reserve("default")
+        self.assertEqual((job["id"], job["args"], job["kwargs"], job["attempts"]), (job_id, [1], {"b": 2}, 1))
+        self.assertEqual((await self.jobs.status(job_id))["status"], "running")
+        await self.jobs.complete(job, 3)
+        status = await self.jobs.status(job_id)
+        self.assertEqual((status["status"], status["result"]), ("done", 3))
+        self.assertGreater(await self.redis.redis.ttl(f"jobs:job:{job_id}"), 0)
+        self.assertEqual(await self.lengths(), {"ready": 0, "processing": 0, "delayed": 0, "dead": 0})
+
+    async def test_jobs_are_taken_in_order(self):
+        first = await self.jobs.enqueue("add", 1, 1)
+        second = await self.jobs.enqueue("add", 2, 2)
+        self.assertEqual([(await self.jobs.reserve("default"))["id"] for _ in range(2)], [first, second])
+        self.assertIsNone(await self.jobs.reserve("default", timeout=0.01))
+
+    async def test_failed_jobs_are_retried_then_dead_lettered(self):
+        job_id = await self.jobs.enqueue("broken")
+        job = await self.jobs.reserve("default")
+        await self.jobs.fail(job, "ValueError: boom")
+        self.assertEqual((await self.jobs.status(job_id))["status"], "retrying")
+        self.assertEqual(await self.lengths(), {"ready": 0, "processing": 0, "delayed": 1, "dead": 0})
+        self.assertEqual(await self.jobs.promote_due("default"), 1)
+        job = await self.jobs.reserve("default")
+        self.assertEqual(job["attempts"], 2)
+        await self.jobs.fail(job, "ValueError: boom")
+        status = await self.jobs.status(job_id)
+        self.assertEqual((status["status"], status["error"]), ("dead", "ValueError: boom"))
+        self.assertEqual(await self.lengths(), {"ready": 0, "processing": 0, "delayed": 0, "dead": 1})
+        self.assertEqual(self.calls, [("discard",)])
+
+    async def test_jobs_dead_after_a_timeout_are_cleaned_up(self):
+        job_id = await self.jobs.enqueue("broken", "/spool/file")
+        for attempt in range(2):
+            await self.jobs.reserve("default")
+            deadline = await self.redis.redis.zscore("jobs:default:deadlines", job_id)
+            with patch("src.services.jobs.time.time", return_value=deadline + 1), \
+                    self.assertLogs("src.services.jobs", "WARNING"):
+                self.assertEqual(await self.jobs.requeue_expired("default"), 1)
+                await self.jobs.promote_due("default")
+            self.assertEqual(self.calls, [("discard", "/spool/file")] if attempt else [])
+        self.assertEqual((await self.jobs.status(job_id))["status"], "dead")
+
+    async def test_retries_back_off(self):
+        self.jobs.retry_backoff = 60
+        job_id = await self.jobs.enqueue("broken")
+        await self.jobs.fail(await self.jobs.reserve("default"), "boom")
+        self.assertEqual(await self.jobs.promote_due("default"), 0)
+        retry_at = await self.redis.redis.zscore("jobs:default:delayed", job_id)
+        with patch("src.services.jobs.time.time", return_value=retry_at):
+            self.assertEqual(await self.jobs.promote_due("default"), 1)
+
+    async def test_expired_jobs_are_taken_over(self):
+        job_id = await self.jobs.enqueue("add", 1, 2)
+        job = await self.jobs.reserve("default")
+        self.assertEqual(await self.jobs.requeue_expired("default"), 0)
+        deadline = await self.redis.redis.zscore("jobs:default:deadlines", job_id)
+        with patch("src.services.jobs.time.time", return_value=deadline + 1), \
+                self.assertLogs("src.services.jobs", "WARNING"):
+            self.assertEqual(await self.jobs.requeue_expired("default"), 1)
+            self.assertEqual(await self.jobs.promote_due("default"), 1)
+        self.assertEqual((await self.jobs.status(job_id))["error"], "Visibility timeout expired")
+        # The first worker finishing late marks the job done, so the retry is skipped.
+        await self.jobs.complete(job, 3)
+        self.assertIsNone(await self.jobs.reserve("default", timeout=0.01))
+        self.assertEqual((await self.jobs.status(job_id))["status"], "done")
+        self.assertEqual(await self.lengths(), {"ready": 0, "processing": 0, "delayed": 0, "dead": 0})
+
+    async def test_unstamped_jobs_get_a_full_timeout(self):
+        job_id = await self.jobs.enqueue("add", 1, 2)
+        await self.redis.redis.lmove("jobs:default:ready", "jobs:default:processing", "RIGHT", "LEFT")
+        self.assertEqual(await self.jobs.requeue_expired("default"), 0)
+        self.assertIsNotNone(await self.redis.redis.zscore("jobs:default:deadlines", job_id))
+
+    async def test_extend_pushes_the_deadline(self):
+        job_id = await self.jobs.enqueue("add", 1, 2)
+        job = await self.jobs.reserve("default")
+        deadline = await self.redis.redis.zscore("jobs:default:deadlines", job_id)
+        with patch("src.services.jobs.time.time", return_value=deadline):
+            await self.jobs.extend(job)
+        self.assertEqual(await self.redis.redis.zscore("jobs:default:deadlines", job_id), deadline + 30)
+
+
+class TestWorker(JobQueueTestCase):
+    async def run_until(self, worker, predicate, timeout=5):
+        runner = asyncio.create_task(worker.run())
+        try:
+            async with asyncio.timeout(timeout):
+                while not await predicate():
+                    await asyncio.sleep(0.01)
+        finally:
+            worker.stop()
+            await runner
+
+    async def test_runs_jobs_with_bounded_concurrency(self):
+        running, peak = 0, 0
+
+        @self.jobs.task("slow")
+        async def slow(i):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+            return i
+
+        ids = [await self.jobs.enqueue("slow", i) for i in range(8)]
+        ids.append(await self.jobs.enqueue("add", 1, 2))
+        worker = Worker(self.jobs, {"slow": 3, "default": 1}, poll_timeout=0.01, idle_sleep=0.005)
+
+        async def all_done():
+            return all([(await self.jobs.status(job_id))["status"] == "done" for job_id in ids])
+
+        await self.run_until(worker, all_done)
+        self.assertEqual(peak, 3)
+        self.assertEqual([(await self.jobs.status(job_id))["result"] for job_id in ids], list(range(8)) + [3])
+
+    async def test_failing_jobs_end_in_the_dead_letter_list(self):
+        job_id = await self.jobs.enqueue("broken")
+        worker = Worker(self.jobs, {"default": 1}, poll_timeout=0.01, maintenance_interval=0.01, idle_sleep=0.005)
+
+        async def dead():
+            return (await self.jobs.status(job_id))["status"] == "dead"
+
+        with self.assertLogs("src.services.jobs", "ERROR") as logs:
+            await self.run_until(worker, dead)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual((await self.jobs.status(job_id))["attempts"], 2)
+
+    async def test_long_jobs_keep_their_visibility(self):
+        self.jobs.visibility_timeout = 0.15
+
+        @self.jobs.task("default")
+        async def long():
+            await asyncio.sleep(0.4)
+            self.calls.append("long")
+
+        job_id = await self.jobs.enqueue("long")
+        worker = Worker(self.jobs, {"default": 2}, poll_timeout=0.01, maintenance_interval=0.02, idle_sleep=0.005)
+
+        async def done():
+            return (await self.jobs.status(job_id))["status"] == "done"
+
+        await self.run_until(worker, done)
+        self.assertEqual(self.calls, ["long"])
+        self.assertEqual((await self.jobs.status(job_id))["attempts"], 1)
+
+    async def test_unknown_tasks_are_dead_lettered(self):
+        job_id = await self.jobs.enqueue("add", 1, 2)
+        del self.jobs.tasks["add"]
+        worker = Worker(self.jobs, {"default": 1}, poll_timeout=0.01, idle_sleep=0.005)
+
+        async def dead():
+            return (await self.jobs.status(job_id))["status"] == "dead"
+
+        await self.run_until(worker, dead)
+        self.assertEqual((await self.jobs.status(job_id))["error"], "Unknown task add")
+
+
+class TestEmailJobs(unittest.IsolatedAsyncioTestCase):
+    async def test_send_email_queues_a_job(self):
+        with patch("src.services.email.job_queue", new_callable=AsyncMock) as job_queue:
+            await send_email(User(email="anna@example.com", name="Anna"), "http://test/")
+        job_queue.enqueue.assert_awaited_once_with("send_verification_email", "anna@example.com", "Anna",
+                                                   "http://test/")
+
+    async def test_queue_errors_are_logged(self):
+        with patch("src.services.email.job_queue", new_callable=AsyncMock) as job_queue, \
+                self.assertLogs("src.services.email", "ERROR"):
+            job_queue.enqueue.side_effect = ConnectionError("down")
+            await send_email(User(email="anna@example.com", name="Anna"), "http://test/")
+
+    async def test_job_waits_for_delivery(self):
+        with patch("src.services.email.mailer", new_callable=AsyncMock) as mailer:
+            mailer.send.side_effect = ConnectionError("down")
+            with self.assertRaises(ConnectionError):
+                await send_verification_email("anna@example.com", "Anna", "http://test/")
+        message = mailer.send.await_args.args[0]
+        self.assertEqual(mailer.send.await_args.kwargs, {"max_attempts": 1})
+        self.assertEqual(message["To"], "anna@example.com")
+        self.assertIn("Hi Anna", message.get_content())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import asyncio
+import socket
+import unittest
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+
+from src.services.mailer import Mailer, render_message
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Handler:
+    """
+    Stand-in SMTP server recording delivered messages and replying with queued error codes first.
+    """
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.replies = []
+        self.deferred = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.replies:
+            return self.replies.pop(0)
+        if self.deferred.intersection(envelope.rcpt_tos):
+            return "451 Try again later"
+        self.sessions.add(id(session))
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+class TestMailer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.handler = Handler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=free_port())
+        self.controller.start()
+        self.addCleanup(lambda: self.controller.stop())
+
+    async def asyncSetUp(self):
+        self.mailer = self.make_mailer(self.controller.port)
+        self.mailer.start()
+
+    async def asyncTearDown(self):
+        await self.mailer.stop()
+
+    def make_mailer(self, port, **options):
+        options = {"pool_size": 2, "max_attempts": 3, "backoff": 0.01, **options}
+        return Mailer("127.0.0.1", port, sender="App <app@example.com>", start_tls=False, timeout=5, **options)
+
+    def message(self, i=0):
+        return render_message(f"user{i}@example.com", "Confirm your email ", "email_template.html",
+                              host="http://test/", username=f"user{i}", token="abc")
+
+    async def test_reuses_pooled_connections(self):
+        await asyncio.gather(*(self.mailer.send(self.message(i)) for i in range(10)))
+        self.assertEqual(len(self.handler.messages), 10)
+        self.assertLessEqual(len(self.handler.sessions), 2)
+        await self.mailer.send(self.message(10))
+        self.assertLessEqual(len(self.handler.sessions), 2)
+
+    async def test_message_content(self):
+        await self.mailer.send(self.message())
+        envelope = self.handler.messages[0]
+        self.assertEqual((envelope.mail_from, envelope.rcpt_tos), ("app@example.com", ["user0@example.com"]))
+        self.assertIn(b'href="http://test/auth/confirmed_email/abc"', envelope.content)
+        self.assertIn(b"Hi user0", envelope.content)
+
+    async def test_temporary_errors_are_retried(self):
+        self.handler.replies = ["451 Try again later"]
+        with self.assertLogs("src.services.mailer", "WARNING"):
+            await self.mailer.send(self.message())
+        self.assertEqual(len(self.handler.messages), 1)
+
+    async def test_permanent_errors_are_not_retried(self):
+        # A retry would be accepted by the second reply.
+        self.handler.replies = ["550 No such user", "250 OK"]
+        with self.assertLogs("src.services.mailer", "ERROR"), self.assertRaises(aiosmtplib.SMTPDataError):
+            await self.mailer.send(self.message())
+        self.assertEqual(self.handler.replies, ["250 OK"])
+
+    async def test_callers_can_leave_retries_to_themselves(self):
+        self.handler.replies = ["451 Try again later"]
+        with self.assertLogs("src.services.mailer", "ERROR"), self.assertRaises(aiosmtplib.SMTPDataError):
+            await self.mailer.send(self.message(), max_attempts=1)
+        self.assertEqual((self.handler.replies, self.handler.messages), ([], []))
+
+    async def test_retries_do_not_hold_up_the_batch(self):
+        mailer = self.make_mailer(self.controller.port, pool_size=1, backoff=30)
+        mailer.start()
+        self.handler.deferred.add("user0@example.com")
+        with self.assertLogs("src.services.mailer", "WARNING"):
+            deferred = asyncio.create_task(mailer.send(self.message(0)))
+            await asyncio.wait_for(asyncio.gather(*(mailer.send(self.message(i)) for i in range(1, 4))), 5)
+            self.assertEqual(len(self.handler.messages), 3)
+            self.assertFalse(deferred.done())
+            await mailer.stop(timeout=0.1)
+        with self.assertRaises(asyncio.CancelledError):
+            await deferred
+
+    async def test_unreachable_server_gives_up_after_max_attempts(self):
+        mailer = self.make_mailer(free_port())
+        mailer.start()
+        try:
+            with self.assertLogs("src.services.mailer", "WARNING") as logs, self.assertRaises(OSError):
+                await mailer.send(self.message())
+            self.assertEqual(sum("retrying" in line for line in logs.output), 2)
+            self.assertIn("Could not send email", logs.output[-1])
+        finally:
+            await mailer.stop()
+
+    async def test_reconnects_after_the_server_drops_the_connection(self):
+        await self.mailer.send(self.message(0))
+        await asyncio.to_thread(self.controller.stop)
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=self.controller.port)
+        self.controller.start()
+        await self.mailer.send(self.message(1))
+        self.assertEqual(len(self.handler.messages), 2)
+
+    async def test_stop_delivers_queued_messages(self):
+        for i in range(5):
+            await self.mailer.enqueue(self.message(i))
+        await self.mailer.stop()
+        self.assertEqual(len(self.handler.messages), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
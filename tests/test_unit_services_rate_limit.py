@@ -0,0 +1,231 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from fastapi_limiter import default_identifier, http_default_callback
+from redis.exceptions import ConnectionError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.database.models import User
+from src.services.auth import jwt_manager
+from src.services.rate_limit import HybridRateLimiter, user_identifier
+
+
+class LeaseRedis:
+    """
+    Runs the lease script of the limiter in Python against an in-memory store.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.store = {}
+        self.calls = 0
+        self.down = False
+
+    def register_script(self, script):
+        async def run(keys, args):
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("down")
+            key, (limit, window, wanted) = keys[0], args
+            used, expires = self.store.get(key, (0, 0.0))
+            if expires <= self.now:
+                used = 0
+            granted = min(wanted, limit - used)
+            if granted > 0:
+                if used == 0:
+                    expires = self.now + window / 1000
+                self.store[key] = (used + granted, expires)
+            return [max(granted, 0), round((expires - self.now) * 1000)]
+        return run
+
+
+def make_request(path="/api/contacts/", host="10.0.0.1", token=None, route=None):
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    scope = {"type": "http", "method": "GET", "path": path, "headers": headers, "client": (host, 1000)}
+    if route is not None:
+        scope["route"] = route
+    return Request(scope)
+
+
+class TestHybridRateLimiter(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = LeaseRedis()
+        patcher = patch.multiple("src.services.rate_limit.FastAPILimiter", redis=self.redis, prefix="test",
+                                 identifier=default_identifier, http_callback=http_default_callback)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def worker(self, times=10, seconds=60, lease=3):
+        limiter = HybridRateLimiter(times=times, seconds=seconds, lease=lease)
+        limiter.clock = lambda: self.redis.now
+        return limiter
+
+    async def allowed(self, limiter, count, request=None):
+        admitted = 0
+        for _ in range(count):
+            try:
+                await limiter(request or make_request(), Response())
+                admitted += 1
+            except HTTPException as err:
+                self.assertEqual(err.status_code, 429)
+        return admitted
+
+    async def test_spends_leases_locally(self):
+        limiter = self.worker()
+        self.assertEqual(await self.allowed(limiter, 10), 10)
+        self.assertEqual(self.redis.calls, 4)
+        self.assertEqual(await self.allowed(limiter, 5), 0)
+        self.assertEqual(self.redis.calls, 4)
+
+    async def test_retry_after_is_the_rest_of_the_window(self):
+        limiter = self.worker(times=1)
+        await limiter(make_request(), Response())
+        self.redis.now = 20
+        with self.assertRaises(HTTPException) as raised:
+            await limiter(make_request(), Response())
+        self.assertEqual(raised.exception.headers["Retry-After"], "40")
+
+    async def test_workers_share_the_limit(self):
+        workers = [self.worker(times=20, lease=3) for _ in range(4)]
+        admitted = 0
+        for _ in range(10):
+            for limiter in workers:
+                admitted += await self.allowed(limiter, 1)
+        self.assertEqual(admitted, 20)
+
+    async def test_leases_held_by_other_workers_are_not_shared(self):
+        first, second = self.worker(times=10), self.worker(times=10)
+        self.assertEqual(await self.allowed(first, 1), 1)
+        # The 2 tokens left in the lease of the first worker are lost to the second one.
+        self.assertEqual(await self.allowed(second, 10), 7)
+
+    async def test_new_window_gets_new_tokens(self):
+        limiter = self.worker()
+        self.assertEqual(await self.allowed(limiter, 12), 10)
+        self.redis.now = 60
+        self.assertEqual(await self.allowed(limiter, 12), 10)
+
+    async def test_keys_are_per_client_and_path(self):
+        limiter = self.worker(times=2)
+        self.assertEqual(await self.allowed(limiter, 3, make_request()), 2)
+        self.assertEqual(await self.allowed(limiter, 3, make_request(host="10.0.0.2")), 2)
+        self.assertEqual(await self.allowed(limiter, 3, make_request(path="/api/contacts/5")), 2)
+
+    async def test_limits_per_worker_without_redis(self):
+        self.redis.down = True
+        limiter = self.worker()
+        self.assertEqual(await self.allowed(limiter, 15), 10)
+        self.assertEqual(self.redis.calls, 1)
+        self.redis.down = False
+        self.redis.now = 60
+        self.assertEqual(await self.allowed(limiter, 15), 10)
+
+    async def test_local_state_is_bounded(self):
+        limiter = self.worker()
+        limiter.max_keys = 5
+        for host in range(20):
+            await limiter(make_request(host=f"10.0.1.{host}"), Response())
+        self.assertEqual(len(limiter._buckets), 5)
+
+    def test_default_lease_is_a_fraction_of_the_limit(self):
+        limiter = HybridRateLimiter(times=10, seconds=60)
+        self.assertEqual([limiter.lease_size(times) for times in (120, 20, 10, 5, 3, 2, 1)], [12, 3, 3, 2, 1, 1, 1])
+
+    def test_plan_multipliers(self):
+        limiter = HybridRateLimiter(times=10, seconds=60)
+        limiter.plans = {"free": 1, "pro": 5}
+        self.assertEqual([limiter.limit(plan) for plan in ("free", "pro", None, "unknown")], [10, 50, 10, 10])
+
+
+class TestUserIdentifier(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = LeaseRedis()
+        patcher = patch.multiple("src.services.rate_limit.FastAPILimiter", redis=self.redis, prefix="test",
+                                 identifier=default_identifier, http_callback=http_default_callback)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.services.rate_limit.user_cache", new_callable=AsyncMock)
+        self.user_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.services.rate_limit.repository_users", new_callable=AsyncMock)
+        self.repository = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pro = User(id=1, email="pro@example.com", plan="pro")
+        self.user_cache.get.return_value = self.pro
+        self.repository.get_user_by_email.return_value = None
+        self.token = jwt_manager.create_token({"sub": "pro@example.com"}, "refresh_token")
+
+    async def test_keys_on_the_token_subject(self):
+        request = make_request(token=self.token)
+        self.assertEqual(await user_identifier(request), "user:pro@example.com:/api/contacts/")
+        self.assertEqual(request.state.rate_limit_plan, "pro")
+        self.user_cache.get.assert_awaited_once_with("pro@example.com")
+
+    async def test_anonymous_and_invalid_tokens_key_on_the_address(self):
+        self.assertEqual(await user_identifier(make_request()), "10.0.0.1:/api/contacts/")
+        request = make_request(token="not-a-token")
+        self.assertEqual(await user_identifier(request), "10.0.0.1:/api/contacts/")
+        self.assertFalse(hasattr(request.state, "rate_limit_plan"))
+        self.user_cache.get.assert_not_awaited()
+
+    async def test_path_parameters_share_the_budget_of_their_route(self):
+        route = APIRoute("/contacts/{contact_id}", lambda contact_id: None)
+        request = make_request(path="/contacts/1", token=self.token, route=route)
+        self.assertEqual(await user_identifier(request), "user:pro@example.com:/contacts/{contact_id}")
+        self.assertEqual(await user_identifier(make_request(path="/contacts/1", route=route)),
+                         "10.0.0.1:/contacts/{contact_id}")
+        limiter = HybridRateLimiter(times=2, seconds=60, lease=1, identifier=user_identifier)
+        limiter.plans = {"free": 1, "pro": 3}
+        admitted = 0
+        for contact_id in range(1, 11):
+            try:
+                await limiter(make_request(path=f"/contacts/{contact_id}", token=self.token, route=route), Response())
+                admitted += 1
+            except HTTPException:
+                pass
+        self.assertEqual(admitted, 6)
+
+    async def test_one_budget_per_user_across_addresses(self):
+        limiter = HybridRateLimiter(times=2, seconds=60, lease=1, identifier=user_identifier)
+        limiter.plans = {"free": 1, "pro": 3}
+        admitted = 0
+        for host in range(10):
+            try:
+                await limiter(make_request(host=f"10.0.2.{host}", token=self.token), Response())
+                admitted += 1
+            except HTTPException:
+                pass
+        self.assertEqual(admitted, 6)
+        # Another user behind the same address still has a budget.
+        self.user_cache.get.return_value = None
+        other = jwt_manager.create_token({"sub": "free@example.com"}, "refresh_token")
+        await limiter(make_request(host="10.0.2.0", token=other), Response(), AsyncMock())
+
+    async def test_uncached_users_get_their_plan_from_the_database(self):
+        limiter = HybridRateLimiter(times=2, seconds=60, lease=1, identifier=user_identifier)
+        limiter.plans = {"free": 1, "pro": 3}
+        db = AsyncMock()
+        self.user_cache.get.return_value = None
+        self.repository.get_user_by_email.return_value = self.pro
+        self.user_cache.generation.return_value = "g1"
+        admitted = 0
+        for attempt in range(10):
+            if attempt == 2:
+                self.user_cache.get.return_value = self.pro
+            try:
+                await limiter(make_request(token=self.token), Response(), db)
+                admitted += 1
+            except HTTPException:
+                pass
+        # Cached or not, the user has one budget of the pro limit.
+        self.assertEqual(admitted, 6)
+        self.repository.get_user_by_email.assert_awaited_with("pro@example.com", db)
+        self.assertEqual(self.repository.get_user_by_email.await_count, 2)
+        self.user_cache.set.assert_awaited_with(self.pro, "g1")
+        self.assertEqual(len(self.redis.store), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+"""
+Runs the background jobs queued by the API: verification emails and avatar processing.
+
+    python worker.py
+
+Job concurrency per queue is set with JOBS_CONCURRENCY. SIGINT or SIGTERM stops taking new jobs,
+finishes the running ones and delivers the emails already handed to the mailer.
+"""
+import asyncio
+import logging
+import signal
+
+from src.conf.config import settings
+from src.database.db import redis_sessionmanager, sessionmanager
+from src.services import avatars, email  # noqa: F401 - registers the job handlers
+from src.services.jobs import Worker, job_queue
+from src.services.mailer import mailer
+
+
+async def main():
+    worker = Worker(job_queue, settings.jobs_concurrency)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    sessionmanager.start()
+    mailer.start()
+    try:
+        await worker.run()
+    finally:
+        await mailer.stop()
+        await sessionmanager.close()
+        await redis_sessionmanager.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())